@@ -10,6 +10,7 @@ from getmac import get_mac_address as gma
 from typing import Dict, List, Any
 from hashlib import sha256
 from fl_main.lib.util.states import ClientState, IDPrefix
+from fl_main.lib.util.model_file import write_model_file, read_model_file, is_model_file
 
 
 def set_config_file(config_type: str) -> str:
@@ -143,23 +144,27 @@ def save_model_file(data_dict: Dict[str, Any],
     :param performance_dict: Dict[str,float] - each entry shows a pair of a model id and its performance
     :return:
     """
-    data_dict['performance'] = performance_dict
+    meta_data = {k: v for k, v in data_dict.items() if k != 'models'}
+    meta_data['performance'] = performance_dict
 
-    fname = f'{path}/{name}'
-    with open(fname, 'wb') as f:
-        pickle.dump(data_dict, f)
+    write_model_file(f'{path}/{name}', data_dict['models'], meta_data)
 
 
 def load_model_file(path: str, name: str) -> (Dict[str, Any], Dict[str, float]):
     """
-    Read a local model file and return the unpickled models
+    Read a local model file; the models are memory-mapped (see model_file).
+    Files written in the older pickle format are still readable.
     :param path: str - path to the directory
     :param name: str - model file name
     :return: Dict[str,np.array] - models
     """
     fname = f'{path}/{name}'
-    with open(fname, 'rb') as f:
-        data_dict = pickle.load(f)
+    if is_model_file(fname):
+        models, data_dict = read_model_file(fname)
+        data_dict['models'] = models
+    else:
+        with open(fname, 'rb') as f:
+            data_dict = pickle.load(f)
 
     performance_dict = data_dict.pop('performance')
 
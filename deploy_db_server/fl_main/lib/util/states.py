@@ -41,6 +41,20 @@ class DBMsgType(Enum):
     get_barrier_status = 10
     update_barrier_state = 11
     reset_barrier = 12
+    # Long-lived connection: the DB pushes DBEventType messages on it
+    subscribe = 13
+
+class DBEventType(IntEnum):
+    """
+    Events pushed by the database to its subscribers
+    Event format: [event_type, payload...]
+    """
+    snapshot = 0  # [agents_count, (agg_id, agg_ip, agg_socket) or None, barrier_status, aggregator_ready]
+    agent_registered = 1  # [agent_id, agents_count]
+    aggregator_elected = 2  # [agg_id, agg_ip, agg_socket]
+    aggregator_ready = 3  # [agg_id, agg_ip, agg_socket] - servers listening
+    aggregator_cleared = 4  # []
+    barrier_state_changed = 5  # [state]
 
 class AgentMsgType(Enum):
     """
@@ -50,6 +64,7 @@ class AgentMsgType(Enum):
     update = 1
     polling = 2
     recall_upload = 3
+    round_query = 4  # cheap round check while training (same layout as polling)
 
 class AggMsgType(Enum):
     """
@@ -60,7 +75,17 @@ class AggMsgType(Enum):
     ack = 2
     rotation = 3
     termination = 4
+    weights_request = 5
+    round_info = 6  # reply to round_query
     
+class TransferMsgType(Enum):
+    """
+    Control frames of the chunked (resumable) transfer protocol used by
+    communication_handler for payloads larger than one chunk
+    """
+    header = 0
+    ack = 1
+
 class RotationMSGLocation(IntEnum):
     msg_type = 0
     new_aggregator_id = 1
@@ -88,6 +113,7 @@ class ParticipateMSGLocation(IntEnum):
     agent_ip = 9
     agent_name = 10
     round = 11
+    manifest = 12
 
 class ParticipateConfirmationMSGLocation(IntEnum):
     """
@@ -102,6 +128,7 @@ class ParticipateConfirmationMSGLocation(IntEnum):
     exch_socket = 6
     recv_socket = 7
     aggregator_ip = 8
+    round_budget = 9  # seconds left until the round deadline (None if unknown)
 
 class DBPushMsgLocation(IntEnum):
     """
@@ -126,6 +153,7 @@ class GMDistributionMsgLocation(IntEnum):
     model_id = 2
     round = 3
     global_models = 4
+    round_budget = 5  # seconds left until the round deadline (None if unknown)
 
 class ModelUpMSGLocation(IntEnum):
     """
@@ -137,6 +165,15 @@ class ModelUpMSGLocation(IntEnum):
     lmodels = 3
     gene_time = 4
     meta_data = 5
+    round = 6  # round the models were trained for (None from older agents)
+
+class UploadAckMSGLocation(IntEnum):
+    """
+    index indicator to read the aggregator's reply to a model upload
+    """
+    msg_type = 0
+    model_id = 1
+    duplicate = 2  # True if the upload had already been received
 
 class PollingMSGLocation(IntEnum):
     """
@@ -146,6 +183,13 @@ class PollingMSGLocation(IntEnum):
     round = 1
     agent_id = 2
 
+class RoundInfoMSGLocation(IntEnum):
+    """
+    index indicator to a round info message from aggregator
+    """
+    msg_type = 0
+    round = 1
+
 class RecallUpMSGLocation(IntEnum):
     """
     index indicator to recall upload message from agent
@@ -162,4 +206,20 @@ class TerminationMsgLocation(IntEnum):
     msg_type = 0
     reason = 1
     final_round = 2
-    final_recall = 3
\ No newline at end of file
+    final_recall = 3
+
+class TransferHeaderMsgLocation(IntEnum):
+    """
+    index indicator to read a chunked transfer header
+    """
+    msg_type = 0
+    transfer_id = 1
+    total_size = 2
+
+class TransferAckMsgLocation(IntEnum):
+    """
+    index indicator to read a chunked transfer acknowledgement
+    """
+    msg_type = 0
+    transfer_id = 1
+    offset = 2
@@ -1,4 +1,4 @@
-import pickle
+import asyncio
 import logging
 from logging.handlers import RotatingFileHandler
 import time
@@ -8,7 +8,8 @@ from typing import Any, List
 
 from .sqlite_db import SQLiteDBHandler
 from fl_main.lib.util.helpers import generate_id, read_config, set_config_file
-from fl_main.lib.util.states import DBMsgType, DBPushMsgLocation, ModelType
+from fl_main.lib.util.model_file import write_model_file
+from fl_main.lib.util.states import DBMsgType, DBEventType, DBPushMsgLocation, ModelType
 from fl_main.lib.util.communication_handler import init_db_server, send_websocket, receive 
 
 class PseudoDB:
@@ -47,6 +48,13 @@ class PseudoDB:
         if not os.path.exists(self.db_model_path):
             os.makedirs(self.db_model_path)
 
+        # Open subscriptions (agents waiting for registrations/elections):
+        # events are pushed to them instead of being polled
+        self.subscribers = set()
+        # The current aggregator announced its servers are listening
+        # (update_aggregator); sent in the snapshot to new subscribers
+        self.aggregator_ready = False
+
 
     async def handler(self, websocket, path):
         """
@@ -64,7 +72,12 @@ class PseudoDB:
         # Extract the message type
         msg_type = msg[0] if isinstance(msg, list) and len(msg) > 0 else None
 
+        if msg_type == DBMsgType.subscribe.value:
+            await self._serve_subscription(websocket)
+            return
+
         reply = []
+        event = None  # pushed to the subscribers once the sender got its reply
         
         if msg_type == DBMsgType.push.value:  # models
             logging.info(f'--- Model pushed: {msg[int(DBPushMsgLocation.model_type)]} ---')
@@ -77,6 +90,7 @@ class PseudoDB:
             logging.info(f'--- Agent registration: {agent_id} at {ip}:{socket} (score: {score}) ---')
             self.dbhandler.upsert_agent(agent_id, ip, socket, score)  # Pasar score a la DB
             reply.append('registered')
+            event = [DBEventType.agent_registered.value, agent_id, len(self.dbhandler.get_all_agents())]
             
         elif msg_type == DBMsgType.get_aggregator.value:  # get current aggregator
             logging.info(f'--- Get current aggregator request ---')
@@ -118,7 +132,9 @@ class PseudoDB:
                 
                 if winner_ip:
                     self.dbhandler.update_current_aggregator(winner_id, winner_ip, winner_socket)
+                    self.aggregator_ready = False
                     reply = ['elected', winner_id, winner_ip, winner_socket, scores[winner_id]]
+                    event = [DBEventType.aggregator_elected.value, winner_id, winner_ip, winner_socket]
                     logging.info(f'   Aggregator elected: {winner_ip}:{winner_socket}')
                 else:
                     reply = ['election_failed', 'winner_not_found']
@@ -134,7 +150,9 @@ class PseudoDB:
                 agent_id, aggr_ip, aggr_socket = msg[1], msg[2], msg[3]
                 logging.info(f'--- Aggregator socket update: {aggr_ip}:{aggr_socket} ---')
                 self.dbhandler.update_current_aggregator(agent_id, aggr_ip, aggr_socket)
+                self.aggregator_ready = True
                 reply = ['updated']
+                event = [DBEventType.aggregator_ready.value, agent_id, aggr_ip, aggr_socket]
                 logging.info(f'   Updated aggregator to FL socket: {aggr_ip}:{aggr_socket}')
             else:
                 reply = ['update_failed', 'invalid_message']
@@ -143,7 +161,9 @@ class PseudoDB:
         elif msg_type == DBMsgType.clear_aggregator.value:  # clear stale aggregator
             logging.info(f'--- Clear aggregator request ---')
             self.dbhandler.clear_current_aggregator()
+            self.aggregator_ready = False
             reply = ['cleared']
+            event = [DBEventType.aggregator_cleared.value]
             logging.info(f'   Stale aggregator cleared from DB')
             
         elif msg_type == DBMsgType.get_agents_count.value:  # get count of registered agents
@@ -173,6 +193,7 @@ class PseudoDB:
             logging.info(f'--- Init barrier: round={round_num}, threshold={threshold}, state={state} ---')
             self.dbhandler.init_round_barrier(round_num, threshold, aggregator_id, state)
             reply = ['barrier_initialized']
+            event = [DBEventType.barrier_state_changed.value, state]
             
         elif msg_type == DBMsgType.notify_barrier.value:  # agente notifica llegada a barrera
             # msg format: [msg_type, agent_id, round_num, phase]
@@ -194,6 +215,7 @@ class PseudoDB:
             logging.info(f'--- Update barrier state: {new_state} ---')
             self.dbhandler.update_barrier_state(new_state)
             reply = ['barrier_state_updated']
+            event = [DBEventType.barrier_state_changed.value, new_state]
             
         elif msg_type == DBMsgType.reset_barrier.value:  # resetear agentes listos en barrera
             logging.debug(f'--- Reset barrier request ---')
@@ -208,6 +230,46 @@ class PseudoDB:
         # reply to the sender
         await send_websocket(reply, websocket)
 
+        if event is not None:
+            await self._publish(event)
+
+    async def _serve_subscription(self, websocket):
+        """
+        Keep a subscriber connection open: send the current snapshot,
+        then events are pushed by _publish until the subscriber leaves
+        :param websocket:
+        :return:
+        """
+        self.subscribers.add(websocket)
+        logging.info(f'--- Subscriber joined ({len(self.subscribers)} open) ---')
+        try:
+            await send_websocket([DBEventType.snapshot.value,
+                                  len(self.dbhandler.get_all_agents()),
+                                  self.dbhandler.get_current_aggregator(),
+                                  self.dbhandler.get_barrier_status(),
+                                  self.aggregator_ready], websocket)
+            await websocket.wait_closed()
+        finally:
+            self.subscribers.discard(websocket)
+            logging.info(f'--- Subscriber left ({len(self.subscribers)} open) ---')
+
+    async def _publish(self, event: List[Any]):
+        """
+        Push an event to every open subscription; a dead subscriber
+        only loses its own delivery
+        :param event: [DBEventType, payload...]
+        :return:
+        """
+        if not self.subscribers:
+            return
+        logging.debug(f'Publishing {DBEventType(event[0]).name} to {len(self.subscribers)} subscribers')
+        subscribers = list(self.subscribers)
+        results = await asyncio.gather(*[send_websocket(event, ws) for ws in subscribers],
+                                       return_exceptions=True)
+        for ws, res in zip(subscribers, results):
+            if isinstance(res, Exception):
+                self.subscribers.discard(ws)
+
 
     def _push_all_data_to_db(self, msg: List[Any]):
         """
@@ -223,8 +285,7 @@ class PseudoDB:
         model_id = msg[int(DBPushMsgLocation.model_id)]
         models = msg[int(DBPushMsgLocation.models)]
         fname = f'{self.db_model_path}/{model_id}.binaryfile'
-        with open(fname, 'wb') as f:
-            pickle.dump(models, f)
+        write_model_file(fname, models, {'model_id': model_id})
 
     def _parse_message(self, msg: List[Any]):
         """
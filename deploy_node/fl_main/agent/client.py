@@ -4,17 +4,21 @@ import logging
 import sys
 import os
 from typing import Dict, Any
-from threading import Thread
+from threading import Thread, Condition, Event
+from concurrent.futures import ThreadPoolExecutor
 import subprocess, sys
 import shutil
 
-from fl_main.lib.util.communication_handler import init_client_server, send, receive
+from fl_main.lib.util.data_struc import ModelMailbox, Outbox, OutboxEntry
+from fl_main.lib.util.communication_handler import init_client_server, send, send_resumable, receive
 from fl_main.lib.util.helpers import read_config, init_loop, \
      save_model_file, load_model_file, read_state, write_state, generate_id, \
      set_config_file, get_ip, compatible_data_dict_read, generate_model_id, \
-     create_data_dict_from_models, create_meta_data_dict
-from fl_main.lib.util.states import IDPrefix, ClientState, AggMsgType, ParticipateConfirmationMSGLocation, GMDistributionMsgLocation, PollingMSGLocation, RotationMSGLocation
-from fl_main.lib.util.messengers import generate_lmodel_update_message, generate_agent_participation_message, generate_polling_message
+     create_data_dict_from_models, create_meta_data_dict, generate_model_manifest
+from fl_main.lib.util.states import IDPrefix, ClientState, AggMsgType, ParticipateMSGLocation, ParticipateConfirmationMSGLocation, GMDistributionMsgLocation, RotationMSGLocation, UploadAckMSGLocation, RoundInfoMSGLocation
+from fl_main.lib.util.messengers import generate_lmodel_update_message, generate_agent_participation_message, generate_polling_message, generate_round_query_message, \
+     generate_recall_up
+from fl_main.agent.db_watcher import DBWatcher
 from fl_main.lib.util.helpers import write_config,set_config_file,read_config
 class Client:
     """
@@ -22,28 +26,39 @@ class Client:
     between Agent's ML logic and an aggregator
     """
 
-    def __init__(self):
+    def __init__(self, agent_name: str = None, can_host_aggregator: bool = True, agent_id: str = None):
+        """
+        :param agent_name: name of a hosted agent (agent host); by default
+            'default_agent', or the command line args in simulation mode
+        :param can_host_aggregator: False for the hosted agents that share
+            the node with its lead client: only the lead takes the
+            aggregator role when this node's IP is elected
+        :param agent_id: ID of a hosted agent; by default the node's
+            persisted ID (setups/.agent_id)
+        """
 
-        time.sleep(2)
         logging.info(f"--- Agent initialized ---")
 
         self.agent_name = 'default_agent'
 
         # Unique ID in the system
-        self.id = generate_id()
+        self.id = agent_id if agent_id is not None else generate_id()
 
         # Getting IP Address of the agent itself
         self.agent_ip = get_ip()
 
         # Check command line argvs
         self.simulation_flag = False
-        if len(sys.argv) > 1:
+        if len(sys.argv) > 1 and agent_name is None:
             # if sys.argv[1] == '1', it's in simulation mode
             self.simulation_flag = bool(int(sys.argv[1]))
 
         # Read config
         config_file = set_config_file("agent")
         self.config = read_config(config_file)
+        # The aggregator tells agents apart by name: agents sharing a host
+        # (e.g. net_harness) need their own
+        self.agent_name = self.config.get('agent_name', self.agent_name)
         
         # Read DB config from agent config (db_ip and db_port are in config_agent.json)
         self.db_ip = self.config.get('db_ip', '127.0.0.1')
@@ -65,6 +80,10 @@ class Client:
             self.exch_socket = int(sys.argv[2])
             self.agent_name = sys.argv[3]
 
+        if agent_name is not None:
+            self.agent_name = agent_name
+        self.can_host_aggregator = can_host_aggregator
+
         # Local file location        
         self.model_path = f'{self.config["model_path"]}/{self.agent_name}'
 
@@ -99,14 +118,62 @@ class Client:
         self.gmfile = self.config['global_model_file_name']
         self.statefile = self.config['state_file_name']
 
+        # In-memory client state: transitions wake the waiters right away.
+        # The state file is only written as a crash-recovery journal if enabled.
+        self.state_journal = bool(self.config.get('state_journal', 0))
+        self._state_cond = Condition()
+        self._state_seq = 0
+        self._state = self._recover_state()
+
+        # Completed uploads (guarded by _state_cond) so the engine can time them
+        self.uploads_completed = 0
+        self.last_upload_duration = 0.0
+
+        # Uploads are kept on disk until the aggregator acknowledges them and
+        # retried with backoff, so a dropped link or a restart loses no update
+        self.outbox = Outbox(f'{self.model_path}/outbox',
+                             float(self.config.get('outbox_backoff', 1.0)),
+                             float(self.config.get('outbox_max_backoff', 30.0)))
+
+        # Global/local models are handed over in memory; writing them to the
+        # model files is optional and done in the background
+        self.mailbox = ModelMailbox()
+        self.persist_models = bool(self.config.get('persist_models', 0))
+        self._persist_executor = ThreadPoolExecutor(max_workers=1) if self.persist_models else None
+
+        # Period of the polling / state check while waiting for global models
+        self.polling_interval = float(self.config.get('polling_interval', 5))
+
         # Aggregation round - later updated by the info from the aggregator
         self.round = 0
+
+        # ID of the last global models handed to the engine (evaluation cache key)
+        self.global_model_id = None
+
+        # Deadline of the current round (local clock), from the aggregator
+        self.round_deadline = None
+
+        # Initial models still being prepared by the engine (fast start):
+        # joining the aggregator waits for them, registration does not
+        self._initial_models_future = None
+
+        # Set when newer global models arrive while the engine is training,
+        # so it can stop between batches instead of finishing stale work
+        self.training_cancel = Event()
         
         # Initialization
         self.init_weights_flag = bool(self.config['init_weights_flag'])
 
         # Polling Method
         self.is_polling = bool(self.config['polling'])
+
+        # Aggregator role hosted in this process (no restart on rotation).
+        # Push mode keeps the restart: the push listener and the aggregator
+        # receiver share the same port.
+        self.in_process_roles = bool(self.config.get('in_process_roles', 1)) and self.is_polling
+        self.hosting_aggregator = False
+        self.aggregator_runner = None
+        self._rejoin_pending = False
         
         # Counter for consecutive polling failures (to detect dead aggregator)
         self.polling_failures = 0
@@ -123,8 +190,18 @@ class Client:
         3. Query DB for existing aggregator
         4. If no aggregator exists, trigger election via DB (using ALL registered agents)
         5. Connect to the elected aggregator
+        Waits are driven by DB subscription events (registrations, election,
+        aggregator ready); the timeouts only bound them.
         :return:
         """
+        watcher = DBWatcher(self.db_ip, self.db_socket)
+        await watcher.start()
+        try:
+            await self._participate(watcher)
+        finally:
+            await watcher.stop()
+
+    async def _participate(self, watcher: DBWatcher):
         # Step 1: Register in DB
         my_id, my_score = await self._register_in_db()
         
@@ -138,31 +215,27 @@ class Client:
         else:
             logging.info(f'   📊 Sin límite de agentes (modo dinámico)')
         
-        # Wait in intervals and check DB for registered agents
-        check_interval = 3  # Revisar cada 3 segundos
-        elapsed = 0
-        while elapsed < grace_period:
-            await asyncio.sleep(check_interval)
-            elapsed += check_interval
-            
-            # Query DB for current registered agents count
-            try:
-                from fl_main.lib.util.states import DBMsgType
-                msg = [DBMsgType.get_agents_count.value]
-                resp = await send(msg, self.db_ip, self.db_socket)
-                if resp and len(resp) > 1:
-                    current_count = resp[1]
-                    remaining = grace_period - elapsed
-                    logging.info(f'   ⏱️  [{elapsed}s/{grace_period}s] {current_count} agentes registrados (quedan {remaining}s)')
-                    
-                    # If we reached expected count, can proceed early
-                    if expected_agents > 0 and current_count >= expected_agents:
-                        logging.info(f'   ✅ ¡Todos los {expected_agents} agentes esperados se registraron!')
-                        logging.info(f'   🚀 Continuando antes de tiempo (ahorro: {remaining}s)')
-                        break
-            except Exception as e:
-                logging.warning(f'   ⚠️  No se pudo consultar cantidad de agentes: {e}')
-                # Continuar esperando aunque falle la consulta
+        # Wake up on every registration; leave early once the expected agents
+        # registered or an aggregator is already up
+        start = time.time()
+        while True:
+            seen = watcher.agents_count
+            remaining = grace_period - (time.time() - start)
+            if remaining <= 0:
+                break
+            await watcher.wait_for(lambda w: w.agents_count != seen or w.aggregator_ready, remaining)
+            elapsed = int(time.time() - start)
+            logging.info(f'   ⏱️  [{elapsed}s/{grace_period}s] {watcher.agents_count} agentes registrados')
+
+            if watcher.aggregator_ready:
+                logging.info(f'   🚀 Agregador ya activo en {watcher.aggregator_ip} - continuando')
+                break
+            # If we reached expected count, can proceed early
+            if expected_agents > 0 and watcher.agents_count >= expected_agents:
+                logging.info(f'   ✅ ¡Todos los {expected_agents} agentes esperados se registraron!')
+                logging.info(f'   🚀 Continuando antes de tiempo (ahorro: {grace_period - elapsed}s)')
+                break
+        elapsed = int(time.time() - start)
         
         logging.info(f'✅ Periodo de registro completado ({elapsed}s)')
         
@@ -220,7 +293,7 @@ class Client:
             # IMPORTANT: After election, re-query DB to get the ACTUAL winner
             # This handles race conditions where multiple agents request election
             # NOTE: verify_alive=False because winner hasn't started aggregator yet
-            await asyncio.sleep(2)  # Wait for election to settle
+            await watcher.wait_for(lambda w: w.aggregator is not None, 2)
             actual_agg_ip, actual_agg_socket = await self._discover_aggregator_from_db(verify_alive=False)
             
             if actual_agg_ip:
@@ -229,16 +302,17 @@ class Client:
                 if device_ip == 'CHANGE_ME':
                     device_ip = self.agent_ip
                     
-                if actual_agg_ip == device_ip:
+                if actual_agg_ip == device_ip and self.can_host_aggregator:
                     logging.info(f'🏆 Confirmed: I am the elected aggregator!')
                     self._promote_to_aggregator()
+                    if self.in_process_roles:
+                        self._host_aggregator()
+                        return
                     os._exit(0)  # Exit to restart as aggregator
                 else:
                     logging.info(f'📊 Another node won the election: {actual_agg_ip}:{actual_agg_socket}')
-                    agg_ip, agg_socket = actual_agg_ip, actual_agg_socket
-                    # Wait longer for winner to start aggregator (10 seconds)
-                    logging.info(f'⏳ Waiting 10s for aggregator {agg_ip} to start...')
-                    await asyncio.sleep(10)
+                    agg_ip, agg_socket = await self._wait_aggregator_ready(
+                        watcher, actual_agg_ip, actual_agg_socket)
             else:
                 logging.error('❌ Election failed - cannot proceed')
                 return
@@ -247,32 +321,87 @@ class Client:
         self.aggr_ip = agg_ip
         self.reg_socket = int(agg_socket)
         
+        await self._join_aggregator()
+
+    async def _wait_aggregator_ready(self, watcher: DBWatcher, agg_ip, agg_socket, timeout: float = 10):
+        """
+        Wait until the elected aggregator announces its servers are up
+        :param watcher: DBWatcher - open DB subscription
+        :param agg_ip: elected aggregator IP
+        :param agg_socket: elected aggregator registration socket
+        :param timeout: seconds before trying to join anyway
+        :return: (aggregator_ip, aggregator_socket)
+        """
+        logging.info(f'⏳ Waiting up to {timeout}s for aggregator {agg_ip} to start...')
+        start = time.time()
+        if await watcher.wait_for(lambda w: w.aggregator_ready, timeout):
+            logging.info(f'✅ Aggregator {watcher.aggregator_ip} ready after {time.time() - start:.1f}s')
+            return watcher.aggregator_ip, watcher.aggregator_socket
+        return agg_ip, agg_socket
+
+    async def _join_aggregator(self):
+        """
+        Send the participation message to the aggregator at self.aggr_ip
+        and process the welcome message
+        :return:
+        """
         # Step 4: Connect to aggregator (existing logic)
         # Read the local models to tell the structure to the aggregator
         # (not necessarily trained)
-        data_dict, performance_dict = load_model_file(self.model_path, self.lmfile)
+        if self._initial_models_future is not None:
+            await asyncio.wrap_future(self._initial_models_future)
+        data_dict, performance_dict = self.load_models(self.lmfile)
 
         _, gene_time, models, model_id = compatible_data_dict_read(data_dict)
 
         logging.debug(models)
 
+        # Only the manifest (names/shapes/dtypes) is sent; the weights go
+        # later if the aggregator asks for them to initialize its models
         msg = generate_agent_participation_message(
-                self.agent_name, self.id, model_id, models, self.init_weights_flag, self.simulation_flag,
-                self.exch_socket, gene_time, performance_dict, self.agent_ip)
+                self.agent_name, self.id, model_id, None, self.init_weights_flag, self.simulation_flag,
+                self.exch_socket, gene_time, performance_dict, self.agent_ip,
+                self.round, generate_model_manifest(models))
         # Send participation message with retries if aggregator doesn't reply
         # Aggressively retry registration since aggregator may be still
         # starting. Increase retries to tolerate startup races in compose.
         max_retries = 12
+        # Rounds of retries kept on an aggregator that answers but does not
+        # get the initial weights, before treating it as dead
+        max_join_cycles = 3
         resp = None
-        for attempt in range(1, max_retries + 1):
-            resp = await send(msg, self.aggr_ip, self.reg_socket)
-            logging.debug(msg)
-            logging.info(f"--- Init Response (attempt {attempt}): {resp} ---")
-            if resp is None:
-                # Backoff before retrying (increasing delay)
-                await asyncio.sleep(min(1 * attempt, 10))
-                continue
-            break
+        for cycle in range(1, max_join_cycles + 1):
+            # Whether the last attempt got an answer from the aggregator
+            aggregator_answered = False
+            for attempt in range(1, max_retries + 1):
+                msg[int(ParticipateMSGLocation.lmodels)] = None
+                resp = await send(msg, self.aggr_ip, self.reg_socket)
+                logging.debug(msg)
+                logging.info(f"--- Init Response (attempt {attempt}): {resp} ---")
+                aggregator_answered = resp is not None
+                if resp is None:
+                    # Backoff before retrying (increasing delay)
+                    await asyncio.sleep(min(1 * attempt, 10))
+                    continue
+                if resp[int(ParticipateConfirmationMSGLocation.msg_type)] == AggMsgType.weights_request:
+                    logging.info('--- Aggregator requested initial weights, sending local models ---')
+                    msg[int(ParticipateMSGLocation.lmodels)] = models
+                    resp = await send_resumable(msg, self.aggr_ip, self.reg_socket)
+                    logging.info(f"--- Init Response (with weights): {resp} ---")
+                    if resp is None:
+                        # The aggregator is alive (it just asked for the weights):
+                        # register again instead of treating it as dead
+                        logging.warning('--- Initial weights not delivered, registering again ---')
+                        await asyncio.sleep(min(1 * attempt, 10))
+                        continue
+                break
+
+            if resp is not None or not aggregator_answered or cycle == max_join_cycles:
+                break
+            # Only the weights upload kept failing: keep the aggregator and retry
+            logging.warning(f'Aggregator {self.aggr_ip}:{self.reg_socket} answered but the initial '
+                            f'weights could not be delivered - retrying to join ({cycle}/{max_join_cycles})')
+            await asyncio.sleep(10)
 
         if resp is None:
             logging.warning('No response from aggregator after retries')
@@ -289,22 +418,30 @@ class Client:
                 device_ip = self.agent_ip
             
             # Re-register with a new score and trigger election
+            watcher = DBWatcher(self.db_ip, self.db_socket)
+            await watcher.start()
             my_id, my_score = await self._register_in_db()
             scores = {my_id: my_score}
             await self._elect_aggregator_via_db(scores)
             
             # Check who won
-            await asyncio.sleep(2)
+            await watcher.wait_for(lambda w: w.aggregator is not None, 2)
             new_agg_ip, new_agg_socket = await self._discover_aggregator_from_db(verify_alive=False)
             
-            if new_agg_ip == device_ip:
+            if new_agg_ip == device_ip and self.can_host_aggregator:
+                await watcher.stop()
                 logging.info('🏆 I won the re-election - promoting to aggregator!')
                 self._promote_to_aggregator()
+                if self.in_process_roles:
+                    self._host_aggregator()
+                    return
                 os._exit(0)
             else:
                 logging.info(f'📊 New aggregator elected: {new_agg_ip}:{new_agg_socket}')
                 # Wait for new aggregator to start, then retry participate
-                await asyncio.sleep(10)
+                new_agg_ip, new_agg_socket = await self._wait_aggregator_ready(
+                    watcher, new_agg_ip, new_agg_socket)
+                await watcher.stop()
                 self.aggr_ip = new_agg_ip
                 self.reg_socket = int(new_agg_socket)
                 # Recursive retry (limited by role_supervisor restarts)
@@ -341,10 +478,31 @@ class Client:
         once the training is done
         :return:
         """
+        loop = asyncio.get_event_loop()
+        seq = -1
         while True:
-            # Periodically check the state
-            await asyncio.sleep(5)
-            state = read_state(self.model_path, self.statefile)
+            # Wake up on every state transition, every polling_interval,
+            # or when the next outbox retry is due
+            timeout = self.polling_interval
+            retry_in = self.outbox.next_attempt_in()
+            if retry_in is not None:
+                timeout = min(timeout, retry_in)
+            state, seq = await loop.run_in_executor(
+                None, self.wait_transition, seq, timeout)
+
+            if self.hosting_aggregator:
+                # This node is the aggregator: no agent traffic until demoted
+                continue
+
+            if self._rejoin_pending:
+                # Rotation lost (or aggregator role left): join the new aggregator
+                self._rejoin_pending = False
+                await self._join_aggregator()
+                continue
+
+            if state != ClientState.sending and len(self.outbox) > 0:
+                # Retry the uploads not acknowledged yet
+                await self.flush_outbox()
 
             if state == ClientState.sending: 
                 # Ready to send the local model
@@ -359,8 +517,12 @@ class Client:
                     logging.info(f'--- Waiting for Global Model ---')
 
             elif state == ClientState.training:
-                # Local model is being trained, do nothing
-                logging.info(f'--- Training is happening ---')
+                # Local model is being trained; in polling mode nobody
+                # pushes a newer global model, so ask for the round
+                if self.is_polling == True:
+                    await self.check_round()
+                else:
+                    logging.info(f'--- Training is happening ---')
 
             elif state == ClientState.gm_ready:
                 # Global model has been received, do nothing
@@ -403,7 +565,7 @@ class Client:
             if device_ip == 'CHANGE_ME':
                 device_ip = self.agent_ip
             
-            i_am_winner = (device_ip == winner_ip)
+            i_am_winner = (device_ip == winner_ip) and self.can_host_aggregator
             logging.info(f'DEBUG: My IP is {device_ip}, winner IP is {winner_ip}, I am winner? {i_am_winner}')
 
             # Persist configs: default set everyone to agent; aggregator will set itself next
@@ -413,7 +575,7 @@ class Client:
                 cfg_agent['role'] = 'agent'
                 cfg_agent['aggr_ip'] = winner_ip
                 # NOTE: reg_socket must stay at 8765 (registration port), don't change it
-                write_config(cfg_agent_file, cfg_agent)
+                self._write_node_config(cfg_agent_file, cfg_agent)
 
                 # Skip aggregator config file - we don't use it anymore
             except Exception as e:
@@ -439,6 +601,13 @@ class Client:
                 logging.info('📡 Stayed as agent after rotation.')
             return
 
+        if msg_type == AggMsgType.termination:
+            from fl_main.lib.util.states import TerminationMsgLocation
+            logging.warning(f'🛑 TRAINING TERMINATED by aggregator')
+            logging.info(f'Reason: {gm_msg[int(TerminationMsgLocation.reason)]}')
+            logging.info(f'Final round: {gm_msg[int(TerminationMsgLocation.final_round)]}')
+            logging.info('Agent exiting due to training termination...')
+            os._exit(0)
 
         self.save_model_from_message(gm_msg, GMDistributionMsgLocation)
     
@@ -446,7 +615,10 @@ class Client:
         logging.info(f'--- Polling to see if there is any update ---')
 
         msg = generate_polling_message(self.round, self.id)
-        resp = await send(msg, self.aggr_ip, self.msend_socket)
+        # Polling is idempotent: a global model cut off mid-download is
+        # requested again and resumes from the bytes already received
+        resp = await send_resumable(msg, self.aggr_ip, self.msend_socket, max_retries=1,
+                                    resend_after_delivery=True)
         # `send` can return None on connection failure or when no reply is sent.
         if resp is None:
             self.polling_failures += 1
@@ -498,7 +670,7 @@ class Client:
                 if device_ip == 'CHANGE_ME':
                     device_ip = self.agent_ip
                 
-                i_am_winner = (device_ip == winner_ip)
+                i_am_winner = (device_ip == winner_ip) and self.can_host_aggregator
                 logging.info(f'DEBUG: My IP is {device_ip}, winner IP is {winner_ip}, I am winner? {i_am_winner}')
                 
                 # Update configs
@@ -519,12 +691,22 @@ class Client:
                         # NOTE: reg_socket must stay at 8765 (registration port), don't change it
                         logging.info(f'📡 Updated aggregator address to {winner_ip}')
                     
-                    write_config(cfg_agent_file, cfg_agent)
+                    self._write_node_config(cfg_agent_file, cfg_agent)
                     
                     # Skip aggregator config file - we don't use it anymore
                 except Exception as e:
                     logging.error(f'Failed to persist rotation config: {e}')
                 
+                # Switch roles in this process if enabled
+                if self.in_process_roles:
+                    if i_am_winner:
+                        self._host_aggregator()
+                    else:
+                        self.aggr_ip = winner_ip
+                        self._rejoin_pending = True
+                        logging.info(f'This agent lost rotation. Re-registering with new aggregator at {winner_ip}')
+                    return
+
                 # If promoted, exit to let supervisor restart as aggregator
                 if i_am_winner:
                     logging.info('Exiting to restart as aggregator...')
@@ -546,6 +728,27 @@ class Client:
         except Exception as e:
             logging.error(f'Unexpected polling response format: {e} | resp={resp}')
 
+    async def check_round(self):
+        """
+        Ask the aggregator for its round while training. If it moved past
+        the round being trained, fetch the newer global model through the
+        regular polling path, which cancels the stale training.
+        """
+        logging.info(f'--- Training is happening (round {self.round}) ---')
+
+        msg = generate_round_query_message(self.round, self.id)
+        resp = await send(msg, self.aggr_ip, self.msend_socket)
+        # Aggregators without round queries (or unreachable ones) leave the
+        # training alone; waiting_gm polling handles failures
+        if not isinstance(resp, list) or len(resp) <= int(RoundInfoMSGLocation.round) \
+                or resp[int(RoundInfoMSGLocation.msg_type)] != AggMsgType.round_info:
+            return
+
+        aggr_round = resp[int(RoundInfoMSGLocation.round)]
+        if aggr_round > self.round:
+            logging.info(f'--- Aggregator is at round {aggr_round}, training for round {self.round} is stale ---')
+            await self.process_polling()
+
 
     # Starting FL client functions
     def start_fl_client(self):
@@ -557,26 +760,41 @@ class Client:
             self.start_wait_model_server()
         self.start_model_exchange_server()
 
+    async def run_fl_client(self):
+        """
+        Register and run the model exchange routine in the running event
+        loop, so several clients (agent host) share one loop. Global models
+        are polled: hosted agents share the node's IP and push socket.
+        :return:
+        """
+        if not self.is_polling:
+            self.is_polling = True
+            self.in_process_roles = bool(self.config.get('in_process_roles', 1))
+        await self.participate()
+        self.agent_running = True
+        await self.model_exchange_routine()
+
     def register_client(self):
         """
         Register an agent in aggregator
         """
-        time.sleep(0.5)
         asyncio.get_event_loop().run_until_complete(self.participate())
     
     def start_wait_model_server(self):
         """
         Start a thread for waiting for global models
+        and return once it is listening
         """
-        time.sleep(0.5)
-        th = Thread(target = init_client_server, args=[self.wait_models, self.agent_ip, self.exch_socket])
+        ready = Event()
+        th = Thread(target = init_client_server, args=[self.wait_models, self.agent_ip, self.exch_socket, ready])
         th.start()
+        if not ready.wait(10):
+            logging.warning(f'--- Model server on {self.agent_ip}:{self.exch_socket} not listening yet ---')
 
     def start_model_exchange_server(self):
         """
         Start a thread for model exchange routine
         """
-        time.sleep(0.5)
         self.agent_running = True
         th = Thread(target = init_loop, args=[self.model_exchange_routine()])
         th.start()
@@ -589,114 +807,258 @@ class Client:
                         msg[int(MSG_LOC.global_models)], msg[int(MSG_LOC.aggregator_id)])
         self.round = msg[int(MSG_LOC.round)]
 
-        # Save the received cluster global models to the local file
-        save_model_file(data_dict, self.model_path, self.gmfile)
+        # Round deadline on the local clock (older aggregators don't send it)
+        loc = int(MSG_LOC.round_budget)
+        budget = msg[loc] if len(msg) > loc else None
+        self.round_deadline = time.time() + budget if budget is not None else None
+
+        # Hand the received cluster global models over to the training loop
+        self.store_models(self.gmfile, data_dict)
         logging.info(f'--- Global Models Saved ---')
+
+        # Local training on the previous global models would be discarded
+        if self.read_state() == ClientState.training:
+            self.training_cancel.set()
+            logging.info(f'--- Newer global models: cancelling the local training ---')
         
         # State transition to gm_ready
         self.tran_state(ClientState.gm_ready)
         logging.info(f'--- Client State is now gm_ready ---')
     
 
+    # Model handoff between the comm. thread and the training loop
+    def store_models(self, name: str, data_dict: Dict[str, Any], meta_data_dict: Dict[str, Any] = None):
+        """
+        Put a set of models in the mailbox (by reference) and, if
+        persist_models is enabled, write the model file in the background
+        :param name: model file name used as the mailbox slot
+        :param data_dict: Dict - model_id, models, ...
+        :param meta_data_dict: Dict - performance / metrics
+        :return:
+        """
+        self.mailbox.put(name, data_dict, meta_data_dict)
+        if self.persist_models:
+            self._persist_executor.submit(save_model_file, data_dict,
+                                          self.model_path, name, meta_data_dict or dict())
+
+    def load_models(self, name: str) -> (Dict[str, Any], Dict[str, Any]):
+        """
+        Get a set of models from the mailbox, or from the model file if
+        nothing was handed over in this process yet (e.g. after a restart)
+        :param name: model file name used as the mailbox slot
+        :return: data_dict, performance_dict
+        """
+        entry = self.mailbox.get(name)
+        if entry is not None:
+            return entry
+        return load_model_file(self.model_path, name)
+
     # Read and change the client state
     def read_state(self) -> ClientState:
         """
-        Read the value in the state file specified by model path
-        :return: ClientState - A state indicated in the file
+        Read the current state of the agent
+        :return: ClientState
         """
-        return read_state(self.model_path, self.statefile)
+        with self._state_cond:
+            return self._state
 
     def tran_state(self, state: ClientState):
         """
-        Change the state of the agent
-        State is indicated in local file 'state'
+        Change the state of the agent and wake up every waiter.
+        If state_journal is enabled, the state is also written to the local
+        file 'state' so a restarted agent can recover it.
         :param state: ClientState
         :return:
         """
-        write_state(self.model_path, self.statefile, state)
+        with self._state_cond:
+            self._state = state
+            self._state_seq += 1
+            self._state_cond.notify_all()
+        if self.state_journal:
+            write_state(self.model_path, self.statefile, state)
+
+    def wait_state(self, state: ClientState, timeout: float = None) -> bool:
+        """
+        Block until the agent reaches the given state
+        :param state: ClientState
+        :param timeout: seconds, None to wait forever
+        :return: True if the state was reached
+        """
+        with self._state_cond:
+            return self._state_cond.wait_for(lambda: self._state == state, timeout)
+
+    def wait_transition(self, seq: int, timeout: float = None) -> (ClientState, int):
+        """
+        Block until a transition newer than seq happens (or timeout)
+        :param seq: last transition number seen by the caller
+        :param timeout: seconds, None to wait forever
+        :return: (current state, current transition number)
+        """
+        with self._state_cond:
+            self._state_cond.wait_for(lambda: self._state_seq != seq, timeout)
+            return self._state, self._state_seq
+
+    def _recover_state(self) -> ClientState:
+        """
+        Initial state: the journaled one if enabled and present, waiting_gm otherwise
+        :return: ClientState
+        """
+        if self.state_journal and os.path.exists(f'{self.model_path}/{self.statefile}'):
+            try:
+                state = ClientState(read_state(self.model_path, self.statefile))
+                logging.info(f'--- Client State recovered from journal: {state.name} ---')
+                return state
+            except Exception as e:
+                logging.warning(f'Could not read state journal: {e}')
+        return ClientState.waiting_gm
 
     # Sending models
     async def send_models(self):
-        # Read the models from the local file
-        data_dict, performance_dict = load_model_file(self.model_path, self.lmfile)
+        # Read the models handed over by the training loop
+        data_dict, performance_dict = self.load_models(self.lmfile)
         _, _, models, model_id = compatible_data_dict_read(data_dict)
-        msg = generate_lmodel_update_message(self.id, model_id, models, performance_dict)
-
-        logging.debug(f'Trained Models: {msg}')
+        round = performance_dict.get('round', self.round) if isinstance(performance_dict, dict) else self.round
 
-        await send(msg, self.aggr_ip, self.msend_socket)
-        logging.info('--- Local Models Sent ---')
+        # Into the outbox first: the upload is retried until acknowledged
+        self.outbox.put(OutboxEntry(self.id, model_id, models, performance_dict, round))
 
-        # State transition to waiting_gm
+        # State transition to waiting_gm (a failed upload stays in the outbox)
         self.tran_state(ClientState.waiting_gm)
         logging.info(f'--- Client State is now waiting_gm ---')
 
+        await self.flush_outbox()
+
+    async def flush_outbox(self):
+        """
+        Upload the outbox entries that are due. An entry is removed when the
+        aggregator acknowledges its model ID (also if it was a duplicate),
+        or when the aggregator has already moved past its round.
+        :return:
+        """
+        for entry in self.outbox.drop_older_than(self.round):
+            logging.info(f'--- Outbox: dropping upload {entry.model_id} of round {entry.round} '
+                         f'(aggregator already in round {self.round}) ---')
+
+        for entry in self.outbox.due():
+            msg = generate_lmodel_update_message(self.id, entry.model_id, entry.models,
+                                                 entry.meta_data, entry.round)
+            logging.debug(f'Trained Models: {msg}')
+
+            # Reconnect and resume from the last acknowledged offset if the link drops
+            resp = await send_resumable(msg, self.aggr_ip, self.msend_socket)
+            if resp and resp[int(UploadAckMSGLocation.msg_type)] == AggMsgType.ack \
+                    and len(resp) > int(UploadAckMSGLocation.model_id) \
+                    and resp[int(UploadAckMSGLocation.model_id)] == entry.model_id:
+                self.outbox.remove(entry.model_id)
+                duplicate = len(resp) > int(UploadAckMSGLocation.duplicate) \
+                    and resp[int(UploadAckMSGLocation.duplicate)]
+                logging.info(f'--- Local Models Sent{" (already received)" if duplicate else ""} ---')
+                with self._state_cond:
+                    self.uploads_completed += 1
+                    self.last_upload_duration = time.time() - entry.created
+                    self._state_cond.notify_all()
+            else:
+                delay = self.outbox.failed(entry)
+                logging.warning(f'⚠️  Upload {entry.model_id} not acknowledged '
+                                f'(attempt {entry.attempts}), retrying in {delay:.1f}s')
+
     def send_initial_model(self, initial_models, num_samples=1, perf_val=0.0):
         self.setup_sending_models(initial_models, num_samples, perf_val)
 
-    def send_trained_model(self, models, num_samples, perf_value):
+    def send_initial_model_when_ready(self, future):
+        """
+        Fast start: the engine prepares the initial models (data loading,
+        model build) while the client registers; they are queued as soon as
+        the future completes and joining the aggregator waits for them
+        :param future: concurrent.futures.Future returning the initial models
+        :return:
+        """
+        self._initial_models_future = future
+        future.add_done_callback(
+            lambda f: f.exception() is None and self.send_initial_model(f.result()))
+
+    def send_trained_model(self, models, num_samples, perf_value, metrics: Dict[str, Any] = None):
+        """
+        Queue the trained models for upload.
+        :param metrics: per-round metrics (recall, loss, timings, ...) sent
+            along with the models in the same update message
+        :return: True if the models were queued, False if they were discarded
+        """
         # Check the state in case another global models arrived during the training
         state = self.read_state()
         if state == ClientState.gm_ready:
             # Do nothing: Discard the trained local models and adopt the new global models
             logging.info(f'--- The training was too slow. A new set of global models are available. ---')
+            return False
         else:  # Keep the training results
             # Send models
-            self.setup_sending_models(models, num_samples, perf_value)
+            self.setup_sending_models(models, num_samples, perf_value, metrics)
+            return True
 
-    def send_recall_metric(self, recall_value):
+    def send_recall(self, recall: float, round: int):
         """
-        Send recall metric to aggregator for early stopping judge
-        :param recall_value: float - recall/accuracy metric for this round
+        Report the local recall of a round after its models were uploaded
+        (pipelined rounds upload the models before evaluating them).
+        Called from the engine's threads: it uses its own connection.
+        :param recall: recall of the local models
+        :param round: round the local models were trained for
         """
-        from fl_main.lib.util.messengers import generate_recall_up
-        from fl_main.lib.util.communication_handler import send
-        
-        recall_msg = generate_recall_up(recall_value, self.round, self.id)
-        
-        # Send recall message to aggregator
-        try:
-            aggr_ip = self.config['aggr_ip']
-            reg_socket = self.config['reg_socket']
-            
-            resp = send(recall_msg, aggr_ip, int(reg_socket))
-            if resp:
-                logging.info(f'--- Recall metric ({recall_value:.4f}) sent to aggregator ---')
-            else:
-                logging.warning(f'--- Failed to send recall metric ---')
-        except Exception as e:
-            logging.error(f'Error sending recall metric: {e}')
+        msg = generate_recall_up(recall, round, self.id)
+        asyncio.run(send(msg, self.aggr_ip, self.msend_socket))
 
-    def setup_sending_models(self, models, num_samples, perf_val):
+    def wait_upload(self, count: int, timeout: float = None) -> bool:
+        """
+        Block until more than `count` uploads have completed
+        :param count: value of uploads_completed seen before queuing the models
+        :param timeout: seconds, None to wait forever
+        :return: True if the upload completed
+        """
+        with self._state_cond:
+            return self._state_cond.wait_for(lambda: self.uploads_completed > count, timeout)
+
+    def setup_sending_models(self, models, num_samples, perf_val, metrics: Dict[str, Any] = None):
         """
         Save the trained models to the local file
         :param models: np.array - models
         :param num_samples: int - Number of sample data
         :param perf_val: float - Performance data: accuracy in this case
+        :param metrics: Dict - extra per-round metrics stored in the meta data
         :return:
         """
         # Create a model ID
         model_id = generate_model_id(IDPrefix.agent, self.id, time.time())
 
-        # Local Model evaluation (id, accuracy)
-        meta_data_dict = create_meta_data_dict(perf_val, num_samples)
+        # Local Model evaluation (id, accuracy, extra metrics); the meta data
+        # travels with the models in the update message
+        metrics = dict(metrics or {}, round=self.round)
+        meta_data_dict = create_meta_data_dict(perf_val, num_samples, metrics)
         data_dict = create_data_dict_from_models(model_id, models, self.id)
-        save_model_file(data_dict, self.model_path, self.lmfile, meta_data_dict)
+        self.store_models(self.lmfile, data_dict, meta_data_dict)
         logging.info(f'--- Local (Initial/Trained) Models saved ---')
 
         self.tran_state(ClientState.sending)
         logging.info(f'--- Client State is now sending ---')
 
+    def round_time_left(self):
+        """
+        Seconds left until the round deadline
+        :return: float, or None if the aggregator did not send a deadline
+        """
+        if self.round_deadline is None:
+            return None
+        return self.round_deadline - time.time()
+
     # Waiting models
     def wait_for_global_model(self):
 
         # Wait for global models (base models)
-        while (self.read_state() != ClientState.gm_ready):
-            time.sleep(5)
+        self.wait_state(ClientState.gm_ready)
+        self.training_cancel.clear()
 
-        # load models from the local file
-        data_dict, _ = load_model_file(self.model_path, self.gmfile)
+        # Global models handed over by the comm. thread
+        data_dict, _ = self.load_models(self.gmfile)
         global_models = data_dict['models']
+        self.global_model_id = data_dict.get('model_id')
         logging.info(f'--- Global Models read by Agent ---')
 
         self.tran_state(ClientState.training)
@@ -704,6 +1066,44 @@ class Client:
 
         return global_models
 
+    def _host_aggregator(self):
+        """
+        Start the aggregator role in this process. The training loop stays
+        blocked waiting for global models until the role is left.
+        """
+        from fl_main.aggregator.runner import AggregatorRunner
+
+        logging.info('🏆 Hosting the aggregator in this process (no restart)')
+        self.hosting_aggregator = True
+        self.aggregator_runner = AggregatorRunner(on_demote=self._on_demoted)
+        try:
+            self.aggregator_runner.start()
+        except Exception as e:
+            logging.error(f'In-process aggregator failed to start ({e}); restarting as aggregator')
+            os._exit(0)
+
+    def _on_demoted(self, winner_ip: str):
+        """
+        Called by the in-process aggregator after losing a rotation:
+        rejoin the new aggregator as a plain agent
+        :param winner_ip: IP address of the new aggregator
+        """
+        logging.info(f'📡 Aggregator role left, rejoining as agent with {winner_ip}')
+        self.aggr_ip = winner_ip
+        self.hosting_aggregator = False
+        self._rejoin_pending = True
+        # Wake up the exchange routine
+        self.tran_state(ClientState.waiting_gm)
+
+    def _write_node_config(self, config_file: str, cfg: Dict[str, Any]):
+        """
+        Persist the node config after a rotation. Agents hosted next to the
+        node's lead client (agent host) leave config_agent.json to the lead,
+        otherwise their 'agent' role could overwrite the lead's promotion.
+        """
+        if self.can_host_aggregator:
+            write_config(config_file, cfg)
+
     def _promote_to_aggregator(self):
         """
         Promote this agent to aggregator role.
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, List, Optional
+
+from fl_main.lib.util.communication_handler import send, subscribe
+from fl_main.lib.util.states import DBMsgType, DBEventType
+
+
+class DBWatcher:
+    """
+    Mirror of the DB coordination state (registered agents, current
+    aggregator, barrier state) kept up to date by a DB subscription,
+    so the agent waits for events instead of sleeping and re-querying.
+    If the DB does not accept subscriptions, wait_for falls back to
+    polling the DB every fallback_interval seconds.
+    """
+
+    def __init__(self, db_ip: str, db_socket: int, fallback_interval: float = 3):
+        """
+        :param db_ip: DB IP address
+        :param db_socket: DB port num
+        :param fallback_interval: polling period when not subscribed
+        """
+        self.db_ip = db_ip
+        self.db_socket = db_socket
+        self.fallback_interval = fallback_interval
+
+        self.agents_count = 0
+        self.aggregator = None  # (agg_id, agg_ip, agg_socket)
+        self.aggregator_ready = False
+        self.barrier_state = None
+
+        self.subscribed = False
+        self._task = None
+        self._changed = None
+        self._snapshot = None
+
+    async def start(self, timeout: float = 5) -> bool:
+        """
+        Open the subscription and wait for the initial snapshot
+        :param timeout: seconds to wait for the snapshot
+        :return: bool - True if subscribed
+        """
+        self._changed = asyncio.Event()
+        self._snapshot = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        try:
+            await asyncio.wait_for(self._snapshot.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if not self.subscribed:
+            logging.warning(f'⚠️  DB subscription unavailable - polling every {self.fallback_interval}s')
+        return self.subscribed
+
+    async def stop(self):
+        """
+        Close the subscription
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.subscribed = False
+
+    async def wait_for(self, predicate: Callable[['DBWatcher'], bool], timeout: float) -> bool:
+        """
+        Wait until predicate(watcher) holds or the timeout expires
+        :param predicate: condition on the watcher fields
+        :param timeout: seconds
+        :return: bool - predicate value when returning
+        """
+        deadline = time.time() + timeout
+        while not predicate(self):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if self.subscribed:
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(self.fallback_interval, remaining))
+                await self.refresh()
+        return True
+
+    async def refresh(self):
+        """
+        Query the DB directly (fallback when there is no subscription)
+        :return:
+        """
+        resp = await send([DBMsgType.get_agents_count.value], self.db_ip, self.db_socket)
+        if resp and resp[0] == 'agents_count':
+            self.agents_count = resp[1]
+        resp = await send([DBMsgType.get_aggregator.value], self.db_ip, self.db_socket)
+        if resp and resp[0] == 'aggregator':
+            self.aggregator = tuple(resp[1:4])
+        elif resp and resp[0] == 'no_aggregator':
+            self.aggregator = None
+
+    async def _run(self):
+        try:
+            await subscribe([DBMsgType.subscribe.value], self.db_ip, self.db_socket, self._on_event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f'⚠️  DB subscription lost: {type(e).__name__}')
+        self.subscribed = False
+        self._snapshot.set()
+        self._notify()
+
+    def _on_event(self, msg: List[Any]):
+        event = msg[0] if isinstance(msg, list) and msg else None
+        if event == DBEventType.snapshot:
+            self.agents_count, aggregator, barrier = msg[1], msg[2], msg[3]
+            self.aggregator = tuple(aggregator) if aggregator else None
+            # An aggregator already listening when we subscribe is ready right
+            # away (older DBs do not send the flag: wait for aggregator_ready)
+            self.aggregator_ready = self.aggregator is not None and len(msg) > 4 and bool(msg[4])
+            self.barrier_state = barrier.get('state') if isinstance(barrier, dict) else None
+            self.subscribed = True
+            self._snapshot.set()
+        elif event == DBEventType.agent_registered:
+            self.agents_count = msg[2]
+        elif event == DBEventType.aggregator_elected:
+            self.aggregator = tuple(msg[1:4])
+            self.aggregator_ready = False
+        elif event == DBEventType.aggregator_ready:
+            self.aggregator = tuple(msg[1:4])
+            self.aggregator_ready = True
+        elif event == DBEventType.aggregator_cleared:
+            self.aggregator = None
+            self.aggregator_ready = False
+        elif event == DBEventType.barrier_state_changed:
+            self.barrier_state = msg[1]
+        else:
+            # e.g. ['error', ...] from a DB without subscriptions
+            logging.debug(f'Unexpected DB event: {msg}')
+            return
+        logging.debug(f'DB event: {DBEventType(event).name} {msg[1:]}')
+        self._notify()
+
+    def _notify(self):
+        # Wake every waiter, later waits use a fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    @property
+    def aggregator_ip(self) -> Optional[str]:
+        return self.aggregator[1] if self.aggregator else None
+
+    @property
+    def aggregator_socket(self) -> Optional[int]:
+        return self.aggregator[2] if self.aggregator else None
@@ -0,0 +1,104 @@
+import logging
+import os
+import resource
+import threading
+from typing import Any, Dict, List
+
+
+class ResourceGovernor:
+    """
+    Keeps local training from starving the protocol threads (model exchange
+    routine, model server, in-process aggregator): the torch thread pools
+    are limited to, and pinned on, the cores not reserved for communication,
+    training threads run at a lower priority, and the process memory can
+    be capped. torch is imported only when the settings are applied.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        :param config: agent config - comm_reserved_cores, train_threads
+            (0 = every core left for training), pin_train_threads,
+            train_nice, memory_limit_mb (0 = no cap)
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+        self.num_cores = len(cores)
+
+        # At least one core is always left for training
+        self.reserved_cores = max(0, min(int(config.get('comm_reserved_cores', 1)), len(cores) - 1))
+        self.train_cpus: List[int] = cores[self.reserved_cores:]
+        threads = int(config.get('train_threads', 0))
+        self.train_threads = threads if threads > 0 else len(self.train_cpus)
+        self.pin = bool(config.get('pin_train_threads', 1)) and hasattr(os, 'sched_setaffinity')
+        self.train_nice = max(0, int(config.get('train_nice', 5)))
+        self.memory_limit_mb = int(config.get('memory_limit_mb', 0))
+
+        self._governed = set()  # native IDs of the threads already governed
+        self._lock = threading.Lock()
+
+    def apply_process(self, train_threads: int = None):
+        """
+        Process-wide settings: torch thread pools and memory cap.
+        Call once, before the first training.
+        :param train_threads: intra-op threads (default: self.train_threads)
+        :return:
+        """
+        import torch
+
+        if train_threads is not None:
+            self.train_threads = max(1, int(train_threads))
+        torch.set_num_threads(self.train_threads)
+        try:
+            # Inter-op parallelism only adds threads competing with the comm loop
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # already fixed once torch ran parallel work
+
+        if self.memory_limit_mb > 0:
+            limit = self.memory_limit_mb * 1024 * 1024
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+        logging.info(f'🎛️  Resource governor: {self.train_threads} torch threads on cores {self.train_cpus}, '
+                     f'{self.reserved_cores} core(s) reserved for communication, training nice +{self.train_nice}'
+                     + (f', memory cap {self.memory_limit_mb} MB' if self.memory_limit_mb > 0 else ''))
+
+    def apply_thread(self):
+        """
+        Govern the calling thread (training / evaluation): pin it to the
+        training cores and lower its priority. Threads it creates later,
+        such as the torch intra-op pool, inherit both.
+        :return:
+        """
+        tid = threading.get_native_id()
+        with self._lock:
+            if tid in self._governed:
+                return
+            self._governed.add(tid)
+        try:
+            if self.pin:
+                os.sched_setaffinity(0, self.train_cpus)  # 0 = calling thread
+            if self.train_nice > 0:
+                nice = os.getpriority(os.PRIO_PROCESS, tid)
+                os.setpriority(os.PRIO_PROCESS, tid, min(19, nice + self.train_nice))
+        except (OSError, AttributeError) as e:
+            logging.warning(f'Resource governor could not govern thread {tid}: {e}')
+
+    def settings(self) -> Dict[str, Any]:
+        """
+        Chosen settings and peak memory, for the round metrics
+        :return: Dict
+        """
+        return {
+            'train_threads': self.train_threads,
+            'train_cores': len(self.train_cpus),
+            'reserved_cores': self.reserved_cores,
+            'train_nice': self.train_nice,
+            'memory_limit_mb': self.memory_limit_mb,
+            # ru_maxrss is in KB on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
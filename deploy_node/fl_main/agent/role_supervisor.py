@@ -12,9 +12,16 @@ from fl_main.lib.util.helpers import set_config_file, read_config
 # server (replacing itself). Otherwise it restarts the client.
 
 # Motor de clasificación tabular para datos de defunciones hospitalarias
-# Usar conda run para ejecutar en el entorno correcto
-CLIENT_MODULE = ['conda', 'run', '-n', 'federatedenv2', '--no-capture-output', 'python3', '-m', 'fl_main.examples.tabular_ncd.tabular_engine']
-AGG_MODULE = ['conda', 'run', '-n', 'federatedenv2', '--no-capture-output', 'python3', '-m', 'fl_main.aggregator.server_th']
+# Usar conda run para ejecutar en el entorno correcto; si el supervisor ya
+# corre dentro del entorno se lanza el mismo intérprete (sin el coste de
+# arranque de `conda run` en cada reinicio)
+CONDA_ENV = 'federatedenv2'
+if os.environ.get('CONDA_DEFAULT_ENV') == CONDA_ENV:
+    PYTHON = [sys.executable]
+else:
+    PYTHON = ['conda', 'run', '-n', CONDA_ENV, '--no-capture-output', 'python3']
+CLIENT_MODULE = PYTHON + ['-m', 'fl_main.examples.tabular_ncd.tabular_engine']
+AGG_MODULE = PYTHON + ['-m', 'fl_main.aggregator.server_th']
 
 client_args = sys.argv[1:]
 
@@ -107,5 +114,6 @@ while True:
 
     # client exited; re-check role and loop. If the client promoted itself it
     # should have written role='aggregator' into the config, so the next loop
-    # will exec the aggregator.
-    time.sleep(0.5)
+    # will exec the aggregator. Only back off after a crash.
+    if proc.returncode != 0:
+        time.sleep(0.5)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from threading import Thread, Event
+from typing import Callable, Optional
+
+from fl_main.lib.util.communication_handler import serve_fl_server
+from .server_th import Server
+
+
+class AggregatorRunner:
+    """
+    Hosts the aggregator role inside an already running process (the agent),
+    on its own thread and event loop, so a role switch does not need a
+    process restart: the agent keeps its loaded data, model and imports.
+    """
+
+    def __init__(self, on_demote: Optional[Callable[[str], None]] = None):
+        """
+        :param on_demote: called with the new aggregator IP when this
+            aggregator loses a rotation (after its servers are stopping)
+        """
+        self.on_demote = on_demote
+        self.server = None
+        self._loop = None
+        self._thread = None
+        self._ready = Event()
+        self._error = None
+
+    def start(self) -> Server:
+        """
+        Start the Server coroutines (registration/receiver sockets and the
+        model synthesis routine) and return once they are listening
+        :return: Server
+        """
+        self._thread = Thread(target=self._run, name='aggregator', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        logging.info(f'--- Aggregator hosted in-process at {self.server.aggr_ip} ---')
+        return self.server
+
+    def stop(self, timeout: float = 10):
+        """
+        Stop the servers and the synthesis routine, releasing the sockets
+        :param timeout: seconds to wait for the aggregator thread
+        :return:
+        """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self.server = Server(on_demote=self._demoted)
+            bind_ip = self.server.config.get('bind_ip', '0.0.0.0')
+            ws_servers = self._loop.run_until_complete(serve_fl_server(
+                self.server.register, self.server.receive_msg_from_agent,
+                bind_ip, self.server.reg_socket, self.server.recv_socket))
+            self._loop.create_task(self.server.model_synthesis_routine())
+            self._loop.create_task(self.server.announce_ready())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            self._loop.close()
+            return
+
+        self._ready.set()
+        self._loop.run_forever()
+
+        # Stopped: close the sockets and cancel whatever is still pending
+        for ws in ws_servers:
+            ws.close()
+            self._loop.run_until_complete(ws.wait_closed())
+        pending = asyncio.all_tasks(self._loop)
+        for task in pending:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self._loop.close()
+        logging.info('--- In-process aggregator stopped ---')
+
+    def _demoted(self, winner_ip: str):
+        # Runs on the aggregator loop: stop it once the current handler returns
+        self._loop.call_soon(self._loop.stop)
+        if self.on_demote is not None:
+            self.on_demote(winner_ip)
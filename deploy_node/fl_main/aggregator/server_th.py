@@ -3,11 +3,12 @@ import websockets
 from typing import List, Dict, Any
 import random
 import os
-from fl_main.lib.util.communication_handler import init_fl_server, send, send_websocket, receive 
+from fl_main.lib.util.communication_handler import init_fl_server, send, send_resumable, send_websocket, receive, fan_out
 from fl_main.lib.util.data_struc import convert_LDict_to_Dict
-from fl_main.lib.util.helpers import read_config, set_config_file, write_config, get_ip
+from fl_main.lib.util.helpers import read_config, set_config_file, write_config, get_ip, models_from_manifest
 from fl_main.lib.util.messengers import generate_rotation_message, generate_db_push_message, generate_ack_message, \
-     generate_cluster_model_dist_message, generate_agent_participation_confirm_message
+     generate_cluster_model_dist_message, generate_agent_participation_confirm_message, generate_weights_request_message, \
+     generate_upload_ack_message, generate_round_info_message
 from fl_main.lib.util.states import ParticipateMSGLocation, RotationMSGLocation, ModelUpMSGLocation, PollingMSGLocation, \
      ModelType, AgentMsgType, DBMsgType
 from fl_main.lib.util.metrics_logger import AggregatorMetricsLogger
@@ -22,10 +23,14 @@ class Server:
     and the aggregator and an agent (client)
     """
 
-    def __init__(self):
+    def __init__(self, on_demote=None):
         """
         Instantiation of a Server instance
+        :param on_demote: callback(winner_ip) used instead of exiting the
+            process when the aggregator role is hosted in-process
         """
+        self.on_demote = on_demote
+
         # read the config file (use agent config since we're on a node)
         config_file = set_config_file("agent")
         self.config = read_config(config_file)
@@ -90,6 +95,9 @@ class Server:
         # Aggregation timeout (seconds) - max time to wait for models
         self.aggregation_timeout = int(self.config.get('aggregation_timeout', 30))
         self.aggregation_start_time = None
+        # Deadline of the current round (local clock); agents receive the time
+        # left with the global models and size their local work to it
+        self.round_deadline = None
         logging.info(f'⏱️  Timeout de agregación configurado: {self.aggregation_timeout}s')
         
         # Termination judges
@@ -104,6 +112,12 @@ class Server:
         self.training_terminated = False
         self.termination_reason = None
         self.pending_termination_msg = None
+        self.termination_broadcasted = False
+        self.stepped_down = False
+
+        # Concurrent sends to all agents (push mode): max parallel connections and per-agent deadline
+        self.fanout_concurrency = int(self.config.get('fanout_concurrency', 8))
+        self.fanout_deadline = float(self.config.get('fanout_deadline', 15))
         
         # Initialize metrics logger for aggregator
         self.metrics_logger = AggregatorMetricsLogger(log_dir="./metrics")
@@ -134,6 +148,13 @@ class Server:
         logging.info(f'--- {msg[int(ParticipateMSGLocation.msg_type)]} Message Received ---')
         logging.debug(f'Message: {msg}')
 
+        # The agent only sent its model manifest: ask for the weights if
+        # they are needed to initialize the cluster models
+        if self._needs_initial_weights(msg):
+            logging.info(f'--- Requesting initial weights from {msg[int(ParticipateMSGLocation.agent_id)]} ---')
+            await send_websocket(generate_weights_request_message(), websocket)
+            return
+
         # Check if it is a simulation run
         es = self._get_exch_socket(msg)
 
@@ -173,6 +194,17 @@ class Server:
             es = self.exch_socket
         return es
 
+    def _needs_initial_weights(self, msg) -> bool:
+        """
+        True if the participation message carries only a manifest while the
+        agent asks its weights to be used as the initial cluster models
+        :param msg: Message received
+        :return:
+        """
+        return self.sm.round == 0 and not self.sm.initialized \
+            and bool(msg[int(ParticipateMSGLocation.init_flag)]) \
+            and msg[int(ParticipateMSGLocation.lmodels)] is None
+
     async def _initialize_fl(self, msg):
         """
         Initialize FL round
@@ -187,11 +219,16 @@ class Server:
         performance = msg[int(ParticipateMSGLocation.meta_data)]
         init_weights_flag = bool(msg[int(ParticipateMSGLocation.init_flag)])
 
-        # Initialize model info
-        self.sm.initialize_model_info(lmodels, init_weights_flag)
+        if lmodels is None:
+            # Manifest-only registration: zero-initialized models of the same structure
+            manifest = msg[int(ParticipateMSGLocation.manifest)]
+            self.sm.initialize_model_info(models_from_manifest(manifest), init_weights_flag=False)
+        else:
+            # Initialize model info
+            self.sm.initialize_model_info(lmodels, init_weights_flag)
 
-        # Pushing the local model to DB
-        await self._push_local_models(agent_id, model_id, lmodels, gene_time, performance)
+            # Pushing the local model to DB
+            await self._push_local_models(agent_id, model_id, lmodels, gene_time, performance)
 
         # Recognize this step as one aggregation round
         self.sm.increment_round()
@@ -216,7 +253,7 @@ class Server:
 
         reply = generate_agent_participation_confirm_message(
             self.sm.id, model_id, cluster_models,
-            self.sm.round, agent_id, exch_socket, self.recv_socket, self.aggr_ip)
+            self.sm.round, agent_id, exch_socket, self.recv_socket, self.aggr_ip, self._round_budget())
         await send_websocket(reply, websocket)
         logging.info(f'--- Global Models Sent to {agent_id} ---')
         
@@ -234,30 +271,69 @@ class Server:
         :param path:
         :return:
         """
-        msg = await receive(websocket)
+        try:
+            msg = await receive(websocket)
+        except websockets.exceptions.ConnectionClosed:
+            # The bytes received so far are kept; the agent resumes after reconnecting
+            logging.warning('--- Upload interrupted, waiting for the agent to resume ---')
+            return
 
         if msg[int(ModelUpMSGLocation.msg_type)] == AgentMsgType.update:
-            await self._process_lmodel_upload(msg)
+            reply = await self._process_lmodel_upload(msg)
+            if reply is None:
+                # Not buffered: no ack, so the agent's outbox retries it
+                return
+            # The agent keeps the upload in its outbox until this ack arrives
+            try:
+                await send_websocket(reply, websocket)
+            except websockets.exceptions.ConnectionClosed:
+                logging.warning('--- Upload ack lost, the agent will retry (deduplicated) ---')
 
         elif msg[int(PollingMSGLocation.msg_type)] == AgentMsgType.polling:
             await self._process_polling(msg, websocket)
+
+        elif msg[int(PollingMSGLocation.msg_type)] == AgentMsgType.round_query:
+            # Agents training in polling mode: only the round, no models
+            await send_websocket(generate_round_info_message(self.sm.round), websocket)
             
         elif msg[0] == AgentMsgType.recall_upload:
             await self._process_recall_upload(msg)
 
     async def _process_lmodel_upload(self, msg):
         """
-        Process local models uploaded from agents
+        Process local models uploaded from agents.
+        Retried uploads (same model ID) are acknowledged but not buffered again.
+        An upload is marked as received only once it is buffered.
         :param msg: message received from the agent
-        :return:
+        :return: upload ack message, or None if the models could not be buffered
         """
         lmodels = msg[int(ModelUpMSGLocation.lmodels)]
         agent_id = msg[int(ModelUpMSGLocation.agent_id)]
         model_id = msg[int(ModelUpMSGLocation.model_id)]
         gene_time = msg[int(ModelUpMSGLocation.gene_time)]
         perf_val = msg[int(ModelUpMSGLocation.meta_data)]
+        round = msg[int(ModelUpMSGLocation.round)] if len(msg) > int(ModelUpMSGLocation.round) else None
+
+        if self.sm.upload_received(model_id):
+            logging.info(f'--- Duplicate upload {model_id} from {agent_id} (round {round}) ignored ---')
+            return generate_upload_ack_message(model_id, True)
+
         await self._push_local_models(agent_id, model_id, lmodels, gene_time, perf_val)
 
+        # A retry of the same upload may have been buffered during the DB push
+        if self.sm.upload_received(model_id):
+            logging.info(f'--- Duplicate upload {model_id} from {agent_id} (round {round}) ignored ---')
+            return generate_upload_ack_message(model_id, True)
+
+        # Store local models in the buffer
+        try:
+            self.sm.buffer_local_models(lmodels, participate=False, meta_data=perf_val)
+        except Exception as e:
+            logging.error(f"Error buffering local models from {agent_id}: {e} - not acknowledged")
+            return None
+        self.sm.register_upload(agent_id, model_id, round)
+        logging.info(f"_process_lmodel_upload: buffer size now={len(self.sm.local_models_buffer) if hasattr(self.sm, 'local_models_buffer') else 'unknown'}")
+
         logging.info('--- Local Model Received ---')
         logging.debug(f'Local models: {lmodels}')
         
@@ -269,22 +345,29 @@ class Server:
         except Exception as e:
             logging.warning(f"Could not calculate model bytes: {e}")
 
-        # Debug: log model keys and buffer state before/after
+        # Debug: log model keys
         try:
             logging.info(f"_process_lmodel_upload: agent_id={agent_id} model_id={model_id} num_keys={len(list(lmodels.keys()))}")
         except Exception:
             pass
 
-        # Store local models in the buffer
-        try:
-            self.sm.buffer_local_models(lmodels, participate=False, meta_data=perf_val)
-            logging.info(f"_process_lmodel_upload: buffer size now={len(self.sm.local_models_buffer) if hasattr(self.sm, 'local_models_buffer') else 'unknown'}")
-        except Exception as e:
-            logging.error(f"Error buffering local models from {agent_id}: {e}")
+        # Per-round metrics piggybacked on the upload (no separate recall message)
+        if isinstance(perf_val, dict):
+            logging.info(f"📈 Métricas de {agent_id}: " + ', '.join(
+                f'{k}={v:.4f}' if isinstance(v, float) else f'{k}={v}' for k, v in perf_val.items()))
+            # Pipelined agents upload before evaluating the local models: their
+            # recall is the received global model's, the local one follows
+            # in a recall_upload message
+            if perf_val.get('recall') is not None and perf_val.get('evaluated_model', 'local') == 'local':
+                self._record_agent_recall(agent_id, float(perf_val['recall']),
+                                          int(perf_val.get('round', self.sm.round)))
+
+        return generate_upload_ack_message(model_id)
 
     async def _process_recall_upload(self, msg):
         """
-        Process recall metric uploaded from agents (Juez 1: Early Stopping)
+        Process a standalone recall message (agents that do not send their
+        metrics inside the model upload yet)
         :param msg: [AgentMsgType.recall_upload, recall_value, round, agent_id]
         """
         from fl_main.lib.util.states import RecallUpMSGLocation
@@ -292,8 +375,16 @@ class Server:
         recall_value = float(msg[int(RecallUpMSGLocation.recall_value)])
         round_no = int(msg[int(RecallUpMSGLocation.round)])
         agent_id = msg[int(RecallUpMSGLocation.agent_id)]
-        
-        logging.info(f'--- Recall Upload Received: agent={agent_id}, recall={recall_value:.4f}, round={round_no} ---')
+        self._record_agent_recall(agent_id, recall_value, round_no)
+
+    def _record_agent_recall(self, agent_id: str, recall_value: float, round_no: int):
+        """
+        Record the recall of an agent for this round (Juez 1: Early Stopping)
+        :param agent_id: agent ID
+        :param recall_value: local recall reported by the agent
+        :param round_no: round the agent trained on
+        """
+        logging.info(f'--- Recall Received: agent={agent_id}, recall={recall_value:.4f}, round={round_no} ---')
         
         # Store recall for this agent in current round
         self.current_round_recalls[agent_id] = recall_value
@@ -421,39 +512,7 @@ class Server:
                 else:
                     logging.info(f'🔄 Este agregador PERDIÓ la rotación. Cambiando a rol AGENT.')
                     logging.info(f'   Nuevo agregador: {winner_id[:8]}... en {winner_ip}:{winner_sock}')
-                    
-                    # IMPORTANTE: Guardar métricas finales antes de salir
-                    try:
-                        logging.info(f'💾 Guardando métricas finales del agregador...')
-                        self.metrics_logger.log_round(
-                            round_num=self.sm.round,
-                            num_agents=len(self.sm.agent_set),
-                            global_recall=self.last_global_recall,
-                            aggregation_time=0.0,  # No hay agregación en esta salida
-                            models_received=0,
-                            bytes_received=0,
-                            bytes_sent=0,
-                            rounds_without_improvement=self.rounds_without_improvement,
-                            best_recall=self.best_global_recall if self.best_global_recall > 0 else None
-                        )
-                        logging.info(f'✅ Métricas guardadas en {self.metrics_logger.get_csv_path()}')
-                    except Exception as e:
-                        logging.error(f'⚠️  Error guardando métricas finales: {e}')
-                    
-                    # Persist config changes before exiting - change to agent
-                    try:
-                        cfg_agent_file = set_config_file('agent')
-                        cfg_agent = read_config(cfg_agent_file)
-                        cfg_agent['role'] = 'agent'
-                        cfg_agent['aggr_ip'] = winner_ip
-                        # NOTE: reg_socket must stay at 8765 (registration port), don't change it
-                        write_config(cfg_agent_file, cfg_agent)
-                        logging.info(f'✅ Config persistida: ahora agent apuntando a {winner_ip}')
-                    except Exception as e:
-                        logging.error(f'❌ Error persistiendo config: {e}')
-                    
-                    logging.info(f'👋 Saliendo del proceso agregador...')
-                    os._exit(0)
+                    self._step_down(winner_ip)
             else:
                 remaining = all_agent_ids - self.rotation_notified_agents
                 logging.info(f'Rotation sent to {agent_id}. Waiting for {len(remaining)} more agents: {remaining}')
@@ -471,7 +530,8 @@ class Server:
 
             model_id = self.sm.cluster_model_ids[-1]
             cluster_models = convert_LDict_to_Dict(self.sm.cluster_models)
-            gm_msg = generate_cluster_model_dist_message(self.sm.id, model_id, self.sm.round, cluster_models)
+            gm_msg = generate_cluster_model_dist_message(self.sm.id, model_id, self.sm.round, cluster_models,
+                                                         self._round_budget())
             await send_websocket(gm_msg, websocket)
             logging.info(f'--- Global Models Sent to {agent_id} ---')
             
@@ -486,12 +546,62 @@ class Server:
             ack_msg = generate_ack_message()
             await send_websocket(ack_msg, websocket)
 
+    def _step_down(self, winner_ip: str):
+        """
+        Leave the aggregator role after losing a rotation:
+        save the final metrics, point the config to the winner and exit
+        :param winner_ip: IP address of the new aggregator
+        """
+        # IMPORTANTE: Guardar métricas finales antes de salir
+        try:
+            logging.info(f'💾 Guardando métricas finales del agregador...')
+            self.metrics_logger.log_round(
+                round_num=self.sm.round,
+                num_agents=len(self.sm.agent_set),
+                global_recall=self.last_global_recall,
+                aggregation_time=0.0,  # No hay agregación en esta salida
+                models_received=0,
+                bytes_received=0,
+                bytes_sent=0,
+                rounds_without_improvement=self.rounds_without_improvement,
+                best_recall=self.best_global_recall if self.best_global_recall > 0 else None
+            )
+            logging.info(f'✅ Métricas guardadas en {self.metrics_logger.get_csv_path()}')
+        except Exception as e:
+            logging.error(f'⚠️  Error guardando métricas finales: {e}')
+
+        # Persist config changes before exiting - change to agent
+        try:
+            cfg_agent_file = set_config_file('agent')
+            cfg_agent = read_config(cfg_agent_file)
+            cfg_agent['role'] = 'agent'
+            cfg_agent['aggr_ip'] = winner_ip
+            # NOTE: reg_socket must stay at 8765 (registration port), don't change it
+            write_config(cfg_agent_file, cfg_agent)
+            logging.info(f'✅ Config persistida: ahora agent apuntando a {winner_ip}')
+        except Exception as e:
+            logging.error(f'❌ Error persistiendo config: {e}')
+
+        self.stepped_down = True
+        if self.on_demote is not None:
+            logging.info(f'👋 Dejando el rol de agregador (mismo proceso)...')
+            self.on_demote(winner_ip)
+            return
+
+        logging.info(f'👋 Saliendo del proceso agregador...')
+        os._exit(0)
+
     async def model_synthesis_routine(self):
         """
         Rutina de agregación con BARRERAS DISTRIBUIDAS para sincronización perfecta
         """
-        while True:
+        while not self.stepped_down:
             await asyncio.sleep(self.round_interval)
+
+            # Push mode: agents don't poll, so the termination has to be broadcast
+            if self.pending_termination_msg is not None and not self.is_polling \
+                    and not self.termination_broadcasted:
+                await self._broadcast_termination()
             
             num_agents = len(self.sm.agent_set)
             
@@ -527,6 +637,12 @@ class Server:
             
             # Incrementar ronda
             self.sm.increment_round()
+            # Los modelos de la nueva ronda se esperan tras round_interval + aggregation_timeout
+            self.round_deadline = time.time() + self.round_interval + self.aggregation_timeout
+
+            # Modo push: distribuir el modelo global a todos los agentes en paralelo
+            if not self.is_polling:
+                await self._send_cluster_models_to_all()
             
             # Log metrics
             self.metrics_logger.log_round(
@@ -587,6 +703,24 @@ class Server:
         msg = [DBMsgType.reset_barrier.value]
         await send(msg, self.db_ip, self.db_socket)
     
+    def _round_budget(self):
+        """Segundos que quedan hasta el cierre de la ronda (None si no hay plazo)"""
+        if self.round_deadline is None:
+            return None
+        return max(0.0, self.round_deadline - time.time())
+    
+    async def announce_ready(self):
+        """
+        Tell the DB the aggregator is listening; agents subscribed to the
+        DB join right away instead of waiting a fixed time after the election
+        """
+        msg = [DBMsgType.update_aggregator.value, self.sm.id, self.aggr_ip, int(self.reg_socket)]
+        reply = await send(msg, self.db_ip, self.db_socket)
+        if reply and reply[0] == 'updated':
+            logging.info(f'📣 Agregador anunciado en la DB: {self.aggr_ip}:{self.reg_socket}')
+        else:
+            logging.warning(f'⚠️  No se pudo anunciar el agregador en la DB: {reply}')
+    
     async def _wait_for_models_barrier(self, num_expected: int) -> bool:
         """
         Espera hasta que todos los agentes envíen sus modelos (barrera distribuida)
@@ -684,9 +818,14 @@ class Server:
             logging.info(f"⏳ Esperando que {len(agents)} agentes lo reciban via polling...")
             # El exit ocurrirá en _process_polling después de que todos confirmen
         else:
-            # Modo push: enviar directamente (no usado típicamente)
-            logging.warning(f"⚠️  Modo push detectado - enviando rotación directamente")
-            os._exit(0)
+            # Modo push: enviar la rotación a todos los agentes en paralelo
+            logging.info(f"📤 Modo push - enviando rotación a {len(agents)} agentes")
+            _, failures = await fan_out(rot_msg, self._agent_targets(),
+                                        self.fanout_concurrency, self.fanout_deadline)
+            if failures:
+                logging.warning(f"⚠️  {len(failures)} agente(s) no recibieron la rotación")
+            if winner_id != self.sm.id:
+                self._step_down(winner_ip)
 
     async def _send_cluster_models_to_all(self):
         """
@@ -701,13 +840,31 @@ class Server:
         model_id = self.sm.cluster_model_ids[-1]
         cluster_models = convert_LDict_to_Dict(self.sm.cluster_models)
 
-        msg = generate_cluster_model_dist_message(self.sm.id, model_id, self.sm.round, cluster_models)
-        for agent in self.sm.agent_set:
-            try:
-                await send(msg, agent['agent_ip'], agent['socket'])
-                logging.info(f'--- Global Models Sent to {agent["agent_id"]} ---')
-            except Exception as e:
-                logging.error(f'Failed to send cluster models to {agent.get("agent_id")} : {e}')
+        msg = generate_cluster_model_dist_message(self.sm.id, model_id, self.sm.round, cluster_models,
+                                                  self._round_budget())
+        responses, _ = await fan_out(msg, self._agent_targets(), self.fanout_concurrency, self.fanout_deadline)
+        for agent_id in responses:
+            logging.info(f'--- Global Models Sent to {agent_id} ---')
+
+        # Track bytes sent for metrics
+        self.round_bytes_sent += len(pickle.dumps(msg)) * len(responses)
+
+    async def _broadcast_termination(self):
+        """
+        Send the termination message to all agents under this aggregator
+        :return:
+        """
+        responses, _ = await fan_out(self.pending_termination_msg, self._agent_targets(),
+                                     self.fanout_concurrency, self.fanout_deadline)
+        logging.info(f'--- Termination message sent to {len(responses)}/{len(self.sm.agent_set)} agents ---')
+        self.termination_broadcasted = True
+
+    def _agent_targets(self) -> Dict[str, Any]:
+        """
+        Addresses of all agents under this aggregator for fan_out
+        :return: Dict[agent_id, (agent_ip, socket)]
+        """
+        return {a['agent_id']: (a['agent_ip'], a['socket']) for a in self.sm.agent_set}
 
     async def _push_local_models(self, agent_id: str, model_id: str, local_models: Dict[str, np.array],\
                                  gene_time: float, performance: Dict[str, float]) -> List[Any]:
@@ -752,7 +909,7 @@ class Server:
         :return: Response message (List)
         """
         msg = generate_db_push_message(component_id, self.sm.round, model_type, models, model_id, gene_time, performance_dict)
-        resp = await send(msg, self.db_ip, self.db_socket)
+        resp = await send_resumable(msg, self.db_ip, self.db_socket)
         logging.info(f'--- Models pushed to DB: Response {resp} ---')
 
         return resp
@@ -792,11 +949,13 @@ if __name__ == "__main__":
         # Start FL server and background routine (model synthesis only)
         # Bind to 0.0.0.0 inside container for reachability, but keep
         # `s.aggr_ip` as the advertised address used in messages.
-        bind_ip = '0.0.0.0'
+        # `bind_ip` can narrow it (e.g. 127.0.0.1 behind net_emulator links).
+        bind_ip = s.config.get('bind_ip', '0.0.0.0')
         init_fl_server(s.register,
                        s.receive_msg_from_agent,
                        s.model_synthesis_routine(),
-                       bind_ip, s.reg_socket, s.recv_socket)
+                       bind_ip, s.reg_socket, s.recv_socket,
+                       s.announce_ready())
     except Exception as e:
         logging.error(f"=== AGGREGATOR CRASHED ===")
         logging.error(f"Exception type: {type(e).__name__}")
@@ -1,6 +1,7 @@
 import numpy as np
 import logging
 import time
+from collections import OrderedDict
 from typing import Dict, Any
 
 from fl_main.lib.util.data_struc import LimitedDict
@@ -40,6 +41,12 @@ class StateManager:
         # stores sample numbers for each agent
         self.local_model_num_samples = list()
 
+        # (agent_id, round) of the local models already received, by model ID,
+        # so uploads retried by the agents' outbox are buffered only once.
+        # Kept across rounds (bounded) so a late retry is not taken as new.
+        self.received_uploads = OrderedDict()
+        self.max_received_uploads = 4096
+
         # stores cluster models by names
         # {'model_name' : list of a type of models (only used location 0)}
         self.cluster_models = LimitedDict(self.mnames)
@@ -189,6 +196,29 @@ class StateManager:
         for mname in self.mnames:
             self.cluster_models[mname].clear()
 
+    def upload_received(self, model_id: str) -> bool:
+        """
+        Check whether a local model upload was already received
+        :param model_id: str - model ID of the local models
+        :return: True if it was already received
+        """
+        return model_id in self.received_uploads
+
+    def register_upload(self, agent_id: str, model_id: str, round: int) -> bool:
+        """
+        Remember a local model upload
+        :param agent_id: str - agent ID
+        :param model_id: str - model ID of the local models
+        :param round: int - round the models were trained for
+        :return: True if it is new, False if it was already received
+        """
+        if model_id in self.received_uploads:
+            return False
+        self.received_uploads[model_id] = (agent_id, round)
+        while len(self.received_uploads) > self.max_received_uploads:
+            self.received_uploads.popitem(last=False)
+        return True
+
     def clear_lmodel_buffers(self):
         """
         Clear all buffered local models for a next round
@@ -0,0 +1,191 @@
+"""
+Agent Host para Tabular NCD: varios agentes (hospitales) en un solo proceso.
+
+Cada agente lógico tiene su propio ID, dataset (data/dataX.csv), estado,
+planificador y métricas, pero comparten el proceso: un solo runtime de
+torch, un solo event loop para las comunicaciones de todos los clientes,
+el preprocessor y el Converter. Un scheduler reparte los núcleos entre los
+entrenamientos para que se intercalen sin sobre-suscribir la CPU.
+
+Uso:
+    python -m fl_main.examples.tabular_ncd.agent_host [data/data1.csv data/data2.csv ...]
+
+Sin argumentos se usan los datasets de `hosted_datasets` en config_agent.json.
+El primer agente es el principal del nodo: es el único que puede asumir el
+rol de agregador si se elige la IP de este nodo.
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
+
+from fl_main.lib.util.helpers import set_config_file, read_config, generate_id
+from fl_main.lib.util.metrics_logger import MetricsLogger
+from fl_main.agent.resource_governor import ResourceGovernor
+from .tabular_engine import TrainingMetaData, get_agent_num, training, run_rounds
+from .autotune import RuntimeAutotuner, apply_tuning
+
+
+class TrainingScheduler:
+    """
+    Reparte los núcleos de entrenamiento (los que el ResourceGovernor no
+    reserva para comunicación) entre los agentes del proceso: como mucho
+    `slots` entrenamientos a la vez, cada uno con cores // slots hilos de torch.
+    """
+
+    def __init__(self, num_agents: int, governor: ResourceGovernor, slots: int = 0):
+        """
+        Args:
+            num_agents: Agentes alojados en el proceso
+            governor: ResourceGovernor del proceso
+            slots: Entrenamientos simultáneos (0 = uno por núcleo, hasta num_agents)
+        """
+        cores = len(governor.train_cpus)
+        self.slots = slots if slots > 0 else max(1, min(num_agents, cores))
+        self.threads_per_slot = max(1, cores // self.slots)
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        governor.apply_process(self.threads_per_slot)
+        logging.info(f'🧮 Scheduler: {self.slots} entrenamientos simultáneos, '
+                     f'{self.threads_per_slot} hilos de torch cada uno ({cores} núcleos)')
+
+    @contextmanager
+    def slot(self):
+        """Reserva un hueco de CPU mientras dura el entrenamiento."""
+        start = time.time()
+        with self._semaphore:
+            waited = time.time() - start
+            if waited > 1:
+                logging.info(f'⏳ Esperó {waited:.1f}s por un hueco de CPU')
+            yield
+
+
+class HostedAgent:
+    """Un agente lógico: cliente FL, datos, evaluador, planificador y métricas propios."""
+
+    def __init__(self, data_path: str, cfg: Dict, lead: bool):
+        """
+        Args:
+            data_path: CSV crudo del hospital, relativo a deploy_node
+            cfg: Configuración (config_agent.json)
+            lead: True para el agente principal del nodo
+        """
+        from fl_main.agent.client import Client
+        stem = os.path.splitext(os.path.basename(data_path))[0]
+        self.name = f'a{get_agent_num(stem)}'
+        self.data_path = data_path
+        self.cfg = cfg
+        # ID propio, guardado junto a los modelos del agente: el agregador y
+        # la DB distinguen a los agentes del nodo por su ID
+        agent_id = generate_id(os.path.join(cfg['model_path'], self.name))
+        self.client = Client(agent_name=self.name, can_host_aggregator=lead, agent_id=agent_id)
+        self.metrics_logger = MetricsLogger(log_dir="./metrics", agent_name=self.name)
+        self.dm = None
+        self.evaluator = None
+        self.planner = None
+        self.initial_models = None
+
+    def prepare(self):
+        """Carga los datos del hospital y crea los modelos iniciales."""
+        from .tabular_training import DataManager, WorkPlanner
+        from .evaluation import EvaluationEngine
+        batch_size = TrainingMetaData.batch_size
+        cutoff = max(1, int(TrainingMetaData.num_training_data / batch_size))
+        self.dm = DataManager(cutoff, self.name, batch_size, self.data_path)
+        self.evaluator = EvaluationEngine(self.dm)
+        self.planner = WorkPlanner(local_epochs=TrainingMetaData.local_epochs)
+        logging.info(f'[{self.name}] {self.data_path}: {self.dm.num_train_samples} muestras de entrenamiento')
+        return training(dict(), init_flag=True, dm=self.dm)
+
+    def run(self, scheduler: TrainingScheduler, governor: ResourceGovernor):
+        """Bucle de rondas del agente (en su propio hilo)."""
+        try:
+            self.initial_models.result()
+        except Exception as e:
+            logging.error(f'[{self.name}] No se pudieron preparar los datos: {e}')
+            return
+        if self.cfg.get('autotune', 0) and self.cfg.get('autotune_batch_sizes'):
+            # Solo el batch size (dentro del rango del operador): los hilos los
+            # fija el scheduler para todo el proceso. Agentes con los mismos
+            # datos de entrada comparten la medición
+            governor.apply_thread()
+            tuning = RuntimeAutotuner(self.cfg, TrainingMetaData.learning_rate).tune(
+                self.dm, [scheduler.threads_per_slot])
+            apply_tuning(self.dm, tuning)
+        rounds = run_rounds(self.client, self.cfg, self.metrics_logger, self.dm,
+                            self.evaluator, self.planner, scheduler.slot, governor)
+        logging.info(f'[{self.name}] Total rounds: {rounds}')
+
+
+def run_comm_loop(agents: List[HostedAgent]):
+    """
+    Event loop compartido: registro y rutina de intercambio de modelos de
+    todos los clientes. El fallo de uno no detiene a los demás.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    def report(agent, task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f'[{agent.name}] Cliente FL detenido: {task.exception()!r}')
+
+    for agent in agents:
+        task = loop.create_task(agent.client.run_fl_client())
+        task.add_done_callback(lambda t, a=agent: report(a, t))
+    loop.run_forever()
+
+
+if __name__ == '__main__':
+    cfg = read_config(set_config_file('agent'))
+    if cfg.get('role', 'agent') == 'aggregator':
+        subprocess.Popen([sys.executable, "-m", "fl_main.aggregator.server_th"])
+        sys.exit(0)
+    TrainingMetaData.configure(cfg)
+    from .evaluation import EvaluationEngine
+    EvaluationEngine.configure(cfg)
+
+    os.makedirs('logs', exist_ok=True)
+    log_formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+    file_handler = logging.FileHandler('logs/agent_host.log')
+    file_handler.setFormatter(log_formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(log_formatter)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(file_handler)
+    root_logger.addHandler(console_handler)
+
+    datasets = sys.argv[1:] or cfg.get('hosted_datasets', [])
+    if not datasets:
+        logging.error('No hay datasets que alojar (argumentos o hosted_datasets en config_agent.json)')
+        sys.exit(1)
+    logging.info(f'=== Agent Host: {len(datasets)} agentes en un proceso ===')
+
+    agents = [HostedAgent(path, cfg, lead=(i == 0)) for i, path in enumerate(datasets)]
+    names = [agent.name for agent in agents]
+    if len(set(names)) != len(names):
+        logging.error(f'Nombres de agente repetidos {names}: los datasets deben numerarse (data1.csv, data2.csv, ...)')
+        sys.exit(1)
+    governor = ResourceGovernor(cfg)
+    scheduler = TrainingScheduler(len(agents), governor, int(cfg.get('hosted_train_slots', 0)))
+
+    # Datos y modelos iniciales en paralelo mientras los clientes se registran
+    startup_pool = ThreadPoolExecutor(max_workers=len(agents), thread_name_prefix='startup')
+    for agent in agents:
+        agent.initial_models = startup_pool.submit(agent.prepare)
+        agent.client.send_initial_model_when_ready(agent.initial_models)
+
+    threading.Thread(target=run_comm_loop, args=[agents], name='comm', daemon=True).start()
+
+    workers = [threading.Thread(target=agent.run, args=[scheduler, governor], name=agent.name) for agent in agents]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    startup_pool.shutdown(wait=False)
+    logging.info('=== Agent Host: training complete ===')
@@ -0,0 +1,208 @@
+"""
+Autotuner del runtime de entrenamiento para Tabular NCD.
+
+Al arrancar mide unos pasos de entrenamiento reales (el MLP del agente
+sobre sus propios datos) para cada número de hilos de torch y elige el más
+rápido entre los estables (poca variación entre repeticiones). El tamaño de
+batch cambia el entrenamiento (pasos del optimizador por ronda), así que
+solo se mide dentro del rango que fije el operador (autotune_batch_sizes);
+sin rango se mantiene el batch_size configurado. El resultado se guarda por huella del dispositivo
+(CPU, núcleos de entrenamiento, torch, features), así que un nodo solo se
+mide la primera vez: un Pi 4 y un servidor x86 terminan con su propia
+configuración.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from .mlp import MLP
+
+# Una medición a la vez por proceso (agent host): medir en paralelo
+# falsearía los resultados
+_tune_lock = threading.Lock()
+
+
+def _cpu_model() -> str:
+    """Modelo de CPU (x86: 'model name'; Raspberry Pi: 'Model')."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            info = dict(line.split(':', 1) for line in f if ':' in line)
+        info = {k.strip(): v.strip() for k, v in info.items()}
+        return info.get('model name') or info.get('Model') or info.get('Hardware') or platform.processor()
+    except OSError:
+        return platform.processor()
+
+
+class RuntimeAutotuner:
+    """
+    Elige hilos de torch (y batch_size, si el operador da un rango) midiendo
+    samples/segundo de entrenamiento, y persiste la elección por huella del
+    dispositivo.
+    """
+
+    def __init__(self, cfg: Dict, learning_rate: float = 0.001):
+        """
+        Args:
+            cfg: Configuración (config_agent.json): autotune_file,
+                autotune_batch_sizes (vacío = batch_size del DataManager),
+                autotune_samples, autotune_repeats, autotune_max_cv
+            learning_rate: Learning rate del optimizador (como en el entrenamiento)
+        """
+        self.path = cfg.get('autotune_file', './data/autotune.json')
+        self.batch_sizes = [int(b) for b in cfg.get('autotune_batch_sizes') or []]
+        # Muestras por repetición y repeticiones por combinación
+        self.samples = int(cfg.get('autotune_samples', 4096))
+        self.repeats = max(2, int(cfg.get('autotune_repeats', 3)))
+        # Coeficiente de variación máximo para considerar estable una combinación
+        self.max_cv = float(cfg.get('autotune_max_cv', 0.15))
+        self.learning_rate = learning_rate
+
+    def fingerprint(self, in_features: int, batch_sizes: List[int], thread_options: List[int]) -> str:
+        """Huella del dispositivo y del espacio de búsqueda."""
+        key = {
+            'machine': platform.machine(),
+            'cpu': _cpu_model(),
+            'max_threads': max(thread_options),
+            'torch': torch.__version__,
+            'in_features': in_features,
+            'batch_sizes': batch_sizes,
+            'thread_options': sorted(thread_options),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def tune(self, dm, thread_options: List[int]) -> Dict:
+        """
+        Configuración para este dispositivo: la guardada o una medición nueva.
+
+        Args:
+            dm: DataManager del agente (datos y dimensión de entrada)
+            thread_options: Números de hilos de torch a probar
+
+        Returns:
+            dict con batch_size, threads, samples_per_sec y results
+        """
+        thread_options = sorted(set(max(1, int(t)) for t in thread_options))
+        batch_sizes = self.batch_sizes or [dm.batch_size]
+        key = self.fingerprint(dm.input_dim, batch_sizes, thread_options)
+        with _tune_lock:
+            saved = self._load().get(key)
+            if saved is not None:
+                logging.info(f"🎚️  Autotune ({key}): batch {saved['batch_size']}, {saved['threads']} hilos, "
+                             f"{saved['samples_per_sec']:.0f} samples/s (guardado)")
+                return saved
+            tuning = self._search(dm, batch_sizes, thread_options)
+            tuning['fingerprint'] = key
+            self._save(key, tuning)
+        return tuning
+
+    def _search(self, dm, batch_sizes: List[int], thread_options: List[int]) -> Dict:
+        X, y = dm.trainloader.dataset.X, dm.trainloader.dataset.y
+        # Sin sentido probar batches mayores que el propio dataset
+        batch_sizes = [b for b in batch_sizes if b <= max(1, len(X))] or [min(batch_sizes)]
+        logging.info(f'🎚️  Autotune: midiendo batch {batch_sizes} x hilos {thread_options}...')
+
+        start = time.time()
+        results = []
+        threads_before = torch.get_num_threads()
+        try:
+            for threads in thread_options:
+                torch.set_num_threads(threads)
+                for batch_size in batch_sizes:
+                    rates = self.benchmark(X, y, dm.input_dim, batch_size)
+                    median = float(np.median(rates))
+                    cv = float(np.std(rates) / np.mean(rates)) if np.mean(rates) > 0 else float('inf')
+                    results.append({'batch_size': batch_size, 'threads': threads,
+                                    'samples_per_sec': median, 'cv': cv})
+                    logging.info(f'   batch {batch_size:4d}, {threads} hilos: {median:8.0f} samples/s (cv {cv:.2f})')
+        finally:
+            torch.set_num_threads(threads_before)
+
+        stable = [r for r in results if r['cv'] <= self.max_cv]
+        if not stable:
+            logging.warning('⚠️  Autotune: ninguna combinación estable, se usa la más rápida')
+        best = max(stable or results, key=lambda r: r['samples_per_sec'])
+        logging.info(f"✓ Autotune en {time.time() - start:.1f}s: batch {best['batch_size']}, "
+                     f"{best['threads']} hilos, {best['samples_per_sec']:.0f} samples/s")
+        return {'batch_size': best['batch_size'], 'threads': best['threads'],
+                'samples_per_sec': best['samples_per_sec'], 'results': results,
+                'tuned_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    def benchmark(self, X: torch.Tensor, y: torch.Tensor, in_features: int, batch_size: int) -> List[float]:
+        """
+        Samples/segundo de cada repetición: pasos de entrenamiento como los de
+        execute_tabular_training (batches barajados, Adam, BCEWithLogitsLoss).
+        """
+        with torch.random.fork_rng():
+            net = MLP(in_features=in_features)
+            net.train()
+            criterion = nn.BCEWithLogitsLoss()
+            optimizer = optim.Adam(net.parameters(), lr=self.learning_rate)
+            perm = torch.randperm(len(X))
+            steps = max(3, self.samples // batch_size)
+
+            def step(i):
+                idx = perm[(i * batch_size) % len(X):][:batch_size]
+                optimizer.zero_grad()
+                loss = criterion(net(X[idx]).reshape(-1), y[idx])
+                loss.backward()
+                optimizer.step()
+                return len(idx)
+
+            for i in range(3):  # calentamiento
+                step(i)
+            rates = []
+            for _ in range(self.repeats):
+                start = time.perf_counter()
+                samples = sum(step(i) for i in range(steps))
+                rates.append(samples / (time.perf_counter() - start))
+        return rates
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def _save(self, key: str, tuning: Dict):
+        saved = self._load()
+        saved[key] = tuning
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(saved, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def thread_options(max_threads: int) -> List[int]:
+    """1, 2, 4, ... hasta max_threads (incluido)."""
+    options, t = [], 1
+    while t < max_threads:
+        options.append(t)
+        t *= 2
+    return options + [max(1, max_threads)]
+
+
+def apply_tuning(dm, tuning: Dict, governor=None):
+    """
+    Aplica la configuración elegida: tamaño de batch de los loaders y, si
+    hay governor, hilos de torch.
+
+    Args:
+        dm: DataManager del agente
+        tuning: Resultado de RuntimeAutotuner.tune
+        governor: ResourceGovernor del proceso (None = no tocar los hilos)
+    """
+    dm.set_batch_size(tuning['batch_size'])
+    if governor is not None:
+        governor.apply_process(tuning['threads'])
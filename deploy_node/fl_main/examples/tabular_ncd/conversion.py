@@ -3,13 +3,23 @@ Conversion utilities for Tabular NCD models.
 
 Convierte entre modelos PyTorch (MLP) y diccionarios de numpy arrays
 para transmisión en Federated Learning.
+
+Las instancias de MLP se reutilizan: cargar un modelo copia los arrays en
+los parámetros de una red del pool (vía torch.from_numpy, sin tensores
+intermedios), sin crear la red ni re-inicializar pesos ni re-sembrar torch.
+Exportar devuelve vistas numpy de los parámetros (memoria compartida).
 """
+import threading
 from typing import Dict
 import numpy as np
 import torch
 
 from .mlp import MLP
 
+# Redes libres que se guardan como máximo (entrenamiento, evaluaciones en
+# paralelo y agentes alojados en el mismo proceso)
+POOL_SIZE = 8
+
 
 class Converter:
     """
@@ -17,12 +27,12 @@ class Converter:
     Implementa patrón Singleton.
     """
     _singleton_cvtr = None
-    
+
     @classmethod
     def cvtr(cls, in_features: int = None):
         """
         Obtiene o crea el converter singleton.
-        
+
         Args:
             in_features: Dimensión de entrada del MLP (requerido en primera llamada)
         """
@@ -31,7 +41,7 @@ class Converter:
                 raise ValueError("in_features requerido para inicializar Converter")
             cls._singleton_cvtr = cls(in_features)
         return cls._singleton_cvtr
-    
+
     @classmethod
     def reset(cls):
         """Reinicia el singleton."""
@@ -39,35 +49,94 @@ class Converter:
 
     def __init__(self, in_features: int):
         self.in_features = in_features
+        self._pool = []
+        self._lock = threading.Lock()
+        self.created = 0  # redes construidas (el resto de cargas reutiliza)
 
     def convert_nn_to_dict_nparray(self, net: MLP) -> Dict[str, np.ndarray]:
         """
         Convierte un modelo MLP a diccionario de numpy arrays.
-        
+        Los arrays son vistas de los parámetros (sin copia) y la red vuelve
+        al pool con memoria nueva, así que no debe usarse después.
+
         Args:
             net: Modelo MLP de PyTorch
-            
+
         Returns:
             Dict con pesos y biases como numpy arrays
         """
-        state_dict = net.state_dict()
-        return {key: value.cpu().numpy() for key, value in state_dict.items()}
+        models = {key: value.detach().cpu().numpy() for key, value in net.state_dict().items()}
+        self.release(net, exported=True)
+        return models
 
     def convert_dict_nparray_to_nn(self, models: Dict[str, np.ndarray]) -> MLP:
         """
         Convierte diccionario de numpy arrays a modelo MLP.
-        
+        La red sale del pool; al terminar con ella se devuelve con
+        release() o convert_nn_to_dict_nparray().
+
         Args:
             models: Dict con pesos y biases como numpy arrays
-            
+
         Returns:
             Modelo MLP con los pesos cargados
         """
-        # Crear nueva instancia del modelo
-        net = MLP(in_features=self.in_features)
-        
-        # Convertir numpy arrays a tensors y cargar
-        state_dict = {key: torch.tensor(value) for key, value in models.items()}
-        net.load_state_dict(state_dict)
-        
+        net = self._acquire()
+        try:
+            self.load_into(net, models)
+        except Exception:
+            self.release(net)
+            raise
         return net
+
+    @staticmethod
+    def load_into(net: MLP, models: Dict[str, np.ndarray]):
+        """
+        Copia los arrays en los parámetros existentes de la red (copy_ desde
+        una vista torch.from_numpy: los arrays no se modifican ni se comparten).
+        """
+        state = net.state_dict(keep_vars=True)
+        if state.keys() != models.keys():
+            raise RuntimeError(f'Error(s) in loading state_dict for {type(net).__name__}: '
+                               f'missing {sorted(state.keys() - models.keys())}, '
+                               f'unexpected {sorted(models.keys() - state.keys())}')
+        with torch.no_grad():
+            for key, tensor in state.items():
+                value = np.asarray(models[key])
+                if value.shape != tuple(tensor.shape):
+                    raise RuntimeError(f'size mismatch for {key}: copying a param with shape {value.shape}, '
+                                       f'the shape in current model is {tuple(tensor.shape)}')
+                src = torch.from_numpy(value) if value.flags.writeable else torch.as_tensor(value.copy())
+                tensor.copy_(src)
+
+    def release(self, net: MLP, exported: bool = False):
+        """
+        Devuelve una red al pool.
+
+        Args:
+            net: Red obtenida de convert_dict_nparray_to_nn (o una MLP nueva)
+            exported: Sus parámetros se exportaron como vistas numpy; la red
+                recibe memoria nueva para no pisar esos arrays en la próxima carga
+        """
+        if not isinstance(net, MLP) or net.in_features != self.in_features:
+            return
+        with torch.no_grad():
+            for param in net.parameters():
+                param.grad = None
+                if exported:
+                    param.data = torch.empty_like(param.data)
+        with self._lock:
+            if len(self._pool) < POOL_SIZE:
+                self._pool.append(net)
+
+    def _acquire(self) -> MLP:
+        with self._lock:
+            if self._pool:
+                net = self._pool.pop()
+                net.train()
+                return net
+            self.created += 1
+        # MLP() siembra torch: sin fork_rng reiniciaría el generador global
+        # (p.ej. las permutaciones del shuffle) en cada red nueva
+        with torch.random.fork_rng():
+            return MLP(in_features=self.in_features)
@@ -5,21 +5,37 @@ Este módulo prepara los datos tabulares de defunciones para entrenamiento feder
 Cada nodo (hospital) tiene su propio CSV con datos locales.
 
 Pasos:
- 1. Cargar datos crudos del hospital (dataX.csv)
- 2. Cargar preprocessor global compartido (preprocessor_global.joblib)
- 3. Transformar features a matriz numérica
- 4. Dividir en train/val/test con estratificación
- 5. Guardar CSVs procesados
+ 1. Cargar preprocessor global compartido (preprocessor_global.joblib)
+ 2. Leer los datos crudos del hospital (dataX.csv) por bloques de filas
+ 3. Transformar cada bloque a matriz numérica
+ 4. Repartir sus filas en train/val/test con estratificación
+ 5. Escribirlas directo en la caché binaria (processed_cache.py)
+
+La memoria pico depende del tamaño del bloque (chunk_rows), no del dataset.
+
+Los datos procesados solo se regeneran cuando cambia el CSV crudo, el
+preprocessor o los parámetros del split (ver load_processed). Si el CSV
+solo creció por el final (el hospital agregó registros), se transforman
+únicamente las filas nuevas y se reparten entre train/val/test por el hash
+de la fila, de forma determinista.
 """
 import os
-import json
+import io
+import threading
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 import joblib
 import logging
 
-def get_default_config(base_dir: str, agent_name: str = "a1") -> dict:
+from .processed_cache import ProcessedCache, SPLITS, prefix_digest
+
+# Preprocessors ya cargados, por ruta: los agentes de un mismo proceso
+# (agent host) comparten una sola instancia
+_preprocessors = dict()
+_preprocessors_lock = threading.Lock()
+
+
+def get_default_config(base_dir: str, agent_name: str = "a1", raw_data_path: str = None) -> dict:
     """
     Genera configuración por defecto para el preprocesamiento.
     
@@ -30,19 +46,26 @@ def get_default_config(base_dir: str, agent_name: str = "a1") -> dict:
         artifacts/
           preprocessor_global.joblib
         fl_main/examples/tabular_ncd/  <- este módulo
+    
+    Con raw_data_path (varios hospitales en un nodo, p.ej. data/data2.csv)
+    la caché procesada va a data/processed/<nombre del archivo>/.
     """
     # Subir desde fl_main/examples/tabular_ncd/ hasta deploy_node/
     deploy_root = os.path.abspath(os.path.join(base_dir, "..", "..", ".."))
     
-    # Cada nodo tiene UN SOLO archivo: data.csv
-    raw_data_path = os.path.join(deploy_root, "data", "data.csv")
+    # Directorio de la caché de datos procesados
+    output_dir = os.path.join(deploy_root, "data", "processed")
+    
+    if raw_data_path is None:
+        # Cada nodo tiene UN SOLO archivo: data.csv
+        raw_data_path = os.path.join(deploy_root, "data", "data.csv")
+    else:
+        raw_data_path = os.path.join(deploy_root, raw_data_path)
+        output_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(raw_data_path))[0])
     
     # Preprocessor compartido
     preprocessor_path = os.path.join(deploy_root, "artifacts", "preprocessor_global.joblib")
     
-    # Directorio de salida para CSVs procesados
-    output_dir = os.path.join(deploy_root, "data", "processed")
-    
     return {
         "raw_data_path": raw_data_path,
         "preprocessor_path": preprocessor_path,
@@ -54,46 +77,150 @@ def get_default_config(base_dir: str, agent_name: str = "a1") -> dict:
         "output_dir": output_dir,
         "rename_target_to": "target",
         "drop_cols": ["hospital_cliente"],
-        "balance_strategy": "none"
+        "balance_strategy": "none",
+        # Procesar solo las filas agregadas al CSV (no aplica con balanceo)
+        "incremental": True,
+        # Filas por bloque al leer el CSV crudo (acota la memoria pico)
+        "chunk_rows": 50000
     }
 
 
-def simple_undersample(X: np.ndarray, y: np.ndarray, random_state: int):
-    """Undersampling simple de la clase mayoritaria."""
-    rng = np.random.default_rng(random_state)
-    pos_idx = np.where(y == 1)[0]
-    neg_idx = np.where(y == 0)[0]
-    
-    if len(pos_idx) == 0 or len(neg_idx) == 0:
-        return X, y
-    if len(pos_idx) == len(neg_idx):
-        return X, y
-    
-    if len(pos_idx) < len(neg_idx):
-        keep_neg = rng.choice(neg_idx, size=len(pos_idx), replace=False)
-        sel = np.concatenate([pos_idx, keep_neg])
-    else:
-        keep_pos = rng.choice(pos_idx, size=len(neg_idx), replace=False)
-        sel = np.concatenate([keep_pos, neg_idx])
-    
-    sel = rng.permutation(sel)
-    return X[sel], y[sel]
+class StreamingStratifiedSplit:
+    """
+    Reparte filas en train/val/test bloque a bloque manteniendo las
+    proporciones dentro de cada clase: tras cada bloque, cada split tiene
+    su fracción de las filas vistas de cada clase (±1). Dentro del bloque
+    las posiciones se barajan con la semilla.
+    """
+
+    def __init__(self, fracs, random_state: int):
+        self.fracs = np.asarray(fracs, dtype=float)
+        self.counts = dict()  # clase -> filas asignadas a cada split
+        self.rng = np.random.default_rng(random_state)
+
+    def assign(self, y: np.ndarray) -> np.ndarray:
+        """Índice de split (0 train, 1 val, 2 test) de cada fila del bloque."""
+        out = np.empty(len(y), dtype=np.int8)
+        for c in np.unique(y):
+            rows = np.flatnonzero(y == c)
+            counts = self.counts.setdefault(float(c), np.zeros(len(self.fracs), dtype=np.int64))
+            # Cuotas del bloque: lo que falta a cada split para su fracción,
+            # redondeado por mayor resto
+            want = np.maximum(self.fracs * (counts.sum() + len(rows)) - counts, 0)
+            share = want * len(rows) / want.sum()
+            quota = np.floor(share).astype(np.int64)
+            quota[np.argsort(quota - share)[:len(rows) - quota.sum()]] += 1
+            out[rows] = self.rng.permutation(np.repeat(np.arange(len(self.fracs)), quota))
+            counts += quota
+        return out
+
+
+def load_preprocessor(path: str):
+    """Carga el preprocessor una sola vez por proceso."""
+    with _preprocessors_lock:
+        if path not in _preprocessors:
+            logging.info(f"Cargando preprocessor desde: {path}")
+            _preprocessors[path] = joblib.load(path)
+        return _preprocessors[path]
+
+
+class _ByteRange(io.RawIOBase):
+    """Lectura de un archivo que termina en el byte `end` (para leer el CSV hasta el watermark)."""
+
+    def __init__(self, path: str, start: int, end: int):
+        self._f = open(path, 'rb')
+        self._f.seek(start)
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._end - self._f.tell())
+        if n <= 0:
+            return 0
+        return self._f.readinto(memoryview(b)[:n])
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def _csv_dtypes(preproc) -> dict:
+    """
+    Tipo de lectura fijo (texto) para las columnas que el preprocessor
+    codifica como categorías de texto. Al leer por bloques pandas infiere
+    los tipos de cada bloque por separado: un bloque donde la columna está
+    vacía la leería como float y el encoder fallaría.
+    """
+    dtypes = dict()
+    for _, transformer, columns in getattr(preproc, 'transformers_', []):
+        if not isinstance(columns, (list, tuple, np.ndarray)):
+            continue
+        steps = [step for _, step in transformer.steps] if hasattr(transformer, 'steps') else [transformer]
+        for step in steps:
+            for col, categories in zip(columns, getattr(step, 'categories_', [])):
+                if isinstance(col, str) and np.asarray(categories).dtype == object:
+                    dtypes[col] = object
+    return dtypes
+
+
+def _read_csv_chunks(path: str, start: int, end: int, chunk_rows: int, **kwargs):
+    """pd.read_csv por bloques de chunk_rows filas, de los bytes [start, end) del archivo."""
+    with io.BufferedReader(_ByteRange(path, start, end)) as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_rows, **kwargs):
+            yield chunk
+
+
+def _transform(df: pd.DataFrame, cfg: dict, preproc):
+    """
+    Features y target de un bloque de filas crudas.
+
+    Returns:
+        (X, y) como arrays float32
+    """
+    target_col = cfg['target_col']
+    if target_col not in df.columns:
+        raise ValueError(f'Target column {target_col} not found. Columns: {list(df.columns)}')
+
+    # Eliminar columnas no deseadas
+    df = df.drop(columns=[c for c in cfg.get('drop_cols', []) if c in df.columns])
+
+    # Extraer target y transformar features
+    y = df[target_col].to_numpy(dtype=np.float32)
+    X = preproc.transform(df.drop(columns=[target_col]))
+    return np.asarray(X, dtype=np.float32), y
+
+
+def hash_split(df: pd.DataFrame, cfg: dict) -> np.ndarray:
+    """
+    Split de cada fila (0 train, 1 val, 2 test) a partir del hash de sus
+    valores crudos: la misma fila cae siempre en el mismo split.
+    """
+    u = pd.util.hash_pandas_object(df, index=False).to_numpy() / 2.0 ** 64
+    train_frac, val_frac = float(cfg['train_frac']), float(cfg['val_frac'])
+    return np.where(u < train_frac, 0, np.where(u < train_frac + val_frac, 1, 2))
 
 
-def run_preprocessing(cfg: dict) -> dict:
+def run_preprocessing(cfg: dict, fingerprint: tuple = None) -> dict:
     """
-    Ejecuta el preprocesamiento con la configuración dada.
+    Ejecuta el preprocesamiento con la configuración dada y guarda los
+    splits en la caché binaria de cfg['output_dir'].
     Retorna un diccionario con metadata del proceso.
+
+    Args:
+        cfg: Configuración (get_default_config)
+        fingerprint: (fingerprint, inputs) ya calculado por load_processed
     """
     raw_path = cfg['raw_data_path']
     preproc_path = cfg['preprocessor_path']
-    target_col = cfg['target_col']
     out_dir = cfg.get('output_dir', './data')
-    os.makedirs(out_dir, exist_ok=True)
-    
-    rename_target = cfg.get('rename_target_to', 'target')
-    drop_cols = cfg.get('drop_cols', [])
+    cache = ProcessedCache(out_dir)
+    if fingerprint is None:
+        fingerprint = cache.fingerprint(cfg)
+
     balance_strategy = cfg.get('balance_strategy', 'none')
+    chunk_rows = int(cfg.get('chunk_rows', 50000))
 
     train_frac = float(cfg['train_frac'])
     val_frac = float(cfg['val_frac'])
@@ -101,81 +228,165 @@ def run_preprocessing(cfg: dict) -> dict:
     assert abs(train_frac + val_frac + test_frac - 1.0) < 1e-6, 'Fractions must sum to 1.'
     rnd = int(cfg.get('random_state', 42))
 
-    # 1) Cargar datos crudos
-    logging.info(f"Cargando datos desde: {raw_path}")
-    df = pd.read_csv(raw_path)
-    
-    if target_col not in df.columns:
-        raise ValueError(f'Target column {target_col} not found. Columns: {list(df.columns)}')
-
-    # Eliminar columnas no deseadas
-    for c in drop_cols:
-        if c in df.columns:
-            df = df.drop(columns=c)
-
-    # Extraer target
-    y = df[target_col].astype(float).to_numpy()
-    X_raw = df.drop(columns=[target_col])
+    # Solo se leen los bytes con los que se calculó el fingerprint: ese es
+    # el watermark aunque el hospital siga agregando filas
+    raw_bytes = fingerprint[1]['raw'][0]
 
-    # 2) Cargar preprocessor global
-    logging.info(f"Cargando preprocessor desde: {preproc_path}")
-    preproc = joblib.load(preproc_path)
+    # 1) Cargar preprocessor global
+    preproc = load_preprocessor(preproc_path)
 
-    # 3) Transformar features
-    X_mat = preproc.transform(X_raw)
-    n_features = X_mat.shape[1]
-    feature_cols = [f'f{i}' for i in range(n_features)]
-    logging.info(f"Features transformadas: {n_features} columnas")
-
-    # 4) Balanceo opcional
+    # Balanceo opcional: una primera pasada cuenta las clases (solo la
+    # columna target) y luego cada fila de la mayoritaria se conserva con
+    # probabilidad minoritaria/mayoritaria
+    rng = np.random.default_rng(rnd)
+    majority, keep_prob = None, 1.0
     if balance_strategy == 'undersample_majority':
-        X_mat, y = simple_undersample(X_mat, y, rnd)
-        logging.info(f"Undersampling aplicado. Nuevos tamaños: {len(y)}")
-
-    # 5) Splits estratificados
-    temp_frac = val_frac + test_frac
-    X_train, X_temp, y_train, y_temp = train_test_split(
-        X_mat, y, test_size=temp_frac, random_state=rnd,
-        stratify=y if len(np.unique(y)) > 1 else None
-    )
-    
-    if temp_frac > 0:
-        X_val, X_test, y_val, y_test = train_test_split(
-            X_temp, y_temp, test_size=(test_frac / temp_frac), random_state=rnd,
-            stratify=y_temp if len(np.unique(y_temp)) > 1 else None
-        )
-    else:
-        X_val, X_test = np.empty((0, n_features)), np.empty((0, n_features))
-        y_val, y_test = np.empty((0,)), np.empty((0,))
+        counts = pd.Series(dtype='int64')
+        for chunk in _read_csv_chunks(raw_path, 0, raw_bytes, chunk_rows, usecols=[cfg['target_col']]):
+            counts = counts.add(chunk[cfg['target_col']].value_counts(), fill_value=0)
+        if len(counts) == 2 and counts.iloc[0] != counts.iloc[1]:
+            majority, keep_prob = float(counts.idxmax()), counts.min() / counts.max()
 
-    def build_df(Xp: np.ndarray, yp: np.ndarray) -> pd.DataFrame:
-        d = pd.DataFrame(Xp, columns=feature_cols)
-        d[rename_target] = yp.astype(int)
-        return d
+    splitter = StreamingStratifiedSplit((train_frac, val_frac, test_frac), rnd)
+    raw_rows, n_features = 0, None
 
-    # 6) Guardar CSVs
-    train_df = build_df(X_train, y_train)
-    val_df = build_df(X_val, y_val)
-    test_df = build_df(X_test, y_test)
+    # 2-5) Por bloque: leer, transformar, asignar split y escribir a disco
+    logging.info(f"Cargando datos desde: {raw_path} (bloques de {chunk_rows} filas)")
+    with cache.writer() as writer:
+        for chunk in _read_csv_chunks(raw_path, 0, raw_bytes, chunk_rows, dtype=_csv_dtypes(preproc)):
+            raw_rows += len(chunk)
+            X, y = _transform(chunk, cfg, preproc)
+            del chunk
+            if n_features is None:
+                n_features = X.shape[1]
+                logging.info(f"Features transformadas: {n_features} columnas")
+            if majority is not None:
+                keep = (y != majority) | (rng.random(len(y)) < keep_prob)
+                X, y = X[keep], y[keep]
+            assign = splitter.assign(y)
+            for i, split in enumerate(SPLITS):
+                writer.add(split, X[assign == i], y[assign == i])
+        writer.commit(fingerprint[0], fingerprint[1], {'bytes': raw_bytes, 'rows': raw_rows}, n_features)
 
-    train_df.to_csv(os.path.join(out_dir, 'train.csv'), index=False)
-    val_df.to_csv(os.path.join(out_dir, 'val.csv'), index=False)
-    test_df.to_csv(os.path.join(out_dir, 'test.csv'), index=False)
-
-    logging.info(f"CSVs guardados en: {out_dir}")
-    logging.info(f"  - train.csv: {len(train_df)} samples")
-    logging.info(f"  - val.csv: {len(val_df)} samples")
-    logging.info(f"  - test.csv: {len(test_df)} samples")
+    if majority is not None:
+        logging.info(f"Undersampling aplicado. Nuevos tamaños: {sum(writer.rows.values())}")
+    logging.info(f"Caché de datos procesados guardada en: {out_dir}")
+    for split in SPLITS:
+        logging.info(f"  - {split}: {writer.rows[split]} samples")
 
     return {
         'n_features_transformed': n_features,
-        'train_samples': len(train_df),
-        'val_samples': len(val_df),
-        'test_samples': len(test_df),
-        'output_dir': out_dir
+        'train_samples': writer.rows['train'],
+        'val_samples': writer.rows['val'],
+        'test_samples': writer.rows['test'],
+        'output_dir': out_dir,
+        'fingerprint': fingerprint[0]
     }
 
 
+def _append_new_rows(cfg: dict, cache: ProcessedCache, manifest: dict, fingerprint: tuple) -> bool:
+    """
+    Preprocesamiento incremental: si el CSV crudo solo creció por el final
+    desde el watermark, transforma las filas nuevas y las agrega a la caché.
+
+    Returns:
+        False si no aplica (hay que rehacer todo)
+    """
+    raw_path = cfg['raw_data_path']
+    watermark = manifest.get('watermark')
+    inputs = fingerprint[1]
+    if not cfg.get('incremental', False) or watermark is None \
+            or cfg.get('balance_strategy', 'none') != 'none' \
+            or manifest['inputs'].get('base') != inputs['base']:
+        return False
+
+    # Lo ya procesado debe seguir intacto y terminar en un fin de línea
+    start, end = watermark['bytes'], inputs['raw'][0]
+    if end <= start or prefix_digest(raw_path, start) != manifest['inputs']['raw'][2]:
+        return False
+    with open(raw_path, 'rb') as f:
+        f.seek(start - 1)
+        if f.read(1) != b'\n':
+            return False
+
+    columns = pd.read_csv(raw_path, nrows=0).columns
+    preproc = load_preprocessor(cfg['preprocessor_path'])
+    new_rows = dict.fromkeys(SPLITS, 0)
+    rows = watermark['rows']
+    with cache.writer(append=True) as writer:
+        for chunk in _read_csv_chunks(raw_path, start, end, int(cfg.get('chunk_rows', 50000)),
+                                      header=None, names=columns, dtype=_csv_dtypes(preproc)):
+            X, y = _transform(chunk, cfg, preproc)
+            if X.shape[1] != manifest['n_features']:
+                return False  # el writer se descarta y se rehace todo
+            assign = hash_split(chunk, cfg)
+            for i, split in enumerate(SPLITS):
+                writer.add(split, X[assign == i], y[assign == i])
+                new_rows[split] += int((assign == i).sum())
+            rows += len(chunk)
+        writer.commit(fingerprint[0], inputs, {'bytes': end, 'rows': rows})
+    logging.info(f"✓ Preprocesamiento incremental: {sum(new_rows.values())} filas nuevas (" +
+                 ', '.join(f'{new_rows[s]} {s}' for s in SPLITS) + ")")
+    return True
+
+
+def _import_legacy_csv(cfg: dict, cache: ProcessedCache) -> bool:
+    """
+    Convierte los train/val/test.csv de versiones anteriores a la caché
+    binaria, para nodos que ya no tienen el CSV crudo o el preprocessor.
+    """
+    paths = {split: os.path.join(cfg['output_dir'], f'{split}.csv') for split in SPLITS}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return False
+    target = cfg.get('rename_target_to', 'target')
+    splits = dict()
+    for split, path in paths.items():
+        df = pd.read_csv(path)
+        splits[split] = (df.drop(columns=[target]).to_numpy(np.float32), df[target].to_numpy(np.float32))
+    n_features = splits['train'][0].shape[1]
+    cache.write('legacy-csv', {}, n_features, splits)
+    logging.info(f"✓ CSVs procesados importados a la caché binaria en {cfg['output_dir']}")
+    return True
+
+
+def load_processed(cfg: dict) -> dict:
+    """
+    Datos procesados de la caché binaria, regenerándola solo si cambió el
+    CSV crudo, el preprocessor o los parámetros del split. Si el CSV solo
+    recibió filas nuevas al final, se procesan solo esas.
+
+    Args:
+        cfg: Configuración (get_default_config)
+
+    Returns:
+        {split: (X, y)} con arrays float32 (memmap)
+    """
+    raw_path = cfg['raw_data_path']
+    preproc_path = cfg['preprocessor_path']
+    cache = ProcessedCache(cfg['output_dir'])
+    manifest = cache.read_manifest()
+
+    if not (os.path.exists(raw_path) and os.path.exists(preproc_path)):
+        if manifest is not None or _import_legacy_csv(cfg, cache):
+            logging.warning(f"⚠️ Sin datos crudos o preprocessor: usando la caché existente de {cfg['output_dir']}")
+            return cache.load()
+        if not os.path.exists(raw_path):
+            raise FileNotFoundError(
+                f"No se encontró el archivo de datos: {raw_path}\n"
+                f"Asegúrate de tener data.csv en deploy_node/data/")
+        raise FileNotFoundError(
+            f"No se encontró el preprocessor: {preproc_path}\n"
+            f"Asegúrate de tener preprocessor_global.joblib en deploy_node/artifacts/")
+
+    fingerprint = cache.fingerprint(cfg, manifest)
+    if manifest is not None and manifest['fingerprint'] == fingerprint[0]:
+        logging.info(f"✓ Datos procesados al día ({fingerprint[0][:12]}): sin preprocesar")
+    elif manifest is None or not _append_new_rows(cfg, cache, manifest, fingerprint):
+        logging.info("→ Datos procesados ausentes o desactualizados: preprocesando...")
+        run_preprocessing(cfg, fingerprint)
+    return cache.load()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     
@@ -0,0 +1,285 @@
+"""
+Evaluation Engine for Tabular NCD models.
+
+Evalúa un modelo en una sola pasada vectorizada sobre el conjunto de test
+(accuracy, precision, recall, F1 y loss a la vez) y guarda el resultado por
+model_id, de modo que el mismo modelo nunca se evalúa dos veces.
+
+Ruta rápida opcional (solo evaluación): el MLP compilado con TorchScript o
+torch.compile y/o con las capas nn.Linear cuantizadas a int8 (dinámica).
+La primera evaluación se compara con la de fp32; si no coincide dentro de
+la tolerancia se vuelve a fp32.
+
+Benchmark de throughput en el nodo:
+    python -m fl_main.examples.tabular_ncd.evaluation [data/dataX.csv] [--compile]
+"""
+import logging
+import sys
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .conversion import Converter
+from .tabular_training import DataManager
+
+
+def model_fingerprint(models: Dict[str, np.ndarray]) -> str:
+    """
+    Identificador por contenido para modelos sin model_id (p.ej. el modelo
+    local recién entrenado, antes de subirlo).
+    """
+    h = sha256()
+    for name in sorted(models):
+        a = np.ascontiguousarray(models[name])
+        h.update(name.encode('utf-8'))
+        h.update(str(a.dtype).encode('utf-8'))
+        h.update(str(a.shape).encode('utf-8'))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+class EvaluationEngine:
+    """
+    Evalúa modelos sobre el test set del DataManager.
+    Implementa patrón Singleton.
+    """
+    _singleton_engine = None
+    # Ruta rápida (config_agent.json, ver configure)
+    backend = 'eager'    # eager | script | compile
+    quantize = False     # int8 dinámico en las nn.Linear (en lugar del backend)
+    parity_tol = 0.01    # diferencia máxima de métricas con fp32
+
+    @classmethod
+    def configure(cls, cfg: Dict):
+        """Lee eval_backend, eval_quantize y eval_parity_tol de config_agent.json."""
+        cls.backend = cfg.get('eval_backend', 'eager')
+        cls.quantize = bool(cfg.get('eval_quantize', 0))
+        cls.parity_tol = float(cfg.get('eval_parity_tol', 0.01))
+
+    @classmethod
+    def engine(cls, cache_size: int = 8):
+        if cls._singleton_engine is None:
+            cls._singleton_engine = cls(DataManager.dm(), cache_size)
+        return cls._singleton_engine
+
+    @classmethod
+    def reset(cls):
+        """Reinicia el singleton."""
+        cls._singleton_engine = None
+
+    def __init__(self, dm: DataManager, cache_size: int = 8, chunk_size: int = 8192,
+                 backend: str = None, quantize: bool = None):
+        """
+        Args:
+            dm: DataManager con el test set
+            cache_size: Número de resultados guardados (LRU)
+            chunk_size: Filas por forward (acota la memoria en test sets grandes)
+            backend: eager | script | compile (por defecto EvaluationEngine.backend)
+            quantize: int8 dinámico, en lugar del backend (por defecto EvaluationEngine.quantize)
+        """
+        testset = dm.testloader.dataset
+        # Tensores residentes del TabularDataset (sin copia)
+        self.X = testset.X
+        self.y = testset.y
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.backend = backend if backend is not None else type(self).backend
+        self.quantize = quantize if quantize is not None else type(self).quantize
+        # Red fp32 propia de la ruta rápida (los pesos se cargan en el sitio)
+        # y su versión compilada, que comparte los parámetros
+        self._net = None
+        self._compiled = None
+        self._fast_lock = threading.Lock()
+        self.fast_path = self.backend != 'eager' or self.quantize
+        self.fallback = False  # la ruta rápida falló o no pasó la paridad
+        self._parity_checked = False
+
+    def evaluate(self, models: Dict[str, np.ndarray], model_id: Optional[str] = None) -> Dict[str, float]:
+        """
+        Métricas del modelo, calculadas una sola vez por model_id.
+
+        Args:
+            models: Modelo a evaluar
+            model_id: ID del modelo (si no hay, se usa un hash del contenido)
+
+        Returns:
+            dict con accuracy, precision, recall, f1 y loss
+        """
+        key = model_id or model_fingerprint(models)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        metrics = self.compute(models)
+
+        with self._lock:
+            self._cache[key] = metrics
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return metrics
+
+    def compute(self, models: Dict[str, np.ndarray]) -> Dict[str, float]:
+        """Métricas del modelo sin caché (ruta rápida si está activa)."""
+        if self.fast_path:
+            with self._fast_lock:
+                if self.fast_path:
+                    return self._compute_fast(models)
+
+        cvtr = Converter.cvtr()
+        net = cvtr.convert_dict_nparray_to_nn(models)
+        try:
+            return self.evaluate_net(net)
+        finally:
+            cvtr.release(net)
+
+    def _compute_fast(self, models: Dict[str, np.ndarray]) -> Dict[str, float]:
+        if self._net is None:
+            self._net = Converter.cvtr().convert_dict_nparray_to_nn(models)
+        else:
+            Converter.load_into(self._net, models)
+        self._net.eval()
+
+        try:
+            metrics = self.evaluate_net(self._fast_model())
+        except Exception as e:
+            logging.warning(f'⚠️  Evaluación {self.describe()} no soportada ({type(e).__name__}: {e}): se usa fp32')
+            self.fast_path, self.fallback = False, True
+            return self.evaluate_net(self._net)
+
+        if not self._parity_checked:
+            # Paridad con fp32 (mismos pesos) en la primera evaluación
+            self._parity_checked = True
+            reference = self.evaluate_net(self._net)
+            diff = max(abs(metrics[k] - reference[k]) for k in reference)
+            if diff > type(self).parity_tol:
+                logging.warning(f'⚠️  Evaluación {self.describe()}: diferencia {diff:.4f} con fp32 '
+                                f'(tolerancia {type(self).parity_tol}): se usa fp32')
+                self.fast_path, self.fallback = False, True
+                return reference
+            logging.info(f'✓ Evaluación {self.describe()}: paridad con fp32 (diferencia {diff:.4f})')
+        return metrics
+
+    def _fast_model(self) -> nn.Module:
+        """Módulo de evaluación sobre los pesos cargados en self._net."""
+        with warnings.catch_warnings():
+            # torch.jit y torch.ao.quantization avisan de su deprecación
+            warnings.simplefilter('ignore')
+            if self.quantize:
+                # Los pesos int8 se empaquetan por modelo (compilarlo también
+                # por modelo costaría más de lo que ahorra)
+                return torch.ao.quantization.quantize_dynamic(self._net, {nn.Linear}, dtype=torch.qint8)
+            if self._compiled is None:
+                if self.backend == 'script':
+                    self._compiled = torch.jit.script(self._net)
+                elif self.backend == 'compile':
+                    self._compiled = torch.compile(self._net, dynamic=True)
+                else:
+                    self._compiled = self._net
+            return self._compiled
+
+    def describe(self) -> str:
+        return 'int8' if self.quantize else self.backend
+
+    def evaluate_net(self, net) -> Dict[str, float]:
+        """
+        Una pasada sobre el test set: logits -> loss y matriz de confusión.
+        """
+        net.eval()
+        with torch.no_grad():
+            logits = torch.cat([net(self.X[i:i + self.chunk_size]).reshape(-1)
+                                for i in range(0, len(self.X), self.chunk_size)]) \
+                if len(self.X) else torch.empty(0)
+            loss = F.binary_cross_entropy_with_logits(logits, self.y).item() if len(self.X) else 0.0
+            preds = logits >= 0  # sigmoid(x) >= 0.5
+            labels = self.y >= 0.5
+            tp = int((preds & labels).sum())
+            fp = int((preds & ~labels).sum())
+            fn = int((~preds & labels).sum())
+            tn = len(labels) - tp - fp - fn
+
+        total = tp + tn + fp + fn
+        accuracy = (tp + tn) / total if total > 0 else 0
+        precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+        recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+
+        return {
+            'accuracy': accuracy,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'loss': loss,
+        }
+
+
+def benchmark_backends(dm: DataManager, models: Dict[str, np.ndarray],
+                       backends: List[str] = ('eager', 'script'), repeats: int = 20) -> List[Dict]:
+    """
+    Throughput de evaluación de cada backend y de int8 sobre el test set
+    del nodo, y su diferencia de métricas con fp32.
+
+    Returns:
+        Lista de dicts con backend, rows_per_sec, build_s (primera
+        evaluación: compilación/cuantización) y max_diff
+    """
+    reference = EvaluationEngine(dm, cache_size=0, backend='eager', quantize=False).compute(models)
+    results = []
+    for backend, quantize in [(b, False) for b in backends] + [('eager', True)]:
+        engine = EvaluationEngine(dm, cache_size=0, backend=backend, quantize=quantize)
+        start = time.perf_counter()
+        metrics = engine.compute(models)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(repeats):
+            engine.compute(models)
+        elapsed = (time.perf_counter() - start) / repeats
+        results.append({
+            'backend': engine.describe() + (' (-> fp32)' if engine.fallback else ''),
+            'rows_per_sec': len(engine.X) / elapsed if elapsed > 0 else 0.0,
+            'build_s': build,
+            'max_diff': max(abs(metrics[k] - reference[k]) for k in reference),
+        })
+    return results
+
+
+def log_metrics(metrics: Dict[str, float], is_local: bool):
+    model_type = 'Local' if is_local else 'Global'
+    logging.info(f'{model_type} Model Performance:')
+    logging.info(f'  Accuracy:  {metrics["accuracy"]:.4f}')
+    logging.info(f'  Precision: {metrics["precision"]:.4f}')
+    logging.info(f'  Recall:    {metrics["recall"]:.4f}')
+    logging.info(f'  F1-Score:  {metrics["f1"]:.4f}')
+    logging.info(f'  Loss:      {metrics["loss"]:.4f}')
+
+
+if __name__ == '__main__':
+    from fl_main.lib.util.helpers import set_config_file, read_config
+    from .tabular_engine import init_models
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    cfg = read_config(set_config_file('agent'))
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    dm = DataManager(1, 'a1', int(cfg.get('batch_size', 32)), args[0] if args else None)
+    backends = ['eager', 'script'] + (['compile'] if '--compile' in sys.argv else [])
+    results = benchmark_backends(dm, init_models(dm), backends)
+
+    print(f'\nEvaluación sobre {dm.num_test_samples} filas de test:')
+    print(f'{"ruta":<20}{"filas/s":>12}{"primera (s)":>14}{"dif. fp32":>12}')
+    for r in results:
+        print(f'{r["backend"]:<20}{r["rows_per_sec"]:>12.0f}{r["build_s"]:>14.3f}{r["max_diff"]:>12.4f}')
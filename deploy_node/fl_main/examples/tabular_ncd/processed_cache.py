@@ -0,0 +1,219 @@
+"""
+Caché binaria de los datos procesados (en lugar de CSVs de texto).
+
+    <output_dir>/
+      manifest.json              fingerprint, n_features, filas por split, watermark
+      train_X.f32  train_y.f32   float32 crudo, fila a fila
+      val_X.f32    val_y.f32
+      test_X.f32   test_y.f32
+
+El fingerprint combina el contenido del CSV crudo, el del preprocessor y
+los parámetros del split: la caché se regenera solo si alguno cambia. Los
+arrays se abren con np.memmap copy-on-write, así que cargar es instantáneo
+(sin parsear texto) y solo se leen las páginas que se usan.
+
+El watermark es la parte del CSV crudo ya procesada (bytes y filas): si el
+archivo solo creció por el final, writer(append=True) agrega las filas nuevas a los
+arrays sin rehacer las anteriores.
+"""
+import json
+import logging
+import os
+from hashlib import sha256
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_VERSION = 1
+SPLITS = ('train', 'val', 'test')
+# Parámetros de run_preprocessing que cambian el contenido de la caché
+SPLIT_PARAMS = ('target_col', 'train_frac', 'val_frac', 'test_frac', 'random_state',
+                'rename_target_to', 'drop_cols', 'balance_strategy')
+
+
+def file_digest(path: str, known: Optional[List] = None) -> List:
+    """
+    [tamaño, mtime_ns, sha256] de un archivo. Si tamaño y mtime coinciden
+    con `known` (de la caché anterior) se reutiliza su hash sin releerlo.
+    Solo se hashean los bytes que había al hacer stat, así el digest
+    describe exactamente lo que se procesa aunque el archivo siga creciendo.
+    """
+    st = os.stat(path)
+    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+        return list(known)
+    return [st.st_size, st.st_mtime_ns, prefix_digest(path, st.st_size)]
+
+
+def prefix_digest(path: str, nbytes: int) -> str:
+    """sha256 de los primeros nbytes de un archivo."""
+    h = sha256()
+    with open(path, 'rb') as f:
+        while nbytes > 0:
+            block = f.read(min(1 << 20, nbytes))
+            if not block:
+                break
+            h.update(block)
+            nbytes -= len(block)
+    return h.hexdigest()
+
+
+class ProcessedCache:
+    """Arrays procesados por split más su manifest, en un directorio."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+
+    def read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == CACHE_VERSION else None
+
+    def fingerprint(self, cfg: Dict, manifest: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """
+        Args:
+            cfg: Configuración del preprocesamiento (get_default_config)
+            manifest: Manifest actual (para no re-hashear archivos sin cambios)
+
+        Returns:
+            (fingerprint, {'raw': digest, 'preprocessor': digest, 'base': hash})
+            donde 'base' cubre todo menos el CSV crudo (preprocessor y split)
+        """
+        known = (manifest or {}).get('inputs', {})
+        inputs = {
+            'raw': file_digest(cfg['raw_data_path'], known.get('raw')),
+            'preprocessor': file_digest(cfg['preprocessor_path'], known.get('preprocessor')),
+        }
+        base = {
+            'version': CACHE_VERSION,
+            'preprocessor': inputs['preprocessor'][2],
+            'params': {k: cfg.get(k) for k in SPLIT_PARAMS},
+        }
+        inputs['base'] = sha256(json.dumps(base, sort_keys=True).encode('utf-8')).hexdigest()
+        key = inputs['base'] + inputs['raw'][2]
+        return sha256(key.encode('utf-8')).hexdigest(), inputs
+
+    def _array_path(self, split: str, name: str) -> str:
+        return os.path.join(self.path, f'{split}_{name}.f32')
+
+    def writer(self, append: bool = False) -> 'CacheWriter':
+        """
+        Escritura por bloques: `with cache.writer() as w: w.add(...); w.commit(...)`.
+        Con append=True los bloques se agregan a los splits existentes.
+        """
+        return CacheWriter(self, append)
+
+    def write(self, fingerprint: str, inputs: Dict, n_features: int,
+              splits: Dict[str, Tuple[np.ndarray, np.ndarray]], watermark: Optional[Dict] = None):
+        """
+        Escribe los splits completos de una vez.
+
+        Args:
+            watermark: {'bytes', 'rows'} del CSV crudo ya procesados
+        """
+        with self.writer() as w:
+            for split in SPLITS:
+                w.add(split, *splits[split])
+            w.commit(fingerprint, inputs, watermark, n_features)
+
+    def _write_manifest(self, manifest: Dict):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def load(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns:
+            {split: (X, y)} como memmaps copy-on-write (float32)
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            raise FileNotFoundError(f'No hay caché de datos procesados en {self.path}')
+        n_features = manifest['n_features']
+        splits = dict()
+        for split in SPLITS:
+            rows = manifest['rows'][split]
+            if rows == 0:
+                # np.memmap no acepta archivos vacíos
+                splits[split] = (np.empty((0, n_features), dtype=np.float32),
+                                 np.empty((0,), dtype=np.float32))
+                continue
+            X = np.memmap(self._array_path(split, 'X'), dtype=np.float32, mode='c', shape=(rows, n_features))
+            y = np.memmap(self._array_path(split, 'y'), dtype=np.float32, mode='c', shape=(rows,))
+            splits[split] = (X, y)
+        logging.info(f"✓ Caché binaria {manifest['fingerprint'][:12]}: " +
+                     ', '.join(f'{manifest["rows"][s]} {s}' for s in SPLITS))
+        return splits
+
+
+class CacheWriter:
+    """
+    Escribe los splits de una ProcessedCache bloque a bloque, directo a
+    disco. Mientras escribe la caché no tiene manifest (no es válida): el
+    manifest nuevo se escribe en commit(), así que un corte a mitad de
+    escritura solo obliga a rehacerla.
+    """
+
+    def __init__(self, cache: ProcessedCache, append: bool = False):
+        self.cache = cache
+        self.manifest = cache.read_manifest() if append else None
+        if append and self.manifest is None:
+            raise FileNotFoundError(f'No hay caché a la que agregar en {cache.path}')
+        self.rows = dict(self.manifest['rows']) if append else {split: 0 for split in SPLITS}
+        self.n_features = self.manifest['n_features'] if append else None
+
+        os.makedirs(cache.path, exist_ok=True)
+        if os.path.exists(cache.manifest_path):
+            os.remove(cache.manifest_path)
+        # Una caché nueva se escribe en .tmp y se renombra al confirmar
+        self._suffix = '' if append else '.tmp'
+        self._files = {(split, name): open(cache._array_path(split, name) + self._suffix, 'ab' if append else 'wb')
+                       for split in SPLITS for name in ('X', 'y')}
+
+    def add(self, split: str, X: np.ndarray, y: np.ndarray):
+        """Agrega filas (X, y) al final del split."""
+        if len(y) == 0:
+            return
+        self.n_features = X.shape[1]
+        np.ascontiguousarray(X, dtype=np.float32).tofile(self._files[(split, 'X')])
+        np.ascontiguousarray(y, dtype=np.float32).tofile(self._files[(split, 'y')])
+        self.rows[split] += int(len(y))
+
+    def commit(self, fingerprint: str, inputs: Dict, watermark: Optional[Dict], n_features: int = None):
+        """Cierra los archivos y escribe el manifest que valida la caché."""
+        self._close()
+        if self._suffix:
+            for split, name in self._files:
+                path = self.cache._array_path(split, name)
+                os.replace(path + self._suffix, path)
+        manifest = self.manifest or {'version': CACHE_VERSION}
+        n_features = n_features if n_features is not None else self.n_features
+        manifest.update(fingerprint=fingerprint, inputs=inputs, n_features=int(n_features or 0),
+                        rows=self.rows, watermark=watermark)
+        self.cache._write_manifest(manifest)
+        self._files = dict()
+
+    def abort(self):
+        """Descarta lo escrito; la caché queda sin manifest hasta rehacerla."""
+        self._close()
+        if self._suffix:
+            for split, name in self._files:
+                path = self.cache._array_path(split, name) + self._suffix
+                if os.path.exists(path):
+                    os.remove(path)
+        self._files = dict()
+
+    def _close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._files:
+            self.abort()
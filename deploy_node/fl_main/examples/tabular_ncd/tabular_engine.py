@@ -15,36 +15,36 @@ import sys
 import time
 import pickle
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Dict
 
 import numpy as np
-import torch
-import torch.nn as nn
-import torch.optim as optim
 
-from .mlp import MLP
-from .conversion import Converter
-from .tabular_training import DataManager, execute_tabular_training, compute_metrics
-
-from fl_main.agent.client import Client
 from fl_main.lib.util.helpers import set_config_file, read_config
-from fl_main.lib.util.metrics_logger import MetricsLogger
+from fl_main.lib.util.metrics_logger import MetricsLogger, StartupProfile
 import subprocess
 
-
-# Verificar si este nodo debe ser agregador
-cfg = read_config(set_config_file('agent'))
-role = cfg.get('role', 'agent')
-if role == 'aggregator':
-    logging.info('Starting aggregator server on this node (role==aggregator)')
-    subprocess.Popen(["python", "-m", "fl_main.aggregator.server_th"])
-    sys.exit(0)
+# torch/pandas (mlp, conversion, tabular_training, evaluation) se importan
+# dentro de las funciones: el cliente puede registrarse mientras se cargan
 
 
 class TrainingMetaData:
     """Metadatos de entrenamiento compartidos."""
     num_training_data = 500  # Samples por ronda
     agent_name = None        # Se configura en runtime
+    batch_size = 32
+    learning_rate = 0.001
+    local_epochs = 1
+    planner = None           # WorkPlanner, creado en el primer entrenamiento
+
+    @classmethod
+    def configure(cls, cfg: Dict):
+        """Lee los hiperparámetros de config_agent.json."""
+        cls.batch_size = int(cfg.get('batch_size', 32))
+        cls.learning_rate = float(cfg.get('learning_rate', 0.001))
+        # Trabajo local por ronda: hasta local_epochs, recortado al plazo de la ronda
+        cls.local_epochs = int(cfg.get('local_epochs', 1))
 
 
 def get_agent_num(agent_name: str) -> str:
@@ -56,18 +56,29 @@ def get_agent_num(agent_name: str) -> str:
     return "1"
 
 
-def init_models() -> Dict[str, np.ndarray]:
+def init_models(dm=None) -> Dict[str, np.ndarray]:
     """
     Retorna templates de modelos para indicar la estructura al agregador.
     El modelo no necesita estar entrenado.
+    
+    Args:
+        dm: DataManager del agente (por defecto el singleton)
     """
+    from .mlp import MLP
+    from .conversion import Converter
+    from .tabular_training import DataManager
+    
     # Inicializar DataManager para obtener input_dim
-    agent_name = TrainingMetaData.agent_name or "a1"
-    dm = DataManager.dm(cutoff_th=10, agent_name=agent_name)
+    if dm is None:
+        agent_name = TrainingMetaData.agent_name or "a1"
+        dm = DataManager.dm(cutoff_th=10, agent_name=agent_name)
     
-    # Inicializar Converter con la dimensión correcta
-    Converter.reset()  # Reset para asegurar dimensión correcta
+    # Inicializar Converter con la dimensión correcta (compartido por los
+    # agentes del proceso: todos usan el mismo preprocessor)
     cvtr = Converter.cvtr(in_features=dm.input_dim)
+    if cvtr.in_features != dm.input_dim:
+        Converter.reset()
+        cvtr = Converter.cvtr(in_features=dm.input_dim)
     
     # Crear modelo inicial
     net = MLP(in_features=dm.input_dim)
@@ -75,28 +86,45 @@ def init_models() -> Dict[str, np.ndarray]:
     return cvtr.convert_nn_to_dict_nparray(net)
 
 
-def training(models: Dict[str, np.ndarray], init_flag: bool = False) -> Dict[str, np.ndarray]:
+def training(models: Dict[str, np.ndarray], init_flag: bool = False,
+             cancel_event=None, time_left: float = None,
+             dm=None, planner=None) -> Dict[str, np.ndarray]:
     """
     Función de entrenamiento principal.
     
     Args:
         models: Modelos globales (diccionario de numpy arrays)
         init_flag: True si es paso inicial (solo retorna templates)
+        cancel_event: threading.Event que aborta el entrenamiento entre batches
+        time_left: Segundos disponibles para entrenar (None = sin plazo)
+        dm: DataManager del agente (por defecto el singleton)
+        planner: WorkPlanner del agente (por defecto el de TrainingMetaData)
         
     Returns:
         Modelos entrenados localmente
+        
+    Raises:
+        TrainingCancelled: si llegó un modelo global más nuevo
     """
-    agent_name = TrainingMetaData.agent_name or "a1"
+    import torch.nn as nn
+    import torch.optim as optim
+    from .conversion import Converter
+    from .tabular_training import DataManager, WorkPlanner, execute_tabular_training
     
+    agent_name = dm.agent_name if dm is not None else (TrainingMetaData.agent_name or "a1")
+    
+    if init_flag and dm is not None:
+        return init_models(dm)
     if init_flag:
         # Inicializar DataManager
-        cutoff = max(1, int(TrainingMetaData.num_training_data / 32))  # batches
-        DataManager.dm(cutoff_th=cutoff, agent_name=agent_name)
+        batch_size = TrainingMetaData.batch_size
+        cutoff = max(1, int(TrainingMetaData.num_training_data / batch_size))  # batches
+        DataManager.dm(cutoff_th=cutoff, agent_name=agent_name, batch_size=batch_size)
         return init_models()
 
     logging.info(f'--- Training (Agent: {agent_name}) ---')
     
-    dm = DataManager.dm()
+    dm = dm if dm is not None else DataManager.dm()
     cvtr = Converter.cvtr()
     
     # Convertir modelos globales a red neuronal
@@ -104,16 +132,34 @@ def training(models: Dict[str, np.ndarray], init_flag: bool = False) -> Dict[str
     
     # Configurar entrenamiento
     criterion = nn.BCEWithLogitsLoss()
-    optimizer = optim.Adam(net.parameters(), lr=0.001)
-    
-    # Entrenar
-    trained_net = execute_tabular_training(dm, net, criterion, optimizer)
+    optimizer = optim.Adam(net.parameters(), lr=TrainingMetaData.learning_rate)
+    
+    # Dimensionar el trabajo según el plazo y el throughput medido
+    if planner is None:
+        if TrainingMetaData.planner is None:
+            TrainingMetaData.planner = WorkPlanner(local_epochs=TrainingMetaData.local_epochs)
+        planner = TrainingMetaData.planner
+    max_batches = planner.plan(len(dm.trainloader), time_left)
+    deadline = time.time() + time_left if time_left is not None else None
+    dm.last_planned_batches = max_batches
+    if time_left is not None:
+        logging.info(f'📐 Plan de la ronda: {max_batches} batches en {time_left:.1f}s disponibles')
+    
+    # Entrenar (si se cancela, la red vuelve al pool del Converter)
+    try:
+        trained_net = execute_tabular_training(dm, net, criterion, optimizer, cancel_event,
+                                               max_batches=max_batches, deadline=deadline)
+    except BaseException:
+        cvtr.release(net)
+        raise
+    planner.update(dm.last_trained_batches, dm.last_train_seconds)
     
     # Convertir de vuelta a diccionario
     return cvtr.convert_nn_to_dict_nparray(trained_net)
 
 
-def compute_performance(models: Dict[str, np.ndarray], testdata, is_local: bool) -> float:
+def compute_performance(models: Dict[str, np.ndarray], testdata, is_local: bool,
+                        model_id: str = None) -> float:
     """
     Evalúa el modelo en el conjunto de test.
     
@@ -121,39 +167,21 @@ def compute_performance(models: Dict[str, np.ndarray], testdata, is_local: bool)
         models: Modelo a evaluar
         testdata: No usado (DataManager ya tiene los datos)
         is_local: True si es modelo local, False si es global
+        model_id: ID del modelo para reutilizar su evaluación
         
     Returns:
         Accuracy del modelo
     """
-    dm = DataManager.dm()
-    cvtr = Converter.cvtr()
-    
-    # Convertir a red
-    net = cvtr.convert_dict_nparray_to_nn(models)
-    net.eval()
-    
-    # Calcular métricas
-    metrics = compute_metrics(net, dm.testloader)
-    
-    model_type = 'Local' if is_local else 'Global'
-    
-    logging.info(f'{model_type} Model Performance:')
-    logging.info(f'  Accuracy:  {metrics["accuracy"]:.4f}')
-    logging.info(f'  Precision: {metrics["precision"]:.4f}')
-    logging.info(f'  Recall:    {metrics["recall"]:.4f}')
-    logging.info(f'  F1-Score:  {metrics["f1"]:.4f}')
-    
+    from .evaluation import EvaluationEngine, log_metrics
+    metrics = EvaluationEngine.engine().evaluate(models, model_id)
+    log_metrics(metrics, is_local)
     return metrics['accuracy']
 
 
-def compute_recall(models: Dict[str, np.ndarray]) -> float:
-    """Calcula el recall para early stopping."""
-    dm = DataManager.dm()
-    cvtr = Converter.cvtr()
-    net = cvtr.convert_dict_nparray_to_nn(models)
-    net.eval()
-    metrics = compute_metrics(net, dm.testloader)
-    return metrics['recall']
+def compute_recall(models: Dict[str, np.ndarray], model_id: str = None) -> float:
+    """Calcula el recall para early stopping (reutiliza la evaluación cacheada)."""
+    from .evaluation import EvaluationEngine
+    return EvaluationEngine.engine().evaluate(models, model_id)['recall']
 
 
 def judge_termination(training_count: int = 0, gm_arrival_count: int = 0) -> bool:
@@ -181,7 +209,197 @@ def prep_test_data():
     return None
 
 
+def run_rounds(fl_client, cfg: Dict, metrics_logger, dm=None, evaluator=None,
+               planner=None, train_slot=None, governor=None) -> int:
+    """
+    Bucle de rondas del agente: espera el modelo global, entrena, sube el
+    modelo local y registra las métricas.
+    
+    Args:
+        fl_client: Client del agente
+        cfg: Configuración (config_agent.json)
+        metrics_logger: MetricsLogger del agente
+        dm: DataManager del agente (por defecto el singleton)
+        evaluator: EvaluationEngine del agente (por defecto el singleton)
+        planner: WorkPlanner del agente (por defecto el de TrainingMetaData)
+        train_slot: Callable que devuelve un context manager que reserva CPU
+            para entrenar (agent host); None = sin reserva
+        governor: ResourceGovernor que limita los hilos de entrenamiento y
+            evaluación para no ahogar a los de comunicación (None = sin límites)
+        
+    Returns:
+        Número de rondas entrenadas
+    """
+    from .tabular_training import DataManager, TrainingCancelled
+    from .evaluation import EvaluationEngine, log_metrics
+    
+    dm = dm if dm is not None else DataManager.dm()
+    evaluator = evaluator if evaluator is not None else EvaluationEngine.engine()
+    
+    training_count = 0
+    gm_arrival_count = 0
+    last_eval_local = 0.0
+    
+    # Rondas en pipeline: la evaluación del modelo global corre en paralelo
+    # con el entrenamiento, y la subida del modelo local en paralelo con su
+    # evaluación y el registro de métricas (que pasan a la siguiente ronda).
+    pipeline = bool(cfg.get('pipeline_rounds', 1))
+    upload_timeout = float(cfg.get('upload_timeout', 120))
+    governed = governor.apply_thread if governor is not None else None
+    if governed is not None:
+        governed()
+    eval_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='eval_global', initializer=governed)
+    post_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='post_round', initializer=governed)
+    logging.info(f'Pipeline de rondas: {"activado" if pipeline else "desactivado"}')
+    
+    def evaluate_models(models, is_local: bool, model_id: str = None):
+        """Evalúa un modelo (una sola pasada) y devuelve (accuracy, recall, segundos)."""
+        start = time.time()
+        metrics = evaluator.evaluate(models, model_id)
+        log_metrics(metrics, is_local)
+        return metrics['accuracy'], metrics['recall'], time.time() - start
+    
+    def finish_round(round_num, round_start, global_models, models, global_future,
+                     local_eval, queued, uploads_before, stage_times, trained_round):
+        """
+        Etapa final de la ronda: evaluación local, conteo de bytes, espera de
+        la subida y registro de métricas. En pipeline corre en segundo plano.
+        """
+        if local_eval is None:
+            local_eval = evaluate_models(models, True)
+            if queued:
+                # La subida llevaba el recall del modelo global: el early
+                # stopping del agregador usa el del modelo local
+                fl_client.send_recall(local_eval[1], trained_round)
+        local_accuracy, local_recall, stage_times['eval_local'] = local_eval
+        global_accuracy, global_recall, stage_times['eval_global'] = global_future.result()
+        
+        # Calcular bytes de los modelos global y local
+        bytes_global = len(pickle.dumps(global_models))
+        bytes_local = len(pickle.dumps(models))
+        
+        num_messages_round = 1  # modelo global
+        if queued:
+            if fl_client.wait_upload(uploads_before, timeout=upload_timeout):
+                stage_times['upload'] = fl_client.last_upload_duration
+            else:
+                logging.warning(f'⚠️  Subida de la ronda {round_num} no completada en {upload_timeout}s')
+            num_messages_round += 1
+        
+        metrics_logger.log_round(
+            round_num=round_num,
+            global_accuracy=global_accuracy,
+            local_accuracy=local_accuracy,
+            global_recall=global_recall,
+            local_recall=local_recall,
+            num_messages=num_messages_round,
+            bytes_global=bytes_global,
+            bytes_local=bytes_local,
+            latency_wait_global=stage_times['wait_global'],
+            round_time=time.time() - round_start,
+            stage_times=stage_times,
+            resources=dict(governor.settings() if governor is not None else {}, batch_size=dm.batch_size)
+        )
+    
+    while judge_termination(training_count, gm_arrival_count):
+        round_start = time.time()
+        stage_times = {}
+        
+        # Esperar modelo global
+        global_models = fl_client.wait_for_global_model()
+        stage_times['wait_global'] = time.time() - round_start
+        gm_arrival_count += 1
+        
+        # Evaluar modelo global (en paralelo con el entrenamiento si hay pipeline)
+        global_future = eval_pool.submit(evaluate_models, global_models, False, fl_client.global_model_id)
+        if not pipeline:
+            global_future.result()
+        
+        # Entrenar localmente (con un hueco de CPU reservado si hay varios agentes)
+        train_start_time = time.time()
+        try:
+            with train_slot() if train_slot is not None else nullcontext():
+                # Tiempo para entrenar: lo que queda de la ronda menos la subida (y la
+                # evaluación local si no hay pipeline), medidas en la ronda anterior
+                time_left = fl_client.round_time_left()
+                if time_left is not None:
+                    time_left -= fl_client.last_upload_duration + (0.0 if pipeline else last_eval_local)
+                models = training(global_models, cancel_event=fl_client.training_cancel,
+                                  time_left=time_left, dm=dm, planner=planner)
+        except TrainingCancelled as e:
+            # Reiniciar desde el modelo global nuevo (ya está en gm_ready)
+            logging.info(f'🔁 Modelo global más nuevo disponible: reiniciando '
+                         f'({e.trained_batches} batches descartados en {time.time() - train_start_time:.1f}s)')
+            continue
+        stage_times['train'] = time.time() - train_start_time
+        training_count += 1
+        logging.info(f'--- Training Round {training_count} Complete ---')
+        
+        if pipeline:
+            # El modelo local se sube sin esperar a su evaluación: la subida
+            # lleva las métricas del modelo global recibido y el recall local
+            # (early stopping) se envía al evaluarlo, en finish_round
+            accuracy, recall, eval_time = global_future.result()
+            local_eval = None
+        else:
+            local_eval = evaluate_models(models, True)
+            accuracy, recall, eval_time = local_eval
+            last_eval_local = eval_time
+        
+        # Enviar modelo entrenado; las métricas (recall para early stopping,
+        # loss, tiempos) viajan en el mismo mensaje de actualización.
+        # El peso en la agregación son las muestras realmente procesadas.
+        uploads_before = fl_client.uploads_completed
+        queued = fl_client.send_trained_model(
+            models, 
+            max(1, int(getattr(dm, 'last_trained_samples', dm.num_train_samples))), 
+            accuracy,
+            metrics={
+                'recall': recall,
+                'evaluated_model': 'global' if pipeline else 'local',
+                'loss': getattr(dm, 'last_train_loss', None),
+                'trained_batches': getattr(dm, 'last_trained_batches', None),
+                'planned_batches': getattr(dm, 'last_planned_batches', None),
+                'trained_samples': getattr(dm, 'last_trained_samples', None),
+                'batch_size': dm.batch_size,
+                'train_threads': governor.train_threads if governor is not None else None,
+                'round_budget': time_left,
+                'train_time': stage_times['train'],
+                'eval_time': eval_time,
+                'wait_time': stage_times['wait_global'],
+            }
+        )
+        
+        # Registrar métricas (en segundo plano si hay pipeline)
+        post = post_pool.submit(finish_round, training_count, round_start, global_models, models,
+                                global_future, local_eval, queued, uploads_before, stage_times,
+                                fl_client.round)
+        if not pipeline:
+            post.result()
+        else:
+            post.add_done_callback(
+                lambda f: f.exception() and logging.error(f'Error al cerrar la ronda: {f.exception()}'))
+    
+    post_pool.shutdown(wait=True)
+    eval_pool.shutdown(wait=True)
+    return training_count
+
+
 if __name__ == '__main__':
+    startup = StartupProfile(log_dir="./metrics")
+    
+    # Verificar si este nodo debe ser agregador
+    cfg = read_config(set_config_file('agent'))
+    role = cfg.get('role', 'agent')
+    if role == 'aggregator':
+        logging.info('Starting aggregator server on this node (role==aggregator)')
+        subprocess.Popen([sys.executable, "-m", "fl_main.aggregator.server_th"])
+        sys.exit(0)
+    TrainingMetaData.configure(cfg)
+    # Arranque rápido: datos y modelo inicial se preparan mientras el
+    # cliente se registra en la DB y busca al agregador
+    fast_start = bool(cfg.get('fast_start', 1))
+    
     # Crear directorio de logs si no existe
     os.makedirs('logs', exist_ok=True)
     
@@ -206,10 +424,14 @@ if __name__ == '__main__':
     
     logging.info('=== Tabular NCD Federated Learning Client ===')
     logging.info('Dataset: Defunciones por Enfermedades No Transmisibles')
+    startup.mark('config')
     
     # Inicializar cliente FL
+    from fl_main.agent.client import Client
     fl_client = Client()
     logging.info(f'Agent IP: {fl_client.agent_ip}')
+    startup.agent_name = fl_client.agent_name
+    startup.mark('client_init')
     
     # Configurar nombre del agente
     TrainingMetaData.agent_name = fl_client.agent_name
@@ -222,78 +444,57 @@ if __name__ == '__main__':
     metrics_logger = MetricsLogger(log_dir="./metrics", agent_name=fl_client.agent_name)
     logging.info(f'📊 Metrics CSV: {metrics_logger.get_csv_path()}')
     
-    # Crear modelos iniciales (templates)
-    initial_models = training(dict(), init_flag=True)
-    
-    # Actualizar num_training_data con el tamaño real
-    dm = DataManager.dm()
-    TrainingMetaData.num_training_data = dm.num_train_samples
-    logging.info(f'Training samples: {TrainingMetaData.num_training_data}')
+    def prepare_initial_models():
+        """Carga datos (torch/pandas) y crea los modelos iniciales (templates)."""
+        start = time.time()
+        initial_models = training(dict(), init_flag=True)
+        
+        # Actualizar num_training_data con el tamaño real
+        from .tabular_training import DataManager
+        TrainingMetaData.num_training_data = DataManager.dm().num_train_samples
+        logging.info(f'Training samples: {TrainingMetaData.num_training_data}')
+        startup.record('data_and_model', time.time() - start)
+        return initial_models
     
     # Enviar modelos iniciales
-    fl_client.send_initial_model(initial_models)
+    if fast_start:
+        startup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup')
+        initial_future = startup_pool.submit(prepare_initial_models)
+        fl_client.send_initial_model_when_ready(initial_future)
+    else:
+        fl_client.send_initial_model(prepare_initial_models())
+        startup.mark('data_and_model')
     
     # Iniciar cliente FL
     fl_client.start_fl_client()
-    
-    training_count = 0
-    gm_arrival_count = 0
-    
-    while judge_termination(training_count, gm_arrival_count):
-        # Iniciar timer de ronda
-        metrics_logger.start_round()
-        wait_start_time = time.time()
-        num_messages_round = 0
-        
-        # Esperar modelo global
-        global_models = fl_client.wait_for_global_model()
-        latency_wait_global = time.time() - wait_start_time
-        gm_arrival_count += 1
-        num_messages_round += 1
-        
-        # Calcular bytes del modelo global
-        bytes_global = len(pickle.dumps(global_models))
-        
-        # Evaluar modelo global
-        global_model_performance = compute_performance(global_models, prep_test_data(), False)
-        global_recall = compute_recall(global_models)
-        
-        # Entrenar localmente
-        models = training(global_models)
-        training_count += 1
-        logging.info(f'--- Training Round {training_count} Complete ---')
-        
-        # Evaluar modelo local
-        local_accuracy = compute_performance(models, prep_test_data(), True)
-        local_recall = compute_recall(models)
-        
-        # Calcular bytes del modelo local
-        bytes_local = len(pickle.dumps(models))
-        
-        # Enviar modelo entrenado
-        fl_client.send_trained_model(
-            models, 
-            int(TrainingMetaData.num_training_data), 
-            local_accuracy
-        )
-        num_messages_round += 1
-        
-        # Enviar métrica de recall para early stopping
-        fl_client.send_recall_metric(local_recall)
-        num_messages_round += 1
-        
-        # Registrar métricas
-        metrics_logger.log_round(
-            round_num=training_count,
-            global_accuracy=global_model_performance,
-            local_accuracy=local_accuracy,
-            global_recall=global_recall,
-            local_recall=local_recall,
-            num_messages=num_messages_round,
-            bytes_global=bytes_global,
-            bytes_local=bytes_local,
-            latency_wait_global=latency_wait_global
-        )
-    
+    startup.mark('register_and_join')
+    if fast_start:
+        initial_future.result()
+        startup_pool.shutdown(wait=False)
+        startup.mark('wait_data')
+    startup.report()
+    
+    # Los hilos de comunicación ya están en marcha: limitar los de
+    # entrenamiento/evaluación (creados a partir de aquí) para no ahogarlos
+    from fl_main.agent.resource_governor import ResourceGovernor
+    governor = ResourceGovernor(cfg)
+    governor.apply_process()
+    
+    # Hilos de torch (y batch size, solo si el operador da un rango) medidos
+    # en este dispositivo la primera vez: se guardan por huella del dispositivo
+    if cfg.get('autotune', 0):
+        from .autotune import RuntimeAutotuner, apply_tuning, thread_options
+        from .tabular_training import DataManager
+        governor.apply_thread()
+        dm = DataManager.dm()
+        tuning = RuntimeAutotuner(cfg, TrainingMetaData.learning_rate).tune(dm, thread_options(governor.train_threads))
+        apply_tuning(dm, tuning, governor)
+        TrainingMetaData.batch_size = dm.batch_size
+    
+    # Ruta de evaluación (fp32, TorchScript/torch.compile, int8)
+    from .evaluation import EvaluationEngine
+    EvaluationEngine.configure(cfg)
+    
+    training_count = run_rounds(fl_client, cfg, metrics_logger, governor=governor)
     logging.info('=== Training Complete ===')
     logging.info(f'Total rounds: {training_count}')
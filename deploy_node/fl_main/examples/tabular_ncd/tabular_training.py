@@ -2,41 +2,102 @@
 Tabular Training Module for NCD Federated Learning.
 
 Proporciona:
-- TabularDataset: Dataset PyTorch para datos tabulares
+- TabularDataset: Dataset PyTorch para datos tabulares (tensores residentes)
+- TensorBatchLoader: Batches por slicing de índices sobre esos tensores
 - DataManager: Singleton que maneja train/val/test loaders
-- execute_tabular_training: Función de entrenamiento
+- WorkPlanner: Dimensiona el trabajo local según el plazo de la ronda
+- execute_tabular_training: Función de entrenamiento (cancelable)
 
 Compatible con la arquitectura semi-descentralizada de FL.
 """
 import os
+import math
+import time
 import logging
-from typing import Tuple
+from threading import Event
+from typing import Iterator, Optional, Tuple
 
 import torch
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import Dataset
 import pandas as pd
 import numpy as np
 
 
 class TabularDataset(Dataset):
-    """Dataset tabular compatible con PyTorch."""
+    """
+    Dataset tabular compatible con PyTorch.
+    Las features y el target completos viven en dos tensores float32
+    contiguos; un ítem es una vista, no un tensor nuevo.
+    """
     
     def __init__(self, dataframe: pd.DataFrame, target_col: str = "target"):
         # Excluir columnas que empiecen con 'id_' también
         feature_cols = [c for c in dataframe.columns 
                        if c != target_col and not c.startswith('id_')]
         
-        self.X = dataframe[feature_cols].values.astype("float32")
-        self.y = dataframe[target_col].values.astype("float32")
+        self.X = torch.from_numpy(np.ascontiguousarray(dataframe[feature_cols].values, dtype=np.float32))
+        self.y = torch.from_numpy(np.ascontiguousarray(dataframe[target_col].values, dtype=np.float32))
         
+    @classmethod
+    def from_arrays(cls, X: np.ndarray, y: np.ndarray) -> 'TabularDataset':
+        """
+        Dataset sobre arrays float32 ya procesados (caché binaria): los
+        tensores comparten memoria con los arrays, sin copia.
+        """
+        dataset = cls.__new__(cls)
+        dataset.X = torch.from_numpy(np.asarray(X, dtype=np.float32))
+        dataset.y = torch.from_numpy(np.asarray(y, dtype=np.float32))
+        return dataset
+
     def __len__(self):
         return len(self.X)
     
     def __getitem__(self, idx):
-        return (
-            torch.tensor(self.X[idx], dtype=torch.float32),
-            torch.tensor(self.y[idx], dtype=torch.float32)
-        )
+        return self.X[idx], self.y[idx]
+
+
+class TensorBatchLoader:
+    """
+    Reemplazo de DataLoader para TabularDataset: cada batch es un slicing
+    de los tensores (sin __getitem__ por fila ni collate). Con shuffle se
+    genera una permutación por época y los batches se toman de ella.
+    """
+    
+    def __init__(self, dataset: TabularDataset, batch_size: int = 32, shuffle: bool = False):
+        """
+        Args:
+            dataset: TabularDataset con X, y como tensores
+            batch_size: Tamaño de batch (el último puede ser menor)
+            shuffle: Permutar las filas en cada época
+        """
+        self.dataset = dataset
+        self.batch_size = max(1, int(batch_size))
+        self.shuffle = shuffle
+    
+    def __len__(self):
+        return math.ceil(len(self.dataset) / self.batch_size)
+    
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        X, y = self.dataset.X, self.dataset.y
+        n, bs = len(X), self.batch_size
+        if not self.shuffle:
+            # Vistas contiguas, sin copia
+            for i in range(0, n, bs):
+                yield X[i:i + bs], y[i:i + bs]
+            return
+        # Mismo generador global que DataLoader(shuffle=True)
+        perm = torch.randperm(n)
+        for i in range(0, n, bs):
+            idx = perm[i:i + bs]
+            yield X[idx], y[idx]
+
+
+class TrainingCancelled(Exception):
+    """El entrenamiento se interrumpió porque llegó un modelo global más nuevo."""
+
+    def __init__(self, trained_batches: int):
+        super().__init__(f'Entrenamiento cancelado tras {trained_batches} batches')
+        self.trained_batches = trained_batches
 
 
 class DataManager:
@@ -47,9 +108,9 @@ class DataManager:
     _singleton_dm = None
 
     @classmethod
-    def dm(cls, cutoff_th: int = 0, agent_name: str = "a1"):
+    def dm(cls, cutoff_th: int = 0, agent_name: str = "a1", batch_size: int = 32):
         if cls._singleton_dm is None and cutoff_th > 0:
-            cls._singleton_dm = cls(cutoff_th, agent_name)
+            cls._singleton_dm = cls(cutoff_th, agent_name, batch_size)
         return cls._singleton_dm
     
     @classmethod
@@ -57,83 +118,59 @@ class DataManager:
         """Reinicia el singleton (útil para testing)."""
         cls._singleton_dm = None
 
-    def __init__(self, cutoff_th: int, agent_name: str = "a1"):
+    def __init__(self, cutoff_th: int, agent_name: str = "a1", batch_size: int = 32,
+                 data_path: str = None):
         """
         Inicializa el DataManager.
         
         Args:
-            cutoff_th: Número de batches para entrenar por ronda
+            cutoff_th: Número de batches para entrenar por ronda (si no hay plan)
             agent_name: Nombre del agente (identificador, no afecta el archivo de datos)
+            batch_size: Tamaño de batch (config batch_size)
+            data_path: CSV crudo relativo a deploy_node (p.ej. data/data2.csv);
+                por defecto data/data.csv, el único dataset del nodo
         """
         self.agent_name = agent_name
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         
-        # deploy_node/fl_main/examples/tabular_ncd/ -> deploy_node/
-        deploy_root = os.path.abspath(os.path.join(BASE_DIR, "..", "..", ".."))
-        
-        # Directorio de datos procesados (único por nodo)
-        data_dir = os.path.join(deploy_root, "data", "processed")
-        
-        # Verificar si existen los CSVs procesados
-        train_path = os.path.join(data_dir, "train.csv")
-        val_path = os.path.join(data_dir, "val.csv")
-        test_path = os.path.join(data_dir, "test.csv")
-        
-        if not all([os.path.exists(p) for p in [train_path, val_path, test_path]]):
-            logging.info(f"⚠️ CSVs procesados no encontrados.")
-            logging.info(f"→ Ejecutando preprocesamiento automático...")
-            self._run_preprocessing(BASE_DIR, agent_name)
-        
-        # Cargar CSVs procesados
-        logging.info(f"📂 Cargando datos de: {data_dir}")
-        train_df = pd.read_csv(train_path)
-        val_df = pd.read_csv(val_path)
-        test_df = pd.read_csv(test_path)
+        # Caché de datos procesados (una por dataset); solo se preprocesa
+        # si cambiaron los datos crudos, el preprocessor o el split
+        from .data_preparation import get_default_config, load_processed
+        prep_cfg = get_default_config(BASE_DIR, agent_name, data_path)
+        logging.info(f"📂 Cargando datos de: {prep_cfg['output_dir']}")
+        splits = load_processed(prep_cfg)
+
+        # Crear datasets (comparten memoria con la caché)
+        trainset = TabularDataset.from_arrays(*splits['train'])
+        valset = TabularDataset.from_arrays(*splits['val'])
+        testset = TabularDataset.from_arrays(*splits['test'])
 
         # Detectar dimensión de entrada
-        target_col = "target"
-        feature_cols = [c for c in train_df.columns 
-                       if c != target_col and not c.startswith('id_')]
-        self.input_dim = len(feature_cols)
+        self.input_dim = trainset.X.shape[1]
         
-        logging.info(f"✓ Datos cargados: {len(train_df)} train, {len(val_df)} val, {len(test_df)} test")
+        logging.info(f"✓ Datos cargados: {len(trainset)} train, {len(valset)} val, {len(testset)} test")
         logging.info(f"✓ Input dimension: {self.input_dim} features")
 
-        # Crear datasets
-        trainset = TabularDataset(train_df, target_col=target_col)
-        valset = TabularDataset(val_df, target_col=target_col)
-        testset = TabularDataset(test_df, target_col=target_col)
-
         # Crear DataLoaders
-        self.trainloader = DataLoader(trainset, batch_size=32, shuffle=True)
-        self.valloader = DataLoader(valset, batch_size=32, shuffle=False)
-        self.testloader = DataLoader(testset, batch_size=32, shuffle=False)
+        self.batch_size = batch_size
+        self.trainloader = TensorBatchLoader(trainset, batch_size=batch_size, shuffle=True)
+        self.valloader = TensorBatchLoader(valset, batch_size=batch_size, shuffle=False)
+        self.testloader = TensorBatchLoader(testset, batch_size=batch_size, shuffle=False)
 
         self.cutoff_threshold = cutoff_th
-        self.num_train_samples = len(train_df)
-        self.num_val_samples = len(val_df)
-        self.num_test_samples = len(test_df)
+        self.num_train_samples = len(trainset)
+        self.num_val_samples = len(valset)
+        self.num_test_samples = len(testset)
 
-    def _run_preprocessing(self, base_dir: str, agent_name: str):
-        """Ejecuta preprocesamiento si no existen los CSVs."""
-        from .data_preparation import get_default_config, run_preprocessing
-        
-        cfg = get_default_config(base_dir, agent_name)
-        
-        # Verificar archivos necesarios
-        if not os.path.exists(cfg['raw_data_path']):
-            raise FileNotFoundError(
-                f"No se encontró el archivo de datos: {cfg['raw_data_path']}\n"
-                f"Asegúrate de tener data.csv en deploy_node/data/"
-            )
-        
-        if not os.path.exists(cfg['preprocessor_path']):
-            raise FileNotFoundError(
-                f"No se encontró el preprocessor: {cfg['preprocessor_path']}\n"
-                f"Asegúrate de tener preprocessor_global.joblib en deploy_node/artifacts/"
-            )
-        
-        run_preprocessing(cfg)
+    def set_batch_size(self, batch_size: int):
+        """
+        Cambia el tamaño de batch de los tres loaders (p.ej. el elegido por el
+        autotuner).
+        """
+        batch_size = max(1, int(batch_size))
+        self.batch_size = batch_size
+        for loader in (self.trainloader, self.valloader, self.testloader):
+            loader.batch_size = batch_size
 
     def get_random_batch(self, is_train: bool = True) -> Tuple[torch.Tensor, torch.Tensor]:
         """Retorna un batch aleatorio para demos."""
@@ -142,7 +179,54 @@ class DataManager:
         return features, labels
 
 
-def execute_tabular_training(dm: DataManager, net, criterion, optimizer) -> torch.nn.Module:
+class WorkPlanner:
+    """
+    Decide cuántos batches entrenar en la ronda: hasta local_epochs épocas,
+    recortadas para terminar antes del plazo según el tiempo medido por batch.
+    """
+
+    def __init__(self, local_epochs: int = 1, safety: float = 0.9, min_batches: int = 1):
+        """
+        Args:
+            local_epochs: Máximo de épocas por ronda (config local_epochs)
+            safety: Fracción del tiempo disponible que se planifica
+            min_batches: Trabajo mínimo aunque el plazo ya esté encima
+        """
+        self.local_epochs = max(1, int(local_epochs))
+        self.safety = safety
+        self.min_batches = max(1, int(min_batches))
+        self.sec_per_batch = None  # media móvil exponencial
+
+    def plan(self, batches_per_epoch: int, time_left: Optional[float]) -> int:
+        """
+        Args:
+            batches_per_epoch: len(trainloader)
+            time_left: Segundos disponibles para entrenar (None = sin plazo)
+            
+        Returns:
+            Número máximo de batches de la ronda
+        """
+        max_batches = self.local_epochs * max(1, batches_per_epoch)
+        if time_left is None or self.sec_per_batch is None:
+            return max_batches
+        fit = int(max(0.0, time_left) * self.safety / self.sec_per_batch)
+        return max(self.min_batches, min(max_batches, fit))
+
+    def update(self, batches: int, seconds: float, alpha: float = 0.5):
+        """Registra el throughput medido en la última ronda."""
+        if batches <= 0:
+            return
+        measured = seconds / batches
+        if self.sec_per_batch is None:
+            self.sec_per_batch = measured
+        else:
+            self.sec_per_batch = alpha * measured + (1 - alpha) * self.sec_per_batch
+
+
+def execute_tabular_training(dm: DataManager, net, criterion, optimizer,
+                             cancel_event: Optional[Event] = None,
+                             max_batches: Optional[int] = None,
+                             deadline: Optional[float] = None) -> torch.nn.Module:
     """
     Rutina de entrenamiento para datos tabulares.
     
@@ -151,25 +235,52 @@ def execute_tabular_training(dm: DataManager, net, criterion, optimizer) -> torc
         net: Red neuronal (MLP)
         criterion: Función de pérdida (BCEWithLogitsLoss)
         optimizer: Optimizador
+        cancel_event: Se revisa entre batches; si está activo se aborta
+        max_batches: Batches de la ronda (por defecto dm.cutoff_threshold);
+            se recorren tantas épocas como hagan falta
+        deadline: time.time() límite; no se empieza un batch que no
+            alcance a terminar antes (según el tiempo medido por batch)
         
     Returns:
         Red entrenada
+        
+    Raises:
+        TrainingCancelled: si cancel_event se activó durante el entrenamiento
     """
+    if max_batches is None:
+        max_batches = dm.cutoff_threshold
     net.train()
     running_loss = 0.0
     num_trained_batches = 0
+    num_trained_samples = 0
+    start = time.time()
     
-    for epoch in range(1):  # 1 epoch por ronda de FL
+    epoch = 0
+    while num_trained_batches < max_batches and len(dm.trainloader) > 0:
+        epoch += 1
         for i, (inputs, labels) in enumerate(dm.trainloader):
-            # Detener después de cutoff_threshold batches
-            if num_trained_batches >= dm.cutoff_threshold:
+            # Detener después de max_batches batches
+            if num_trained_batches >= max_batches:
                 break
             
+            # El siguiente batch no termina antes del plazo
+            if deadline is not None and num_trained_batches > 0:
+                per_batch = (time.time() - start) / num_trained_batches
+                if time.time() + per_batch > deadline:
+                    logging.info(f'⏱️  Plazo de la ronda: {num_trained_batches}/{max_batches} batches')
+                    max_batches = num_trained_batches
+                    break
+            
+            # Llegó un modelo global más nuevo: este trabajo se descartaría
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info(f'⏹️  Entrenamiento cancelado tras {num_trained_batches} batches')
+                raise TrainingCancelled(num_trained_batches)
+            
             # Zero gradients
             optimizer.zero_grad()
             
             # Forward
-            outputs = net(inputs).squeeze()
+            outputs = net(inputs).reshape(-1)  # (batch,) también con batches de 1
             loss = criterion(outputs, labels)
             
             # Backward
@@ -178,13 +289,21 @@ def execute_tabular_training(dm: DataManager, net, criterion, optimizer) -> torc
             
             running_loss += loss.item()
             num_trained_batches += 1
+            num_trained_samples += len(labels)
             
             if num_trained_batches % 50 == 0:
                 avg_loss = running_loss / num_trained_batches
                 logging.info(f'[Batch {num_trained_batches}] avg loss: {avg_loss:.4f}')
     
     final_loss = running_loss / max(num_trained_batches, 1)
-    logging.info(f'Entrenamiento completado: {num_trained_batches} batches, loss: {final_loss:.4f}')
+    logging.info(f'Entrenamiento completado: {num_trained_batches} batches '
+                 f'({epoch} épocas), loss: {final_loss:.4f}')
+    
+    # Guardar para las métricas de la ronda (y el peso en la agregación)
+    dm.last_train_loss = final_loss
+    dm.last_trained_batches = num_trained_batches
+    dm.last_trained_samples = num_trained_samples
+    dm.last_train_seconds = time.time() - start
     
     return net
 
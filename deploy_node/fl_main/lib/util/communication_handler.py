@@ -2,6 +2,78 @@ import websockets
 import asyncio
 import pickle
 import logging
+import threading
+import time
+from hashlib import sha256
+from typing import Any, Dict, Tuple
+
+from fl_main.lib.util.states import TransferMsgType, TransferHeaderMsgLocation, TransferAckMsgLocation
+
+# Payloads bigger than one chunk are sent through the resumable transfer protocol:
+# header -> ack(offset held by the receiver) -> chunk -> ack -> ... until complete.
+TRANSFER_CHUNK_SIZE = 64 * 1024
+# Partially received payloads are kept this long so a reconnecting peer can resume
+TRANSFER_TTL = 600
+# Retries (with exponential backoff) used by send_resumable
+TRANSFER_MAX_RETRIES = 5
+TRANSFER_BACKOFF = 1.0
+TRANSFER_MAX_BACKOFF = 10.0
+# Defaults for fan_out: parallel connections and per-target deadline (seconds)
+FANOUT_CONCURRENCY = 8
+FANOUT_DEADLINE = 15.0
+
+
+class TransferBuffers:
+    """
+    Partially received payloads indexed by transfer ID.
+    The transfer ID is the SHA256 of the whole payload, so the same message
+    sent again after a reconnection maps onto the bytes already received.
+    A buffer is owned by one connection at a time: concurrent receives of
+    identical payloads (e.g. agents of one process polling the same global
+    model) each get their own, and any released one is a valid prefix to
+    resume from.
+    """
+
+    def __init__(self, ttl: float = TRANSFER_TTL):
+        self.ttl = ttl
+        # transfer ID -> partial buffers not owned by a connection, with their last use
+        self._free = dict()
+        self._lock = threading.Lock()
+
+    def claim(self, transfer_id: str) -> bytearray:
+        """
+        Take the longest released buffer of the transfer, or a new one
+        """
+        with self._lock:
+            self._evict_stale()
+            free = self._free.get(transfer_id)
+            if not free:
+                return bytearray()
+            free.sort(key=lambda entry: len(entry[0]))
+            buf, _ = free.pop()
+            if not free:
+                del self._free[transfer_id]
+            return buf
+
+    def release(self, transfer_id: str, buf: bytearray):
+        """
+        Keep a partial buffer for a later resume
+        """
+        with self._lock:
+            self._free.setdefault(transfer_id, []).append((buf, time.time()))
+
+    def _evict_stale(self):
+        now = time.time()
+        for tid in list(self._free):
+            self._free[tid] = [(buf, ts) for buf, ts in self._free[tid] if now - ts <= self.ttl]
+            if not self._free[tid]:
+                logging.info(f'--- Partial transfer {tid[:8]} expired ---')
+                del self._free[tid]
+
+
+# One store per process, shared by every server/client websocket
+transfer_buffers = TransferBuffers()
+
 
 def init_db_server(func, ip, socket):
     """
@@ -9,7 +81,7 @@ def init_db_server(func, ip, socket):
     :param func: Function
     :param ip: IP address
     :param socket: port num
-    :return: 
+    :return:
     """
     start_server = websockets.serve(func, ip, socket,
                                     max_size=None, max_queue=None)
@@ -26,7 +98,7 @@ def init_fl_server(register, receive_msg_from_agent, model_synthesis_routine, ag
     :param aggr_ip: IP address
     :param reg_socket: port num
     :param recv_socket: port num
-    :return: 
+    :return:
     """
     loop = asyncio.get_event_loop()
     start_server = websockets.serve(register, aggr_ip, reg_socket,
@@ -42,20 +114,66 @@ def init_fl_server(register, receive_msg_from_agent, model_synthesis_routine, ag
     loop.run_until_complete(asyncio.gather(*gather_items))
     loop.run_forever()
 
-def init_client_server(func, ip, socket):
+async def serve_fl_server(register, receive_msg_from_agent, aggr_ip, reg_socket, recv_socket):
+    """
+    Open the FL server sockets in the running event loop (in-process hosting)
+    :param register: Function
+    :param receive_msg_from_agent: Function
+    :param aggr_ip: IP address
+    :param reg_socket: port num
+    :param recv_socket: port num
+    :return: the websocket servers, to be closed when the role is left
+    """
+    reg_server = await websockets.serve(register, aggr_ip, reg_socket,
+                                        max_size=None, max_queue=None)
+    recv_server = await websockets.serve(receive_msg_from_agent, aggr_ip, recv_socket,
+                                         max_size=None, max_queue=None)
+    return [reg_server, recv_server]
+
+def init_client_server(func, ip, socket, ready=None):
     """
     Start the client server
     :param func: Function
     :param ip: IP address
     :param socket: port num
-    :return: 
+    :param ready: threading.Event set once the server is listening
+    :return:
     """
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     client_server = websockets.serve(func, ip, socket, max_size=None, max_queue=None)
-    loop.run_until_complete(asyncio.gather(client_server))
+    try:
+        loop.run_until_complete(asyncio.gather(client_server))
+    finally:
+        if ready is not None:
+            ready.set()
     loop.run_forever()
 
+async def _exchange(payload: bytes, ip, socket, progress: Dict = None):
+    """
+    Send a pickled message and wait for the reply, raising on connection errors
+    :param payload: pickled message
+    :param ip: IP address
+    :param socket: port num
+    :param progress: if given, the payload always goes through the chunked
+                     protocol and progress['delivered'] is set once the receiver
+                     acknowledged the final chunk
+    :return: response message (None if the peer closed without replying)
+    """
+    wsaddr = f'ws://{ip}:{socket}'
+    async with websockets.connect(wsaddr, max_size=None, max_queue=None, ping_interval=None) as websocket:
+        if progress is None:
+            await _send_payload(payload, websocket)
+        else:
+            await _send_chunked(payload, websocket)
+            progress['delivered'] = True
+        try:
+            frame = await websocket.recv()
+        except websockets.exceptions.ConnectionClosedOK:
+            # logging.info("--- Nothing to be received ---")
+            return None
+        return await _decode_frame(frame, websocket)
+
 async def send(msg, ip, socket):
     """
     Send a message to the IP address and socket
@@ -63,23 +181,101 @@ async def send(msg, ip, socket):
     :param socket: port num
     :return: response message
     """
-    resp = None
     try:
-        wsaddr = f'ws://{ip}:{socket}'
-        async with websockets.connect(wsaddr, max_size=None, max_queue=None, ping_interval=None) as websocket:
-            await websocket.send(pickle.dumps(msg))
-            try:
-                rmsg = await websocket.recv()
-                resp = pickle.loads(rmsg)
-            except:
-                # logging.info("--- Nothing to be received ---")
-                pass
-
-            return resp
+        return await _exchange(pickle.dumps(msg), ip, socket)
     except:
         logging.error("Connection lost to the agent: " + ip)
         logging.error(f'--- Message NOT Sent ---')
-        return resp
+        return None
+
+async def send_resumable(msg, ip, socket, max_retries: int = TRANSFER_MAX_RETRIES,
+                         resend_after_delivery: bool = False):
+    """
+    Send a message and reconnect on connection drops.
+    Large payloads (in both directions) resume from the last acknowledged
+    offset instead of starting over, since both peers keep partial buffers.
+    Only a transfer that failed before its final chunk was acknowledged is
+    retried: once the receiver holds the whole message it has been handed
+    over, and sending it again would deliver it twice.
+    :param ip: IP address
+    :param socket: port num
+    :param max_retries: reconnection attempts after the first one
+    :param resend_after_delivery: for idempotent requests (polling): also
+        resend when the reply is lost, so a large reply resumes
+    :return: response message (None if not sent or if the reply was lost)
+    """
+    payload = pickle.dumps(msg)
+    progress = None if resend_after_delivery else {'delivered': False}
+    for attempt in range(max_retries + 1):
+        try:
+            return await _exchange(payload, ip, socket, progress)
+        except Exception as e:
+            if progress is not None and progress['delivered']:
+                logging.error(f'Reply from {ip}:{socket} lost after the message was delivered '
+                              f'({type(e).__name__}) - not resending')
+                return None
+            if attempt == max_retries:
+                break
+            delay = min(TRANSFER_BACKOFF * 2 ** attempt, TRANSFER_MAX_BACKOFF)
+            logging.warning(f'Connection lost to {ip}:{socket} ({type(e).__name__}) - '
+                            f'resuming in {delay:.1f}s (retry {attempt + 1}/{max_retries})')
+            await asyncio.sleep(delay)
+
+    logging.error("Connection lost to the agent: " + ip)
+    logging.error(f'--- Message NOT Sent after {max_retries} retries ---')
+    return None
+
+async def subscribe(msg, ip, socket, on_message):
+    """
+    Open a long-lived connection: send the (subscription) message once and
+    hand every message pushed by the peer to on_message until it closes.
+    Connection errors are raised so the caller can reconnect or fall back.
+    :param msg: subscription message
+    :param ip: IP address
+    :param socket: port num
+    :param on_message: callback(msg) for each pushed message
+    :return:
+    """
+    wsaddr = f'ws://{ip}:{socket}'
+    async with websockets.connect(wsaddr, max_size=None, max_queue=None) as websocket:
+        await _send_payload(pickle.dumps(msg), websocket)
+        async for frame in websocket:
+            on_message(await _decode_frame(frame, websocket))
+
+async def fan_out(msg, targets: Dict[Any, Tuple[str, int]],
+                  max_concurrency: int = FANOUT_CONCURRENCY,
+                  deadline: float = FANOUT_DEADLINE) -> Tuple[Dict[Any, Any], Dict[Any, str]]:
+    """
+    Send the same message to many peers concurrently.
+    At most max_concurrency connections are open at a time and every target
+    gets its own deadline, so a dead peer only costs its own slot.
+    :param msg: message to be sent (pickled once for all targets)
+    :param targets: Dict[key, (ip, socket)] - e.g. agent_id -> (agent_ip, socket)
+    :param max_concurrency: max number of simultaneous sends
+    :param deadline: seconds allowed per target (connect + transfer + reply)
+    :return: (responses, failures) - Dict[key, reply] of delivered targets,
+             Dict[key, reason] of the ones that failed
+    """
+    payload = pickle.dumps(msg)
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    responses, failures = dict(), dict()
+
+    async def _deliver(key, ip, socket):
+        async with semaphore:
+            try:
+                responses[key] = await asyncio.wait_for(_exchange(payload, ip, socket), deadline)
+            except asyncio.TimeoutError:
+                failures[key] = f'deadline of {deadline}s exceeded'
+            except Exception as e:
+                failures[key] = f'{type(e).__name__}: {e}'
+
+    start = time.time()
+    await asyncio.gather(*[_deliver(key, ip, socket) for key, (ip, socket) in targets.items()])
+
+    logging.info(f'--- Fan-out: {len(responses)}/{len(targets)} delivered in {time.time() - start:.2f}s ---')
+    for key, reason in failures.items():
+        logging.error(f'--- Fan-out to {key} failed: {reason} ---')
+    return responses, failures
 
 async def send_websocket(msg, websocket):
     """
@@ -90,7 +286,13 @@ async def send_websocket(msg, websocket):
     """
     while not websocket:  # wait until socket being initialized
         await asyncio.sleep(0.001)
-    await websocket.send(pickle.dumps(msg))
+    await _send_payload(pickle.dumps(msg), websocket)
+
+async def _send_payload(payload: bytes, websocket):
+    if len(payload) > TRANSFER_CHUNK_SIZE:
+        await _send_chunked(payload, websocket)
+    else:
+        await websocket.send(payload)
 
 async def receive(websocket):
     """
@@ -98,5 +300,67 @@ async def receive(websocket):
     :param websocket:
     :return: A pickled message
     """
-    return pickle.loads(await websocket.recv())
-    
\ No newline at end of file
+    return await _decode_frame(await websocket.recv(), websocket)
+
+async def _decode_frame(frame: bytes, websocket):
+    msg = pickle.loads(frame)
+    if isinstance(msg, list) and msg and msg[0] == TransferMsgType.header:
+        msg = await _receive_chunked(msg, websocket)
+    return msg
+
+async def _send_chunked(payload: bytes, websocket):
+    """
+    Send a payload in chunks, starting from the offset the receiver already holds
+    :param payload: pickled message
+    :param websocket:
+    :return:
+    """
+    transfer_id = sha256(payload).hexdigest()
+    total = len(payload)
+    await websocket.send(pickle.dumps([TransferMsgType.header, transfer_id, total]))
+
+    offset = await _receive_ack(websocket, transfer_id)
+    if offset > 0:
+        logging.info(f'--- Resuming transfer {transfer_id[:8]} at {offset}/{total} bytes ---')
+    while offset < total:
+        await websocket.send(payload[offset:offset + TRANSFER_CHUNK_SIZE])
+        offset = await _receive_ack(websocket, transfer_id)
+
+async def _receive_ack(websocket, transfer_id: str) -> int:
+    ack = pickle.loads(await websocket.recv())
+    if ack[int(TransferAckMsgLocation.msg_type)] != TransferMsgType.ack \
+            or ack[int(TransferAckMsgLocation.transfer_id)] != transfer_id:
+        raise ValueError(f'Unexpected transfer acknowledgement: {ack}')
+    return int(ack[int(TransferAckMsgLocation.offset)])
+
+async def _receive_chunked(header, websocket):
+    """
+    Receive the chunks announced by a transfer header and return the message.
+    Bytes received so far survive a dropped connection in transfer_buffers.
+    :param header: transfer header message
+    :param websocket:
+    :return: the unpickled message
+    """
+    transfer_id = header[int(TransferHeaderMsgLocation.transfer_id)]
+    total = int(header[int(TransferHeaderMsgLocation.total_size)])
+
+    buf = transfer_buffers.claim(transfer_id)
+    if len(buf) > total:
+        buf.clear()
+    if buf:
+        logging.info(f'--- Resuming transfer {transfer_id[:8]} at {len(buf)}/{total} bytes ---')
+    try:
+        await websocket.send(pickle.dumps([TransferMsgType.ack, transfer_id, len(buf)]))
+
+        while len(buf) < total:
+            buf.extend(await websocket.recv())
+            await websocket.send(pickle.dumps([TransferMsgType.ack, transfer_id, len(buf)]))
+    except BaseException:
+        # Dropped mid-transfer: keep the bytes for the sender's resume
+        transfer_buffers.release(transfer_id, buf)
+        raise
+
+    payload = bytes(buf)
+    if sha256(payload).hexdigest() != transfer_id:
+        raise ValueError(f'Corrupted transfer {transfer_id[:8]}: digest mismatch')
+    return pickle.loads(payload)
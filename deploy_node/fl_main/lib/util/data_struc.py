@@ -1,6 +1,12 @@
-from typing import Dict
+from typing import Any, Dict, List, Optional, Tuple
+from threading import Lock
+import logging
+import os
+import time
 import numpy as np
 
+from fl_main.lib.util.model_file import write_model_file, read_model_file
+
 class LimitedDict(dict):
     def __init__(self, keys):
         self._keys = keys
@@ -20,3 +26,130 @@ def convert_LDict_to_Dict(ld: LimitedDict) -> Dict[str,np.array]:
     for key, val in ld.items():
         d[key] = val[0]
     return d
+
+
+class ModelMailbox:
+    """
+    Latest model set per slot (e.g. global / local model file name),
+    handed over by reference between the comm. thread and the training loop
+    """
+    def __init__(self):
+        self._slots = dict()
+        self._lock = Lock()
+
+    def put(self, slot: str, data_dict: Dict[str, Any], meta_data: Dict[str, Any] = None):
+        with self._lock:
+            self._slots[slot] = (data_dict, meta_data if meta_data is not None else dict())
+
+    def get(self, slot: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        with self._lock:
+            return self._slots.get(slot)
+
+
+class OutboxEntry:
+    """
+    A local model upload waiting for the aggregator's acknowledgement
+    """
+    def __init__(self, agent_id: str, model_id: str, models: Dict[str, np.array],
+                 meta_data: Dict[str, Any], round: int, created: float = None):
+        self.agent_id = agent_id
+        self.model_id = model_id
+        self.models = models
+        self.meta_data = meta_data
+        self.round = round
+        self.created = created if created is not None else time.time()
+        self.attempts = 0
+        self.next_attempt = 0.0
+
+
+class Outbox:
+    """
+    Uploads not acknowledged by the aggregator yet, one model file per
+    entry under path, so they survive a crash or restart of the agent.
+    Entries are retried with exponential backoff until acked or stale.
+    """
+    def __init__(self, path: str, backoff: float = 1.0, max_backoff: float = 30.0):
+        self.path = path
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._entries = dict()
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def put(self, entry: OutboxEntry):
+        meta = {'agent_id': entry.agent_id, 'model_id': entry.model_id, 'round': entry.round,
+                'created': entry.created, 'meta_data': entry.meta_data}
+        write_model_file(self._fname(entry.model_id), entry.models, meta)
+        with self._lock:
+            self._entries[entry.model_id] = entry
+
+    def due(self) -> List[OutboxEntry]:
+        """
+        Entries whose next attempt time has come, oldest first
+        """
+        now = time.time()
+        with self._lock:
+            return sorted([e for e in self._entries.values() if e.next_attempt <= now],
+                          key=lambda e: e.created)
+
+    def next_attempt_in(self) -> Optional[float]:
+        """
+        Seconds until the earliest retry, None if the outbox is empty
+        """
+        with self._lock:
+            if not self._entries:
+                return None
+            return max(0.0, min(e.next_attempt for e in self._entries.values()) - time.time())
+
+    def failed(self, entry: OutboxEntry) -> float:
+        """
+        Schedule the next attempt of an entry
+        :return: delay in seconds
+        """
+        entry.attempts += 1
+        delay = min(self.backoff * 2 ** (entry.attempts - 1), self.max_backoff)
+        entry.next_attempt = time.time() + delay
+        return delay
+
+    def remove(self, model_id: str) -> Optional[OutboxEntry]:
+        with self._lock:
+            entry = self._entries.pop(model_id, None)
+        try:
+            os.remove(self._fname(model_id))
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def drop_older_than(self, round: int) -> List[OutboxEntry]:
+        """
+        Remove the entries trained for a round before the given one
+        (the aggregator has moved on, uploading them is pointless)
+        """
+        with self._lock:
+            stale = [e for e in self._entries.values() if e.round is not None and e.round < round]
+        for e in stale:
+            self.remove(e.model_id)
+        return stale
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _fname(self, model_id: str) -> str:
+        return os.path.join(self.path, f'{model_id}.binaryfile')
+
+    def _load(self):
+        for fname in sorted(os.listdir(self.path)):
+            if not fname.endswith('.binaryfile'):
+                continue
+            try:
+                models, meta = read_model_file(os.path.join(self.path, fname), use_mmap=False)
+                entry = OutboxEntry(meta['agent_id'], meta['model_id'], models,
+                                    meta['meta_data'], meta['round'], meta['created'])
+                self._entries[entry.model_id] = entry
+            except Exception as e:
+                logging.warning(f'Discarding unreadable outbox entry {fname}: {e}')
+                os.remove(os.path.join(self.path, fname))
+        if self._entries:
+            logging.info(f'--- {len(self._entries)} pending upload(s) recovered from the outbox ---')
@@ -4,12 +4,12 @@ import pickle
 import pathlib
 import socket
 import asyncio
+import numpy as np
 
-# MAC address is used to generate IDs
-from getmac import get_mac_address as gma
 from typing import Dict, List, Any
 from hashlib import sha256
 from fl_main.lib.util.states import ClientState, IDPrefix
+from fl_main.lib.util.model_file import write_model_file, read_model_file, is_model_file
 
 
 def set_config_file(config_type: str) -> str:
@@ -45,11 +45,20 @@ def write_config(config_path: str, config: Dict[str, Any]):
     pathlib.Path(tmp).replace(pathlib.Path(config_path))
 
 
-def generate_id() -> str:
+def _mac_address() -> str:
+    # MAC address is used to generate IDs; getmac is only imported when an
+    # ID has to be generated (it is persisted and reused afterwards)
+    from getmac import get_mac_address
+    return get_mac_address()
+
+
+def generate_id(id_dir: str = None) -> str:
     """
     Generate or load a PERSISTENT system-wide unique ID.
     The ID is stored in setups/.agent_id file and reused across restarts.
     This ensures the agent maintains the same ID after rotation/restart.
+    :param id_dir: directory of the .agent_id file instead of setups/
+        (agents hosted in one process keep one ID each)
     :return: str - ID
     """
     import os
@@ -59,7 +68,7 @@ def generate_id() -> str:
     try:
         # Get project root (where setups/ directory exists)
         project_root = pathlib.Path(__file__).parent.parent.parent.parent
-        id_file = project_root / 'setups' / '.agent_id'
+        id_file = pathlib.Path(id_dir or project_root / 'setups') / '.agent_id'
         
         # Ensure setups directory exists
         id_file.parent.mkdir(parents=True, exist_ok=True)
@@ -78,7 +87,7 @@ def generate_id() -> str:
                 logging.warning(f"Could not read existing agent_id: {e}")
         
         # Generate new ID if file doesn't exist or is invalid
-        macaddr = gma()
+        macaddr = _mac_address()
         in_time = time.time()
         raw = f'{macaddr}{in_time}'
         hash_id = sha256(raw.encode('utf-8'))
@@ -100,7 +109,7 @@ def generate_id() -> str:
         # Fallback to old behavior if path resolution fails
         import logging
         logging.error(f"Failed to use persistent ID, generating ephemeral one: {e}")
-        macaddr = gma()
+        macaddr = _mac_address()
         in_time = time.time()
         raw = f'{macaddr}{in_time}'
         hash_id = sha256(raw.encode('utf-8'))
@@ -140,19 +149,47 @@ def create_data_dict_from_models(model_id, models, component_id):
     return data_dict
 
 
-def create_meta_data_dict(perf_val, num_samples):
+def create_meta_data_dict(perf_val, num_samples, metrics: Dict[str, Any] = None):
     """
     Create the meta data dictionary from ML models
     :param perf_val: performance metrics
     :param num_samples: number of samples
+    :param metrics: extra per-round metrics (recall, loss, timings, ...)
     :return: meta_data_dict
     """
     meta_data_dict = dict()
     meta_data_dict["accuracy"] = perf_val
     meta_data_dict["num_samples"] = num_samples
+    if metrics:
+        meta_data_dict.update(metrics)
     return meta_data_dict
 
 
+def generate_model_manifest(models: Dict[str, np.array]) -> Dict[str, Any]:
+    """
+    Describe the structure of a set of models without their weights:
+    tensor names, shapes, dtypes and a hash of the whole structure
+    :param models: Dict[str,np.array] - models
+    :return: Dict[str,Any] - manifest
+    """
+    tensors = dict()
+    for name, m in models.items():
+        m = np.asarray(m)
+        tensors[name] = {'shape': list(m.shape), 'dtype': str(m.dtype)}
+    raw = json.dumps(tensors, sort_keys=True)
+    return {'tensors': tensors, 'structure_hash': sha256(raw.encode('utf-8')).hexdigest()}
+
+
+def models_from_manifest(manifest: Dict[str, Any]) -> Dict[str, np.array]:
+    """
+    Build zero-filled models with the structure given by a manifest
+    :param manifest: Dict[str,Any] - manifest from generate_model_manifest
+    :return: Dict[str,np.array] - models
+    """
+    return {name: np.zeros(t['shape'], dtype=t['dtype'])
+            for name, t in manifest['tensors'].items()}
+
+
 def compatible_data_dict_read(data_dict: Dict[str, Any]) -> List[Any]:
     # ID init
     # for compatibility with older versions
@@ -191,23 +228,27 @@ def save_model_file(data_dict: Dict[str, Any],
     :param performance_dict: Dict[str,float] - each entry shows a pair of a model id and its performance
     :return:
     """
-    data_dict['performance'] = performance_dict
+    meta_data = {k: v for k, v in data_dict.items() if k != 'models'}
+    meta_data['performance'] = performance_dict
 
-    fname = f'{path}/{name}'
-    with open(fname, 'wb') as f:
-        pickle.dump(data_dict, f)
+    write_model_file(f'{path}/{name}', data_dict['models'], meta_data)
 
 
 def load_model_file(path: str, name: str) -> (Dict[str, Any], Dict[str, float]):
     """
-    Read a local model file and return the unpickled models
+    Read a local model file; the models are memory-mapped (see model_file).
+    Files written in the older pickle format are still readable.
     :param path: str - path to the directory
     :param name: str - model file name
     :return: Dict[str,np.array] - models
     """
     fname = f'{path}/{name}'
-    with open(fname, 'rb') as f:
-        data_dict = pickle.load(f)
+    if is_model_file(fname):
+        models, data_dict = read_model_file(fname)
+        data_dict['models'] = models
+    else:
+        with open(fname, 'rb') as f:
+            data_dict = pickle.load(f)
 
     performance_dict = data_dict.pop('performance')
 
@@ -24,7 +24,8 @@ def generate_db_push_message(component_id: str,
 def generate_lmodel_update_message(agent_id: str,
                                    model_id: str,
                                    local_models: Dict[str,np.array],
-                                   performance_dict: Dict[str,float]) -> List[Any]:
+                                   performance_dict: Dict[str,float],
+                                   round: int = None) -> List[Any]:
     msg = list()
     msg.append(AgentMsgType.update)  # 0
     msg.append(agent_id)  # 1
@@ -32,18 +33,21 @@ def generate_lmodel_update_message(agent_id: str,
     msg.append(local_models)  # 3
     msg.append(time.time())  # 4
     msg.append(performance_dict)  # 5
+    msg.append(round)  # 6
     return msg
 
 def generate_cluster_model_dist_message(aggregator_id: str,
                                         model_id: str,
                                         round: int,
-                                        models: Dict[str,np.array]) -> List[Any]:
+                                        models: Dict[str,np.array],
+                                        round_budget: float = None) -> List[Any]:
     msg = list()
     msg.append(AggMsgType.update)  # 0
     msg.append(aggregator_id)  # 1
     msg.append(model_id)  # 2
     msg.append(round)  # 3
     msg.append(models)  # 4
+    msg.append(round_budget)  # 5
     return msg
 
 def generate_agent_participation_message(agent_name: str,
@@ -55,7 +59,14 @@ def generate_agent_participation_message(agent_name: str,
                                          exch_socket: str,
                                          gene_time: float,
                                          meta_dict: Dict[str,float],
-                                         agent_ip: str) -> List[Any]:
+                                         agent_ip: str,
+                                         round: int = 0,
+                                         manifest: Dict[str,Any] = None) -> List[Any]:
+    """
+    Participation message sent by an agent on registration.
+    models is None when only the manifest (structure) is sent; the aggregator
+    answers with a weights_request if it needs the initial weights.
+    """
     msg = list()
     msg.append(AgentMsgType.participate)  # 0
     msg.append(agent_id)  # 1
@@ -67,7 +78,9 @@ def generate_agent_participation_message(agent_name: str,
     msg.append(gene_time)  # 7
     msg.append(meta_dict)  # 8
     msg.append(agent_ip)  # 9
-    msg.append(agent_name)  # 9
+    msg.append(agent_name)  # 10
+    msg.append(round)  # 11
+    msg.append(manifest)  # 12
     return msg
 
 def generate_rotation_message(new_aggregator_id: str,
@@ -93,6 +106,18 @@ def generate_ack_message():
     msg.append(AggMsgType.ack) # 0
     return msg
 
+def generate_upload_ack_message(model_id: str, duplicate: bool = False):
+    msg = list()
+    msg.append(AggMsgType.ack) # 0
+    msg.append(model_id) # 1
+    msg.append(duplicate) # 2
+    return msg
+
+def generate_weights_request_message():
+    msg = list()
+    msg.append(AggMsgType.weights_request) # 0
+    return msg
+
 def generate_agent_participation_confirm_message(aggregator_id: str,
                                                  model_id: str,
                                                  models: Dict[str,Any],
@@ -100,7 +125,8 @@ def generate_agent_participation_confirm_message(aggregator_id: str,
                                                  agent_id: str,
                                                  exch_socket: str,
                                                  recv_socket: str,
-                                                 aggregator_ip: str = "") -> List[Any]:
+                                                 aggregator_ip: str = "",
+                                                 round_budget: float = None) -> List[Any]:
     """
     Welcome/confirm message sent by aggregator to an agent on registration.
     Fields:
@@ -113,6 +139,7 @@ def generate_agent_participation_confirm_message(aggregator_id: str,
      6: exch_socket (port for exchange)
      7: recv_socket (port for polling/recv)
      8: aggregator_ip (optional, for rotation)
+     9: round_budget (optional, seconds left until the round deadline)
     """
     msg = list()
     msg.append(AggMsgType.welcome)  # 0
@@ -124,6 +151,7 @@ def generate_agent_participation_confirm_message(aggregator_id: str,
     msg.append(exch_socket)        # 6
     msg.append(recv_socket)        # 7
     msg.append(aggregator_ip)      # 8 (optional)
+    msg.append(round_budget)       # 9 (optional)
     return msg
 
 def generate_polling_message(round: int, agent_id: str):
@@ -133,6 +161,19 @@ def generate_polling_message(round: int, agent_id: str):
     msg.append(agent_id) # 2
     return msg
 
+def generate_round_query_message(round: int, agent_id: str):
+    msg = list()
+    msg.append(AgentMsgType.round_query) # 0
+    msg.append(round) # 1
+    msg.append(agent_id) # 2
+    return msg
+
+def generate_round_info_message(round: int):
+    msg = list()
+    msg.append(AggMsgType.round_info) # 0
+    msg.append(round) # 1
+    return msg
+
 def generate_recall_up(recall_value: float, round: int, agent_id: str):
     """Generate recall upload message from agent to aggregator."""
     msg = list()
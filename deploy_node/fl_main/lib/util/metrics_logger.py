@@ -3,7 +3,6 @@ Metrics Logger for Federated Learning
 Records performance metrics to CSV file for each round
 """
 import csv
-import os
 import time
 import logging
 from pathlib import Path
@@ -44,8 +43,25 @@ class MetricsLogger:
             'bytes_round_total',
             'bytes_cumulative',
             'latency_wait_global',
-            'round_time'
+            'round_time',
+            # Per-stage timings of the (pipelined) agent round
+            't_wait_global',
+            't_eval_global',
+            't_train',
+            't_eval_local',
+            't_upload',
+            # Training batch size, resource governor settings and peak memory
+            'batch_size',
+            'train_threads',
+            'train_cores',
+            'reserved_cores',
+            'train_nice',
+            'memory_limit_mb',
+            'peak_rss_mb'
         ]
+        self.stage_names = ['wait_global', 'eval_global', 'train', 'eval_local', 'upload']
+        self.resource_names = ['batch_size', 'train_threads', 'train_cores', 'reserved_cores',
+                               'train_nice', 'memory_limit_mb', 'peak_rss_mb']
         
         # Cumulative byte counter
         self.cumulative_bytes = 0
@@ -53,6 +69,9 @@ class MetricsLogger:
         # Round start time tracker
         self.round_start_time = None
         
+        # CSV de una versión anterior (otras columnas): archivarlo y empezar uno nuevo
+        self._rotate_if_headers_changed()
+        
         # Si el CSV existe, cargar bytes acumulativos de la última línea
         if self.csv_file.exists():
             try:
@@ -74,6 +93,20 @@ class MetricsLogger:
         
         logging.info(f"MetricsLogger initialized (new file): {self.csv_file}")
     
+    def _rotate_if_headers_changed(self):
+        """Rename an existing CSV whose header differs from the current columns"""
+        if not self.csv_file.exists():
+            return
+        try:
+            with open(self.csv_file, 'r', newline='') as f:
+                existing = next(csv.reader(f), None)
+        except Exception:
+            existing = None
+        if existing is not None and existing != self.headers:
+            archived = self.csv_file.with_name(f"{self.csv_file.stem}.{datetime.now():%Y%m%d_%H%M%S}.csv")
+            self.csv_file.rename(archived)
+            logging.info(f"📁 CSV con columnas anteriores archivado en: {archived}")
+    
     def _init_csv(self):
         """Create CSV file with headers only if file doesn't exist"""
         if not self.csv_file.exists():
@@ -96,7 +129,10 @@ class MetricsLogger:
                   num_messages=0,
                   bytes_global=0,
                   bytes_local=0,
-                  latency_wait_global=0.0):
+                  latency_wait_global=0.0,
+                  round_time=None,
+                  stage_times=None,
+                  resources=None):
         """
         Log metrics for a completed round
         
@@ -109,9 +145,14 @@ class MetricsLogger:
         :param bytes_global: Bytes received for global model
         :param bytes_local: Bytes sent for local model
         :param latency_wait_global: Time waiting for global model (seconds)
+        :param round_time: Round duration (seconds); measured from start_round() if None
+        :param stage_times: Dict stage name -> seconds (see self.stage_names)
+        :param resources: Dict of ResourceGovernor.settings() plus batch_size (see self.resource_names)
         """
         # Calculate round time
-        round_time = time.time() - self.round_start_time if self.round_start_time else 0.0
+        if round_time is None:
+            round_time = time.time() - self.round_start_time if self.round_start_time else 0.0
+        stage_times = stage_times or {}
         
         # Calculate round total bytes
         bytes_round_total = bytes_global + bytes_local
@@ -135,6 +176,13 @@ class MetricsLogger:
             'latency_wait_global': f"{latency_wait_global:.4f}",
             'round_time': f"{round_time:.4f}"
         }
+        for stage in self.stage_names:
+            t = stage_times.get(stage)
+            row[f't_{stage}'] = f"{t:.4f}" if t is not None else ''
+        resources = resources or {}
+        for name in self.resource_names:
+            v = resources.get(name)
+            row[name] = (f"{v:.1f}" if isinstance(v, float) else v) if v is not None else ''
         
         # Write to CSV
         with open(self.csv_file, 'a', newline='') as f:
@@ -150,6 +198,8 @@ class MetricsLogger:
                     f"Msgs={num_messages}, "
                     f"Bytes={bytes_round_total}, "
                     f"Time={round_time:.2f}s")
+        if stage_times:
+            logging.info("⏱️  Etapas: " + ', '.join(f"{k}={v:.2f}s" for k, v in stage_times.items() if v is not None))
         
         # Reset round timer
         self.round_start_time = None
@@ -276,3 +326,61 @@ class AggregatorMetricsLogger:
     def get_csv_path(self):
         """Return the path to the CSV file"""
         return str(self.csv_file)
+
+
+class StartupProfile:
+    """
+    Measured breakdown of the agent startup: time of each phase since the
+    process started, appended as one row per start to startup_<agent>.csv.
+    """
+
+    def __init__(self, log_dir="./metrics", agent_name="agent"):
+        """
+        :param log_dir: Directory to store CSV files
+        :param agent_name: Name of the agent (for filename)
+        """
+        self.log_dir = Path(log_dir)
+        self.agent_name = agent_name
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.phases = []  # (name, seconds spent in the phase)
+        self.parallel = []  # phases overlapped with the sequential ones
+
+    def mark(self, phase: str):
+        """Close a phase: time spent since the previous mark"""
+        now = time.time()
+        self.phases.append((phase, now - self.last_time))
+        self.last_time = now
+
+    def record(self, phase: str, seconds: float):
+        """Add a phase that ran in parallel (does not move the sequential marks)"""
+        self.parallel.append((phase, seconds))
+
+    def total(self) -> float:
+        return self.last_time - self.start_time
+
+    def report(self):
+        """Log the breakdown and append it to the startup CSV"""
+        logging.info(f'🚀 Arranque en {self.total():.3f}s:')
+        for phase, seconds in self.phases:
+            logging.info(f'   {phase:<22} {seconds:.3f}s')
+        for phase, seconds in self.parallel:
+            logging.info(f'   {phase:<22} {seconds:.3f}s (en paralelo)')
+
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        csv_file = self.log_dir / f"startup_{self.agent_name}.csv"
+        phases = self.phases + sorted(self.parallel)
+        headers = ['timestamp', 'total'] + [phase for phase, _ in phases]
+        new_file = not csv_file.exists()
+        if not new_file:
+            with open(csv_file, 'r', newline='') as f:
+                new_file = next(csv.reader(f), None) != headers
+            if new_file:
+                archived = csv_file.with_name(f"{csv_file.stem}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+                csv_file.replace(archived)
+        with open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(headers)
+            writer.writerow([datetime.now().isoformat(), f'{self.total():.4f}'] +
+                            [f'{seconds:.4f}' for _, seconds in phases])
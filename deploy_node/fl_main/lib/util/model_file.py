@@ -0,0 +1,125 @@
+"""
+On-disk format for model files (agent model files and DB model files).
+
+    [magic 8B][header length 8B, little endian][header JSON][padding]
+    [tensor 0 raw bytes][padding][tensor 1 raw bytes][padding]...
+
+The header holds a manifest (name, dtype, shape, offset, nbytes per tensor)
+and the JSON-serializable meta data (model_id, performance, ...). Tensors
+start on page boundaries, so they can be np.memmap-ed and only the pages
+actually touched are read. Files are written to a temp file and renamed,
+so a crash mid-write never leaves a corrupt model file behind; each write
+has its own temp file, so concurrent writers of a path do not mix.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+MAGIC = b'FLMODEL1'
+PAGE_SIZE = mmap.PAGESIZE
+_PREFIX = struct.Struct('<8sQ')
+
+
+def _align(offset: int) -> int:
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+
+def _to_json(obj):
+    # numpy scalars in performance dicts (e.g. np.float64 accuracy); anything
+    # else that JSON cannot hold fails here instead of coming back as a string
+    if isinstance(obj, (np.integer, np.floating, np.bool_)):
+        return obj.item()
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+        return obj.tolist()
+    raise TypeError(f'Meta data value of type {type(obj).__name__} is not JSON serializable')
+
+
+def is_model_file(fname: str) -> bool:
+    """
+    Check if a file is in this format (older files are plain pickles)
+    :param fname: str - file path
+    :return: bool
+    """
+    try:
+        with open(fname, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_model_file(fname: str, models: Dict[str, np.ndarray], meta_data: Dict[str, Any] = None):
+    """
+    Write models and their meta data atomically (temp file + rename)
+    :param fname: str - file path
+    :param models: Dict[str,np.array] - models
+    :param meta_data: Dict[str,Any] - JSON-serializable meta data (numpy
+        numbers and numeric arrays are stored as numbers and lists; any other
+        type raises TypeError before the file is touched)
+    :return:
+    """
+    arrays = {name: np.asarray(m, order='C') for name, m in models.items()}
+    for name, a in arrays.items():
+        if a.dtype.hasobject:
+            raise ValueError(f'Tensor {name} has dtype {a.dtype}, which cannot be stored raw')
+
+    # The header size depends on the offsets and vice versa: lay the tensors
+    # out after an upper bound of the header, then pad the real header to it
+    tensors = [{'name': name, 'dtype': a.dtype.str, 'shape': list(a.shape),
+                'offset': 0, 'nbytes': int(a.nbytes)} for name, a in arrays.items()]
+    header = {'version': 1, 'meta': meta_data or dict(), 'tensors': tensors}
+    offset = _align(_PREFIX.size + len(json.dumps(header, default=_to_json)) + 32 * len(tensors) + 64)
+    for t in tensors:
+        t['offset'] = offset
+        offset = _align(offset + t['nbytes'])
+    header_bytes = json.dumps(header, default=_to_json).encode('utf-8')
+
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(fname) or '.',
+                                    prefix=f'{os.path.basename(fname)}.', suffix='.tmp', delete=False)
+    try:
+        with f:
+            f.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for t, a in zip(tensors, arrays.values()):
+                f.seek(t['offset'])
+                f.write(a.tobytes())
+            f.truncate(max(offset, f.tell()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, fname)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+def read_model_file(fname: str, use_mmap: bool = True) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Read a model file. With use_mmap the tensors are copy-on-write memory
+    maps: loading is instant and pages are read lazily on first access.
+    :param fname: str - file path
+    :param use_mmap: bool - memory-map the tensors instead of reading them
+    :return: Dict[str,np.array] - models, Dict[str,Any] - meta data
+    """
+    with open(fname, 'rb') as f:
+        magic, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{fname} is not a model file')
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+        models = dict()
+        for t in header['tensors']:
+            dtype, shape = np.dtype(t['dtype']), tuple(t['shape'])
+            if t['nbytes'] == 0:
+                models[t['name']] = np.empty(shape, dtype=dtype)
+            elif use_mmap:
+                # np.memmap reads an empty shape as "rest of the file": map 0-d tensors as (1,)
+                m = np.memmap(fname, dtype=dtype, mode='c', offset=t['offset'], shape=shape or (1,))
+                models[t['name']] = m.reshape(shape)
+            else:
+                f.seek(t['offset'])
+                models[t['name']] = np.frombuffer(f.read(t['nbytes']), dtype=dtype).reshape(shape).copy()
+    return models, header['meta']
@@ -0,0 +1,245 @@
+"""
+Network condition emulator for local benchmarking of the FL protocol.
+
+Runs one TCP proxy per link (e.g. agent->DB, agent->aggregator) on a single
+Linux box. Every link forwards to its real target and injects, per direction:
+- bandwidth cap (token bucket, kbit/s)
+- latency + jitter (in-order delivery, like TCP)
+- packet loss (emulated as retransmission delays, since TCP never drops data)
+- disconnects (abrupt close of both sides, probability per MB transferred)
+
+Per-link counters are appended to metrics/netem_stats.csv so they can be
+read next to metrics_aggregator.csv / metrics_<agent>.csv (round time,
+bytes, timeouts) of the same run.
+
+Usage:
+    python -m fl_main.lib.util.net_emulator [setups/config_netem.json]
+"""
+import asyncio
+import csv
+import logging
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from fl_main.lib.util.helpers import read_config, set_config_file
+
+# Read size per forwarding step and TCP segment size used for loss emulation
+READ_SIZE = 16 * 1024
+SEGMENT_SIZE = 1460
+
+
+class LinkProfile:
+    """
+    Network conditions of one link, read from an entry of config_netem.json
+    """
+
+    def __init__(self, cfg: Dict[str, Any]):
+        self.name = cfg['name']
+        self.listen_ip = cfg.get('listen_ip', '127.0.0.1')
+        self.listen_port = int(cfg['listen_port'])
+        self.target_ip = cfg.get('target_ip', '127.0.0.1')
+        self.target_port = int(cfg['target_port'])
+
+        self.bandwidth_kbps = float(cfg.get('bandwidth_kbps', 0))  # 0 = unlimited
+        self.latency_ms = float(cfg.get('latency_ms', 0))
+        self.jitter_ms = float(cfg.get('jitter_ms', 0))
+        self.loss = float(cfg.get('loss', 0.0))  # probability per TCP segment
+        self.loss_penalty_ms = float(cfg.get('loss_penalty_ms', 200))  # retransmission timeout
+        self.disconnect_per_mb = float(cfg.get('disconnect_per_mb', 0.0))
+
+    def transmission_delay(self, nbytes: int) -> float:
+        if self.bandwidth_kbps <= 0:
+            return 0.0
+        return nbytes * 8 / (self.bandwidth_kbps * 1000)
+
+    def propagation_delay(self) -> float:
+        jitter = random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def lost_segments(self, nbytes: int) -> int:
+        if self.loss <= 0:
+            return 0
+        segments = -(-nbytes // SEGMENT_SIZE)
+        return sum(1 for _ in range(segments) if random.random() < self.loss)
+
+    def should_disconnect(self, nbytes: int) -> bool:
+        return self.disconnect_per_mb > 0 and random.random() < self.disconnect_per_mb * nbytes / (1024 * 1024)
+
+
+class LinkStats:
+    """
+    Counters of one link since the emulator started
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.connections = 0
+        self.bytes_up = 0  # client -> target
+        self.bytes_down = 0  # target -> client
+        self.retransmissions = 0
+        self.disconnects = 0
+        self.failed_connects = 0
+
+    def as_row(self) -> Dict[str, Any]:
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'link': self.name,
+            'connections': self.connections,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'retransmissions': self.retransmissions,
+            'disconnects': self.disconnects,
+            'failed_connects': self.failed_connects,
+        }
+
+
+class EmulatedLink:
+    """
+    TCP proxy listening on (listen_ip, listen_port) that forwards every
+    connection to (target_ip, target_port) through the link profile
+    """
+
+    def __init__(self, profile: LinkProfile):
+        self.profile = profile
+        self.stats = LinkStats(profile.name)
+        self.server = None
+
+    async def start(self):
+        p = self.profile
+        self.server = await asyncio.start_server(self._handle, p.listen_ip, p.listen_port)
+        logging.info(f'🌐 Link {p.name}: {p.listen_ip}:{p.listen_port} -> {p.target_ip}:{p.target_port} '
+                     f'(bw={p.bandwidth_kbps or "∞"} kbps, lat={p.latency_ms}±{p.jitter_ms} ms, '
+                     f'loss={p.loss}, disc/MB={p.disconnect_per_mb})')
+
+    async def _handle(self, client_reader, client_writer):
+        p = self.profile
+        try:
+            target_reader, target_writer = await asyncio.open_connection(p.target_ip, p.target_port)
+        except OSError as e:
+            self.stats.failed_connects += 1
+            logging.warning(f'Link {p.name}: target unreachable ({e})')
+            client_writer.close()
+            return
+
+        self.stats.connections += 1
+        closed, dropped = asyncio.Event(), asyncio.Event()
+        pipes = [
+            asyncio.ensure_future(self._pipe(client_reader, target_writer, 'up', closed, dropped)),
+            asyncio.ensure_future(self._pipe(target_reader, client_writer, 'down', closed, dropped)),
+        ]
+        await closed.wait()
+        for t in pipes:
+            t.cancel()
+        for w in (client_writer, target_writer):
+            if dropped.is_set():
+                # Abort instead of a clean FIN: the peers see a dropped link
+                w.transport.abort()
+            else:
+                w.close()
+
+    async def _pipe(self, reader, writer, direction: str, closed: asyncio.Event, dropped: asyncio.Event):
+        """
+        Forward one direction of a connection. Chunks are delivered in order,
+        each one after its transmission, propagation and retransmission delays.
+        """
+        p = self.profile
+        queue = asyncio.Queue()
+        link_free_at = time.monotonic()
+        last_due = 0.0
+
+        async def deliver():
+            try:
+                while True:
+                    due, data = await queue.get()
+                    if data is None:
+                        break
+                    await asyncio.sleep(max(0.0, due - time.monotonic()))
+                    writer.write(data)
+                    await writer.drain()
+            except ConnectionError:
+                pass
+            closed.set()
+
+        delivery = asyncio.ensure_future(deliver())
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                if p.should_disconnect(len(data)):
+                    self.stats.disconnects += 1
+                    logging.info(f'✂️  Link {p.name}: injected disconnect ({direction})')
+                    dropped.set()
+                    closed.set()
+                    return
+
+                lost = p.lost_segments(len(data))
+                self.stats.retransmissions += lost
+                link_free_at = max(link_free_at, time.monotonic()) + p.transmission_delay(len(data))
+                due = link_free_at + p.propagation_delay() + lost * p.loss_penalty_ms / 1000
+                last_due = max(last_due, due)  # TCP keeps the order
+                if direction == 'up':
+                    self.stats.bytes_up += len(data)
+                else:
+                    self.stats.bytes_down += len(data)
+                queue.put_nowait((last_due, data))
+
+            # EOF: flush what is still in flight, then close the connection
+            queue.put_nowait((last_due, None))
+            await delivery
+        except ConnectionError:
+            closed.set()
+        finally:
+            delivery.cancel()
+
+
+class NetEmulator:
+    """
+    Starts all links defined in config_netem.json and logs their counters
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.links = [EmulatedLink(LinkProfile(c)) for c in config['links']]
+        self.stats_interval = float(config.get('stats_interval', 10))
+        random.seed(config.get('seed'))
+
+        log_dir = Path(config.get('log_dir', './metrics'))
+        log_dir.mkdir(parents=True, exist_ok=True)
+        self.csv_file = log_dir / 'netem_stats.csv'
+        self.headers = list(LinkStats('').as_row().keys())
+        if not self.csv_file.exists():
+            with open(self.csv_file, 'w', newline='') as f:
+                csv.DictWriter(f, fieldnames=self.headers).writeheader()
+
+    async def run(self):
+        for link in self.links:
+            await link.start()
+        logging.info(f'📊 Link counters: {self.csv_file}')
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.log_stats()
+
+    def log_stats(self):
+        with open(self.csv_file, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.headers)
+            for link in self.links:
+                writer.writerow(link.stats.as_row())
+        for link in self.links:
+            s = link.stats
+            logging.info(f'📊 {s.name}: conns={s.connections} up={s.bytes_up}B down={s.bytes_down}B '
+                         f'retx={s.retransmissions} disc={s.disconnects} failed={s.failed_connects}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config_file = sys.argv[1] if len(sys.argv) > 1 else set_config_file('netem')
+    emulator = NetEmulator(read_config(config_file))
+    try:
+        asyncio.run(emulator.run())
+    except KeyboardInterrupt:
+        emulator.log_stats()
@@ -0,0 +1,305 @@
+"""
+Harness for local benchmarks of the FL protocol behind net_emulator links.
+
+Starts PseudoDB, a dedicated aggregator and N agents on one Linux box, all
+of them as separate processes, and routes their traffic through the links
+of config_netem.json:
+- every component reaches the DB through the `db_link`
+- agents reach the aggregator through the `aggr_links` (registration and
+  model exchange); the aggregator advertises the links' listen IP and
+  binds only the target IP
+
+Each component runs in its own directory under `run_dir` (setups/ with its
+config and .agent_id, data, models, metrics, logs), so several agents can
+share the box without sharing IDs or files. Agents run in polling mode:
+in push mode the aggregator would connect back to them outside the links.
+Rotation is disabled so the aggregator stays behind its links.
+
+When the aggregator reaches `max_rounds` (or the agents exit, or the
+`duration` runs out) it reports round time, bytes per link and timeouts,
+and writes them to <run_dir>/harness_report.json.
+
+Usage:
+    python -m fl_main.lib.util.net_harness [setups/config_netem.json]
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from fl_main.lib.util.helpers import read_config, set_config_file, write_config
+from fl_main.lib.util.net_emulator import NetEmulator
+
+# Root of deploy_node (code, artifacts and base agent config)
+NODE_ROOT = Path(__file__).resolve().parents[3]
+
+# Log lines counted as timeouts, per component
+TIMEOUT_PATTERNS = {
+    'aggregator': {
+        'barrier_timeouts': 'TIMEOUT: Solo',
+        'skipped_rounds': 'Timeout esperando modelos',
+    },
+    'agent': {
+        'upload_retries': 'not acknowledged',
+        'polling_failures': 'No response received from aggregator',
+        'lost_replies': 'not resending',
+    },
+}
+
+
+class Component:
+    """
+    One process of the harness (DB, aggregator or agent) and its directory
+    """
+
+    def __init__(self, name: str, workdir: Path, module: str, pythonpath: Path):
+        self.name = name
+        self.workdir = workdir
+        self.module = module
+        self.pythonpath = pythonpath
+        self.proc = None
+        self.log_file = None
+
+    def start(self):
+        env = dict(os.environ, PYTHONPATH=str(self.pythonpath), PYTHONUNBUFFERED='1')
+        self.log_file = open(self.workdir / 'harness.log', 'w')
+        self.proc = subprocess.Popen([sys.executable, '-m', self.module], cwd=self.workdir, env=env,
+                                     stdout=self.log_file, stderr=subprocess.STDOUT)
+        logging.info(f'🚀 {self.name}: pid {self.proc.pid} ({self.workdir})')
+
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.running():
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.log_file is not None:
+            self.log_file.close()
+
+    def count(self, pattern: str) -> int:
+        """
+        Occurrences of a pattern in the logs of the component
+        """
+        total = 0
+        for log in [self.workdir / 'harness.log'] + list((self.workdir / 'logs').glob('*.log')):
+            if log.name == 'harness.log' and (self.workdir / 'logs').exists():
+                continue  # same lines as logs/*.log (console handler)
+            try:
+                with open(log, 'r', errors='replace') as f:
+                    total += sum(1 for line in f if pattern in line)
+            except OSError:
+                pass
+        return total
+
+
+class NetHarness:
+    """
+    Lays out the working directories, starts the emulator and the
+    components, and collects the metrics of the run
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        h = config['harness']
+        # Paths are relative to the working directory (deploy_node), like the configs
+        self.run_dir = Path(h.get('run_dir', './netem_run')).resolve()
+        self.db_server_dir = Path(h.get('db_server_dir', '../deploy_db_server')).resolve()
+        self.datasets = [Path(d).resolve() for d in h['datasets']]
+        self.max_rounds = int(h.get('max_rounds', 5))
+        self.duration = float(h.get('duration', 900))
+        self.startup_delay = float(h.get('startup_delay', 3))
+        self.agent_overrides = h.get('agent_config', dict())
+
+        links = {link['name']: link for link in config['links']}
+        self.db_link = links[h.get('db_link', 'agent_db')]
+        self.aggr_links = [links[name] for name in h.get('aggr_links', ['agent_aggr_reg', 'agent_aggr_recv'])]
+        for link in [self.db_link] + self.aggr_links:
+            # The advertised port is the bound one: the proxy must keep it
+            if int(link['listen_port']) != int(link['target_port']):
+                raise ValueError(f"Link {link['name']}: listen_port and target_port must match")
+        if len({link.get('listen_ip', '127.0.0.1') for link in self.aggr_links}) != 1:
+            raise ValueError('All aggr_links must listen on the same IP (the advertised aggregator IP)')
+
+        self.base_agent_config = read_config(set_config_file('agent'))
+        self.components: List[Component] = []
+        self.emulator = None
+        self.agents_started = None
+
+    def _node_config(self) -> Dict[str, Any]:
+        cfg = dict(self.base_agent_config)
+        cfg.update(self.agent_overrides)
+        cfg.update(db_ip=self.db_link.get('listen_ip', '127.0.0.1'), db_port=int(self.db_link['listen_port']),
+                   aggr_ip='', polling=1, rotation_interval=10 ** 6, max_rounds=self.max_rounds)
+        return cfg
+
+    def _node_dir(self, name: str, cfg: Dict[str, Any], dataset: Path = None) -> Path:
+        workdir = self.run_dir / name
+        (workdir / 'setups').mkdir(parents=True, exist_ok=True)
+        (workdir / 'data').mkdir(exist_ok=True)
+        write_config(str(workdir / 'setups' / 'config_agent.json'), cfg)
+        # The node directory mirrors deploy_node: the code resolves data/,
+        # artifacts/ and setups/.agent_id from the location of fl_main
+        for name in ('fl_main', 'artifacts'):
+            (workdir / name).symlink_to(NODE_ROOT / name)
+        if dataset is not None:
+            (workdir / 'data' / 'data.csv').symlink_to(dataset)
+        return workdir
+
+    def setup(self):
+        """
+        Working directories of a fresh run (previous results are removed)
+        """
+        if self.run_dir.exists():
+            shutil.rmtree(self.run_dir)
+        self.run_dir.mkdir(parents=True)
+        self.emulator = NetEmulator(dict(self.config, log_dir=str(self.run_dir / 'metrics')))
+
+        db_dir = self.run_dir / 'db'
+        (db_dir / 'setups').mkdir(parents=True)
+        (db_dir / 'db' / 'models').mkdir(parents=True)
+        db_cfg = read_config(str(self.db_server_dir / 'setups' / 'config_db.json'))
+        db_cfg.update(db_ip=self.db_link.get('target_ip', '127.0.0.1'), db_socket=int(self.db_link['target_port']),
+                      db_data_path='./db', db_model_path='./db/models')
+        write_config(str(db_dir / 'setups' / 'config_db.json'), db_cfg)
+        # Like the nodes: logs/ is resolved from the location of fl_main
+        (db_dir / 'fl_main').symlink_to(self.db_server_dir / 'fl_main')
+        self.components.append(Component('db', db_dir, 'fl_main.pseudodb.pseudo_db', db_dir))
+
+        reg_link = self.aggr_links[0]
+        aggr_cfg = self._node_config()
+        aggr_cfg.update(role='aggregator', device_ip=reg_link.get('listen_ip', '127.0.0.1'),
+                        bind_ip=reg_link.get('target_ip', '127.0.0.1'), reg_socket=int(reg_link['target_port']),
+                        expected_num_agents=len(self.datasets))
+        if len(self.aggr_links) > 1:
+            recv_port = int(self.aggr_links[1]['target_port'])
+            aggr_cfg.update(recv_socket=recv_port, exch_socket=recv_port)
+        aggr_dir = self._node_dir('aggregator', aggr_cfg)
+        self.components.append(Component('aggregator', aggr_dir, 'fl_main.aggregator.server_th', aggr_dir))
+
+        for i, dataset in enumerate(self.datasets, start=1):
+            agent_cfg = self._node_config()
+            agent_cfg.update(role='agent', agent_name=f'agent{i}', reg_socket=int(reg_link['listen_port']))
+            agent_dir = self._node_dir(f'agent{i}', agent_cfg, dataset)
+            self.components.append(Component(f'agent{i}', agent_dir,
+                                             'fl_main.examples.tabular_ncd.tabular_engine', agent_dir))
+
+    async def run(self) -> Dict[str, Any]:
+        self.setup()
+        emulator_task = asyncio.ensure_future(self.emulator.run())
+        start = time.time()
+        try:
+            # DB and aggregator first, so agents find the aggregator announced
+            for component in self.components:
+                if component.name.startswith('agent') and self.agents_started is None:
+                    self.agents_started = datetime.now()
+                component.start()
+                if component.name in ('db', 'aggregator'):
+                    await asyncio.sleep(self.startup_delay)
+
+            while time.time() - start < self.duration:
+                await asyncio.sleep(5)
+                rounds = self._rounds()
+                agents = [c for c in self.components if c.name.startswith('agent')]
+                if rounds and int(rounds[-1]['round']) >= self.max_rounds:
+                    logging.info(f'🏁 Aggregator reached round {self.max_rounds}')
+                    break
+                if not any(c.running() for c in agents):
+                    logging.info('🏁 All agents exited')
+                    break
+                if not self.components[1].running():
+                    logging.warning('⚠️  Aggregator exited')
+                    break
+            else:
+                logging.warning(f'⏱️  Harness duration of {self.duration}s reached')
+        finally:
+            for component in reversed(self.components):
+                component.stop()
+            # Let the proxied connections of the stopped processes wind down
+            await asyncio.sleep(1)
+            emulator_task.cancel()
+            self.emulator.log_stats()
+
+        report = self.report(time.time() - start)
+        with open(self.run_dir / 'harness_report.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def _rounds(self) -> List[Dict[str, str]]:
+        csv_file = self.run_dir / 'aggregator' / 'metrics' / 'metrics_aggregator.csv'
+        try:
+            with open(csv_file, 'r', newline='') as f:
+                return list(csv.DictReader(f))
+        except OSError:
+            return []
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """
+        Round time (from the aggregator metrics), bytes per link (emulator
+        counters) and timeouts (aggregator/agent logs, link disconnects)
+        """
+        rows = self._rounds()
+        stamps = [datetime.fromisoformat(r['timestamp']) for r in rows]
+        # Time between aggregations; the first one counts from the agents' start
+        first_round = (stamps[0] - self.agents_started).total_seconds() if stamps and self.agents_started else None
+        round_times = [(b - a).total_seconds() for a, b in zip(stamps, stamps[1:])]
+
+        links = {link.stats.name: {'bytes_up': link.stats.bytes_up, 'bytes_down': link.stats.bytes_down,
+                                   'connections': link.stats.connections,
+                                   'retransmissions': link.stats.retransmissions,
+                                   'disconnects': link.stats.disconnects,
+                                   'failed_connects': link.stats.failed_connects}
+                 for link in self.emulator.links}
+
+        timeouts = {'link_disconnects': sum(v['disconnects'] for v in links.values()),
+                    'link_failed_connects': sum(v['failed_connects'] for v in links.values())}
+        for component in self.components:
+            kind = 'agent' if component.name.startswith('agent') else component.name
+            for key, pattern in TIMEOUT_PATTERNS.get(kind, dict()).items():
+                timeouts[key] = timeouts.get(key, 0) + component.count(pattern)
+
+        report = {
+            'elapsed': round(elapsed, 1),
+            'agents': len(self.datasets),
+            'rounds': len(stamps),
+            'last_round': int(rows[-1]['round']) if rows else 0,
+            'round_time': {
+                'first': round(first_round, 2) if first_round is not None else None,
+                'mean': round(statistics.mean(round_times), 2) if round_times else None,
+                'median': round(statistics.median(round_times), 2) if round_times else None,
+                'max': round(max(round_times), 2) if round_times else None,
+            },
+            'bytes': {'total': sum(v['bytes_up'] + v['bytes_down'] for v in links.values()), 'links': links},
+            'timeouts': timeouts,
+        }
+        rt = report['round_time']
+        logging.info(f"📊 Rounds: {report['rounds']} in {report['elapsed']}s, round time "
+                     f"first={rt['first']}s mean={rt['mean']}s max={rt['max']}s")
+        logging.info(f"📊 Bytes: {report['bytes']['total']} "
+                     + ', '.join(f"{k}={v['bytes_up'] + v['bytes_down']}" for k, v in links.items()))
+        logging.info(f'📊 Timeouts: {timeouts}')
+        logging.info(f"📄 Report: {self.run_dir / 'harness_report.json'}")
+        return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config_file = sys.argv[1] if len(sys.argv) > 1 else set_config_file('netem')
+    harness = NetHarness(read_config(config_file))
+    try:
+        asyncio.run(harness.run())
+    except KeyboardInterrupt:
+        pass
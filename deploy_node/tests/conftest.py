@@ -0,0 +1,29 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# fl_main is imported from deploy_node, as when the node is started from there
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def agent_dir(tmp_path, monkeypatch):
+    """
+    Working directory of a node with a minimal setups/config_agent.json
+    """
+    (tmp_path / 'setups').mkdir()
+    config = {
+        'aggr_ip': '127.0.0.1',
+        'reg_socket': 8765,
+        'model_path': './data/agents',
+        'local_model_file_name': 'lms.binaryfile',
+        'global_model_file_name': 'gms.binaryfile',
+        'state_file_name': 'state',
+        'init_weights_flag': 1,
+        'polling': 1,
+    }
+    (tmp_path / 'setups' / 'config_agent.json').write_text(json.dumps(config))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
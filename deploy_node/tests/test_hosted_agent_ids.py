@@ -0,0 +1,23 @@
+"""
+Agents hosted in one process (agent_host) register with their own IDs,
+kept across restarts.
+"""
+from fl_main.examples.tabular_ncd.agent_host import HostedAgent
+from fl_main.lib.util.helpers import read_config, set_config_file
+
+
+def test_hosted_agents_get_their_own_ids(agent_dir):
+    cfg = read_config(set_config_file('agent'))
+    a1 = HostedAgent('data/data1.csv', cfg, lead=True)
+    a2 = HostedAgent('data/data2.csv', cfg, lead=False)
+
+    assert a1.client.id != a2.client.id
+    assert (agent_dir / 'data' / 'agents' / 'a1' / '.agent_id').read_text() == a1.client.id
+
+
+def test_hosted_agent_id_is_persisted(agent_dir):
+    cfg = read_config(set_config_file('agent'))
+    first = HostedAgent('data/data1.csv', cfg, lead=True).client.id
+    again = HostedAgent('data/data1.csv', cfg, lead=True).client.id
+
+    assert first == again
@@ -0,0 +1,69 @@
+"""
+Cancelling a stale local training in polling mode: the training agent asks
+the aggregator for its round and fetches the newer global model, which sets
+training_cancel.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+import websockets
+
+import fl_main.agent.client as client_module
+from fl_main.agent.client import Client
+from fl_main.lib.util.communication_handler import receive, send_websocket
+from fl_main.lib.util.messengers import generate_ack_message, generate_cluster_model_dist_message, \
+     generate_round_info_message
+from fl_main.lib.util.states import AgentMsgType, ClientState
+
+
+@pytest.fixture
+def client(agent_dir, monkeypatch):
+    # Keep the agent ID out of the repo's setups directory
+    monkeypatch.setattr(client_module, 'generate_id', lambda: 'agent-under-test')
+    return Client(agent_name='agent1')
+
+
+def run_with_aggregator(client, aggr_round):
+    """
+    Run client.check_round() against an aggregator at round aggr_round
+    """
+    async def handler(websocket, path=None):
+        msg = await receive(websocket)
+        if msg[0] == AgentMsgType.round_query:
+            reply = generate_round_info_message(aggr_round)
+        elif msg[0] == AgentMsgType.polling and aggr_round > msg[1]:
+            models = {'w': np.ones(2, dtype=np.float32)}
+            reply = generate_cluster_model_dist_message('aggregator', 'gm-id', aggr_round, models)
+        else:
+            reply = generate_ack_message()
+        await send_websocket(reply, websocket)
+
+    async def run():
+        async with websockets.serve(handler, '127.0.0.1', 0) as server:
+            client.msend_socket = server.sockets[0].getsockname()[1]
+            await client.check_round()
+
+    asyncio.run(run())
+
+
+def test_training_cancelled_when_aggregator_is_ahead(client):
+    client.round = 1
+    client.tran_state(ClientState.training)
+
+    run_with_aggregator(client, aggr_round=2)
+
+    assert client.training_cancel.is_set()
+    assert client.read_state() == ClientState.gm_ready
+    assert client.round == 2
+
+
+def test_training_kept_when_aggregator_is_on_same_round(client):
+    client.round = 2
+    client.tran_state(ClientState.training)
+
+    run_with_aggregator(client, aggr_round=2)
+
+    assert not client.training_cancel.is_set()
+    assert client.read_state() == ClientState.training
+    assert client.round == 2
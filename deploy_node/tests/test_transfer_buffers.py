@@ -0,0 +1,76 @@
+"""
+Resumable chunked transfers: partial buffers are owned by one connection at
+a time, so identical payloads received concurrently do not interleave, and
+an idempotent request whose reply drops is sent again.
+"""
+import asyncio
+import os
+import pickle
+from hashlib import sha256
+
+import websockets
+
+from fl_main.lib.util.communication_handler import TRANSFER_CHUNK_SIZE, TransferBuffers, \
+     receive, send, send_resumable, send_websocket
+from fl_main.lib.util.states import TransferMsgType
+
+
+def test_concurrent_identical_transfers_do_not_share_a_buffer():
+    payload = os.urandom(8 * TRANSFER_CHUNK_SIZE)
+    received = []
+
+    async def handler(websocket, path=None):
+        received.append(await receive(websocket))
+        await send_websocket(['ok'], websocket)
+
+    async def run():
+        async with websockets.serve(handler, '127.0.0.1', 0, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            return await asyncio.gather(*[send(payload, '127.0.0.1', port) for _ in range(3)])
+
+    replies = asyncio.run(run())
+
+    assert replies == [['ok']] * 3
+    assert received == [payload] * 3
+
+
+def test_released_buffer_is_resumed_by_one_connection():
+    buffers = TransferBuffers()
+    partial = buffers.claim('tid')
+    partial.extend(b'abc')
+    buffers.release('tid', partial)
+
+    first = buffers.claim('tid')
+    second = buffers.claim('tid')
+
+    assert first == b'abc'
+    assert second == b''
+    assert first is not second
+
+
+def test_idempotent_request_is_resent_when_the_reply_drops():
+    reply = ['global models', os.urandom(4 * TRANSFER_CHUNK_SIZE)]
+    payload = pickle.dumps(reply)
+    transfer_id = sha256(payload).hexdigest()
+    connections = []
+
+    async def handler(websocket, path=None):
+        await receive(websocket)
+        connections.append(websocket)
+        if len(connections) == 1:
+            # First reply cut off after one chunk
+            await websocket.send(pickle.dumps([TransferMsgType.header, transfer_id, len(payload)]))
+            await websocket.recv()
+            await websocket.send(payload[:TRANSFER_CHUNK_SIZE])
+            await websocket.recv()
+            return
+        await send_websocket(reply, websocket)
+
+    async def run():
+        async with websockets.serve(handler, '127.0.0.1', 0, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            return await send_resumable(['poll'], '127.0.0.1', port, max_retries=1,
+                                        resend_after_delivery=True)
+
+    assert asyncio.run(run()) == reply
+    assert len(connections) == 2